@@ -0,0 +1,184 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Striped block device over several W25N chips on one SPI bus (RAID-0)
+#  *
+#  * Every chip gets its own NandBdev on the same partition (start, size in erase
+#  * blocks of one chip), logical erase block b lives in erase block b // n of
+#  * chip b % n. Writes reaching the end of an erase block start its write back
+#  * and the write backs of all chips are stepped in turns: the erase or program
+#  * started on one chip runs while the data of the next chip is loaded over the
+#  * bus, so sequential writes scale with the number of chips until the bus is
+#  * saturated. A chip is only written again once its write back is done.
+#  *
+#  *   flash = NandArray([W25N(spi, cs0), W25N(spi, cs1)], start = 256, size = 512)
+#  */
+
+from nandbdev import NandBdev
+
+
+class NandArray:
+    def __init__(self, flashes, blocksize = 512, start = 0, size = 0, cache_size = 131072, stripe = False, readahead = 0, wear = False, debug = False):
+        self.debug = debug
+        self.members = [NandBdev(f, blocksize = blocksize, start = start, size = size, cache_size = cache_size,
+                                 stripe = stripe, readahead = readahead, wear = wear, debug = debug) for f in flashes]
+        self.n = len(self.members)
+        self.blocksize = blocksize
+        self.blockcount = self.members[0].blockcount
+        self.f_blocks = min(m.f_blocks for m in self.members)
+        self.f_size = self.f_blocks * self.n * self.members[0].f_sectorsize
+        # write backs started by the array and not finished, (chip, generator)
+        self._pending = []
+
+#   /* _step(until) -- steps the pending write backs in turns until chip until has none left,
+#    * with until = -1 until all are done
+
+    def _step(self, until = -1):
+        p = self._pending
+        while p:
+            i = 0
+            while i < len(p):
+                try:
+                    next(p[i][1])
+                    i += 1
+                except StopIteration:
+                    p.pop(i)
+            if until >= 0 and not self._waiting(until):
+                return
+
+#   /* _waiting(k) -- True if chip k has a pending write back
+
+    def _waiting(self, k):
+        for (c, _) in self._pending:
+            if c == k:
+                return True
+        return False
+
+#   /* _start(k) -- starts the write back of the dirty slots of chip k, the first step
+#    * (erase of the block) is issued at once
+
+    def _start(self, k):
+        m = self.members[k]
+        for g in m.cache.writebacks(m):
+            try:
+                next(g)
+                self._pending.append((k, g))
+            except StopIteration:
+                pass
+
+#   /* sync() -- writes back the dirty slots of all chips, stepped in turns
+
+    def sync(self):
+        while True:
+            self._pending = [(k, g) for k in range(self.n) for g in self.members[k].cache.writebacks(self.members[k])]
+            if not self._pending:
+                return
+            self._step()
+
+#   /* _io(n, buf, offset, write) -- splits a transfer at the erase blocks and passes the parts to
+#    * the chips. A chip with a pending write back is waited for before it is written, a write
+#    * ending at the end of an erase block starts its write back.
+
+    def _io(self, n, buf, offset, write):
+        buf = memoryview(buf)
+        bs = self.blocksize
+        bpe = self.blockcount
+        n += offset // bs
+        offset %= bs
+        lenght = len(buf)
+        index = 0
+        while index < lenght:
+            sector = n // bpe
+            k = sector % self.n
+            m = self.members[k]
+            chunk = min(lenght - index, (bpe - n % bpe) * bs - offset)
+            mn = sector // self.n * bpe + n % bpe
+            if self.debug:
+                print("{} {} at block {} chip {} block {}".format("write" if write else "read", chunk, n, k, mn))
+            if write:
+                if self._waiting(k):
+                    self._step(k)
+                m.writeblocks(mn, buf[index:index + chunk], offset)
+                if (n % bpe) * bs + offset + chunk == bpe * bs:
+                    self._start(k)
+            else:
+                m.readblocks(mn, buf[index:index + chunk], offset)
+            index += chunk
+            n = (sector + 1) * bpe
+            offset = 0
+
+    def readblocks(self, n, buf, offset = 0):
+        self._io(n, buf, offset, False)
+
+    def writeblocks(self, n, buf, offset = 0):
+        self._io(n, buf, offset, True)
+
+#   /* markerased() -- to be called after all chips were erased outside the driver (bulkErase)
+
+    def markerased(self):
+        for m in self.members:
+            m.markerased()
+
+#   /* stats(reset, enable) -- NandBdev.stats of all chips merged: page reads, programs and erases
+#    * per die of every chip in turn, maxima of the maxima, the other counters summed
+
+    def stats(self, reset = False, enable = None):
+        s = None
+        for m in self.members:
+            t = m.stats(reset, enable)
+            if s is None:
+                s = t
+                continue
+            for key in t:
+                v = t[key]
+                if key in ('reads', 'progs', 'erases'):
+                    s[key] += v
+                elif key in ('wait_count', 'wait_us', 'erase_hist'):
+                    a = s[key]
+                    a.extend([0] * (len(v) - len(a)))
+                    for i in range(len(v)):
+                        a[i] += v[i]
+                elif key == 'wait_max':
+                    s[key] = [max(a, b) for (a, b) in zip(s[key], v)]
+                elif key in ('erase_max', 'wl_max'):
+                    s[key] = max(s[key], v)
+                elif key == 'wl_min':
+                    s[key] = min(s[key], v)
+                else:
+                    s[key] += v
+        s['write_amp'] = s['load_bytes'] / s['write_bytes'] if s['write_bytes'] else 0
+        return s
+
+    def ioctl(self, op, arg):
+        if op == 4:  # MP_BLOCKDEV_IOCTL_BLOCK_COUNT
+            return self.f_size // self.blocksize
+        if op == 5:  # MP_BLOCKDEV_IOCTL_BLOCK_SIZE
+            return self.blocksize
+        if op == 6:  # MP_BLOCKDEV_IOCTL_BLOCK_ERASE
+            sector = arg // self.blockcount
+            self.members[sector % self.n].ioctl(6, sector // self.n * self.blockcount + arg % self.blockcount)
+            return 0
+        if op == 3:
+            self.sync()
+            return 0
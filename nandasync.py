@@ -0,0 +1,142 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * uasyncio interface for W25N and NandBdev
+#  *
+#  * The W25N commands return as soon as the chip accepted them, the wait for a
+#  * busy chip is done before the next command. AsyncW25N awaits that wait, so
+#  * other tasks run while a page is read, programmed or a block erased.
+#  * AsyncNandBdev writes back dirty cache slots and pre-erases free blocks the
+#  * same way. readblocks/writeblocks stay synchronous, as the VFS calls them.
+#  */
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+from nandbdev import NandBdev, _BS_FREE, _BS_ERASED
+
+
+class AsyncW25N:
+    def __init__(self, flash):
+        self.flash = flash
+
+#   /* wait() -- yields until the operation on the selected die is done. Sleeps for the
+#    * expected remaining time, at least one scheduler round per poll.
+
+    async def wait(self):
+        f = self.flash
+        while not f.ready():
+            await asyncio.sleep_ms(f.remaining() // 1000)
+
+    async def pageDataRead(self, pageAdd):
+        self.flash.dieSelectOnAdd(pageAdd)
+        await self.wait()
+        return self.flash.pageDataRead(pageAdd)
+
+    async def read(self, columnAdd, buffer = None, dataLen = None):
+        await self.wait()
+        return self.flash.read(columnAdd, buffer, dataLen)
+
+    async def readPage(self, pageAdd, buffer):
+        await self.pageDataRead(pageAdd)
+        return await self.read(0, buffer)
+
+    async def loadProgData(self, columnAdd, buf, dataLen, pageAdd = None):
+        await self.wait()
+        return self.flash.loadProgData(columnAdd, buf, dataLen, pageAdd)
+
+    async def loadRandProgData(self, columnAdd, buf, dataLen, pageAdd = None):
+        await self.wait()
+        return self.flash.loadRandProgData(columnAdd, buf, dataLen, pageAdd)
+
+    async def ProgramExecute(self, pageAdd):
+        self.flash.dieSelectOnAdd(pageAdd)
+        await self.wait()
+        r = self.flash.ProgramExecute(pageAdd)
+        await self.wait()
+        return r
+
+    async def blockErase(self, pageAdd):
+        self.flash.dieSelectOnAdd(pageAdd)
+        await self.wait()
+        r = self.flash.blockErase(pageAdd)
+        await self.wait()
+        return r
+
+
+class AsyncNandBdev(NandBdev):
+    def __init__(self, flash, *args, **kwargs):
+        super().__init__(flash, *args, **kwargs)
+        self.aflash = AsyncW25N(flash)
+
+#   /* flush() -- writes back every dirty slot, the write backs are stepped in turns like
+#    * NandCache.flush and the die of a slot is awaited before its next step
+
+    async def flush(self):
+        cache = self.cache
+        gens = cache.writebacks(self)
+        slots = [cache.wb.index(g) for g in gens]
+        while gens:
+            i = 0
+            while i < len(gens):
+                self.flash.dieSelectOnAdd(self.slotpage(slots[i]))
+                await self.aflash.wait()
+                try:
+                    next(gens[i])
+                    i += 1
+                except StopIteration:
+                    gens.pop(i)
+                    slots.pop(i)
+            if not gens:
+                gens = cache.writebacks(self)
+                slots = [cache.wb.index(g) for g in gens]
+
+#   /* collect(budget) -- erases up to budget trimmed blocks ahead of use, writes landing
+#    * in them later are programmed without an erase. Returns the number of blocks erased.
+
+    async def collect(self, budget = 8):
+        done = 0
+        for sector in range(self.f_first, self.f_first + self.f_blocks):
+            if done >= budget:
+                break
+            if self.blockstate(sector) != _BS_FREE or self.cached(sector):
+                continue
+            self.flash.dieSelectOnAdd(self._pbase(sector))
+            await self.aflash.wait()
+            if self.blockstate(sector) != _BS_FREE or self.cached(sector):
+                continue
+            self._erase(sector)
+            self.setblockstate(sector, _BS_ERASED)
+            done += 1
+        return done
+
+#   /* flusher(period_ms) -- task that flushes and collects every period_ms, so writes from
+#    * the VFS seldom find a dirty slot to write back inline
+
+    async def flusher(self, period_ms = 500):
+        while True:
+            await asyncio.sleep_ms(period_ms)
+            await self.flush()
+            await self.collect()
@@ -0,0 +1,337 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Bad block management for W25N flash
+#  *
+#  * The last erase blocks of the chip are reserved: two of them hold the bad
+#  * block table (ping pong, the newest sequence number wins), the others are
+#  * spares. The factory bad block markers are scanned once, later mounts only
+#  * read the table pages in the reserved area. A table copy that fails its check
+#  * or ECC (torn by a power loss, worn out) is skipped for the older one.
+#  *
+#  * A bad or failing block (P-FAIL/E-FAIL seen by W25N.checkFail) is replaced
+#  * by a spare, through the bad block LUT of the chip (W25N_BB_MANAGE) while it
+#  * has free links and the spare is on the same die, otherwise through the
+#  * driver map of W25N (W25N._bmap, one dict lookup per command). Pages already
+#  * programmed in a failing block and the page whose program failed are copied
+#  * to the spare, the operation then completes on the spare.
+#  *
+#  * Table page: magic, sequence, block count, map and link counts, bad block
+#  * bitmap, driver map entries, chip LUT links (logical, physical block), check
+#  * of all bytes before it (spareSum).
+#  */
+
+import struct
+import errno
+from micropython import const
+from nandflash import W25N_OP_PROG, W25N_OP_ERASE, W25N_STAT_REG, W25N_STAT_LUTF, W25N_CAP_BBM, W25N_ECC_FAILED, spareSum
+
+_RESERVE    = const(24)     # reserved blocks at the end of the chip, 2 tables and spares
+_MAGIC      = b'BBT1'
+_HDR        = const(16)
+_MARKER_COL = const(0x800)  # factory bad block marker, first byte of the spare area of page 0
+_LUT_ENABLE = const(0x8000)
+_LUT_BLOCK  = const(0x3FFF)  # block address bits, limited to the blocks of a die
+
+
+class NandBBM:
+    def __init__(self, flash, reserve = _RESERVE, debug = False):
+        self.flash = flash
+        self.debug = debug
+        self.busy = False
+        self.ppb = flash.sector_Size() // flash.page_Size()
+        self.nblocks = flash.pages // self.ppb
+        self.dblocks = self.nblocks // flash.dies
+        self.first = self.nblocks - reserve
+        self.bad = bytearray(self.nblocks // 8)
+        self.links = {}
+        self.tables = []
+        self.table = -1
+        self.seq = 0
+        self.remapped = 0
+        self._page = bytearray(flash.page_Size())
+        self._pbuf = bytearray(flash.page_Size() + 64)
+        self._cbuf = bytearray(flash.page_Size() + 64)
+        self._blank = b'\xff' * len(self._cbuf)
+        self._lut = bytearray(4 * flash.lut)
+        flash.size = self.first * flash.sector_Size()
+        flash.bbm = self
+        if not self.load():
+            self.scan()
+
+    def isbad(self, block):
+        return self.bad[block >> 3] & (1 << (block & 7))
+
+    def setbad(self, block):
+        self.bad[block >> 3] |= 1 << (block & 7)
+
+#   /* load() -- reads the newest valid bad block table from the reserved blocks, False if there is none
+
+    def load(self):
+        f = self.flash
+        page = self._page
+        hdr = memoryview(page)[:_HDR]
+        found = []
+        for b in range(self.first, self.nblocks):
+            f.pageDataRead(b * self.ppb)
+            f.read(0, hdr)
+            if page[:4] == _MAGIC:
+                found.append((struct.unpack_from('<I', page, 4)[0], b))
+        found.sort()
+        for i in range(len(found) - 1, -1, -1):
+            if self.valid(found[i][1]):
+                break
+            if self.debug:
+                print("bad block table seq {} at block {} damaged".format(found[i][0], found[i][1]))
+        else:
+            return False
+        # the next save goes after the newest copy found, the damaged one is overwritten first
+        self.seq = found[-1][0]
+        self.table = found[i][1]
+        nb, nmap, nlink = struct.unpack_from('<HHH', page, 8)
+        off = _HDR
+        self.bad[:] = page[off:off + nb // 8]
+        off += nb // 8
+        f._bmap.clear()
+        for i in range(nmap):
+            l, p = struct.unpack_from('<HH', page, off)
+            f._bmap[l] = p
+            off += 4
+        self.links.clear()
+        for i in range(nlink):
+            l, p = struct.unpack_from('<HH', page, off)
+            self.links[l] = p
+            off += 4
+        others = [b for s, b in found if b != self.table]
+        self.tables = [self.table, others[-1] if others else -1]
+        if self.tables[1] < 0:
+            self.tables[1] = self.spare(self.table)
+        if self.debug:
+            print("bad block table seq {} at block {}, {} remapped".format(self.seq, self.table, nmap + nlink))
+        return True
+
+#   /* valid(block) -- reads the table page of block into _page, True if it is readable (ECC) and
+#    * complete: a table of this chip whose check matches
+
+    def valid(self, block):
+        f = self.flash
+        page = self._page
+        f.pageDataRead(block * self.ppb)
+        f.read(0, page)
+        if f.ecc >= W25N_ECC_FAILED:
+            return False
+        nb, nmap, nlink = struct.unpack_from('<HHH', page, 8)
+        end = _HDR + nb // 8 + 4 * (nmap + nlink)
+        if nb != self.nblocks or end + 4 > len(page):
+            return False
+        return struct.unpack_from('>I', page, end)[0] == spareSum(page, end)
+
+#   /* scan() -- builds the table from the factory bad block markers and the LUT of the chip,
+#    * bad blocks of the user area are remapped to spares
+
+    def scan(self):
+        f = self.flash
+        m = memoryview(self._page)[:1]
+        for b in range(self.nblocks):
+            f.pageDataRead(b * self.ppb)
+            f.read(_MARKER_COL, m)
+            if m[0] != 0xFF:
+                self.setbad(b)
+        self.links.clear()
+        lut = self._lut
+        mask = _LUT_BLOCK & (self.dblocks - 1)
+        for die in range(f.dies):
+            if f.dies > 1:
+                f.dieSelect(die)
+            f.readBBM(lut)
+            for i in range(f.lut):
+                l, p = struct.unpack_from('>HH', lut, i * 4)
+                if l & _LUT_ENABLE:
+                    self.links[die * self.dblocks + (l & mask)] = die * self.dblocks + (p & mask)
+        if f.dies > 1:
+            f.dieSelect(0)
+        self.tables = []
+        self.tables.append(self.spare(self.first))
+        self.tables.append(self.spare(self.first))
+        self.busy = True
+        try:
+            for b in range(self.first):
+                if self.isbad(b) and b not in f._bmap and b not in self.links:
+                    self.replace(b, W25N_OP_ERASE, 0)
+        finally:
+            self.busy = False
+        self.save()
+        if self.debug:
+            print("bad block scan, {} bad blocks".format(sum(bin(x).count('1') for x in self.bad)))
+
+#   /* spare(near) -- a free reserved block, on the die of block near if there is one, -1 if none left
+
+    def spare(self, near):
+        used = set(self.flash._bmap.values())
+        used.update(self.links.values())
+        used.update(self.tables)
+        found = -1
+        for b in range(self.first, self.nblocks):
+            if self.isbad(b) or b in used:
+                continue
+            if b // self.dblocks == near // self.dblocks:
+                return b
+            if found < 0:
+                found = b
+        return found
+
+#   /* failed(op, pageAdd) -- called by W25N.checkFail with the page of a failed program or erase
+
+    def failed(self, op, pageAdd):
+        block = pageAdd // self.ppb
+        if block >= self.first:
+            raise OSError(errno.EIO)
+        self.busy = True
+        try:
+            if op == W25N_OP_PROG:
+                # the data of the failed page is still in the data buffer of the die
+                self.flash.read(0, self._pbuf)
+            self.replace(block, op, pageAdd % self.ppb)
+        finally:
+            self.busy = False
+        self.save()
+
+#   /* replace(block, op, page) -- moves block to a spare: for a failed program the other pages
+#    * are copied (blocks are appended to by partial page programs, pages after page may hold
+#    * data) and the failed page is programmed from _pbuf merged with its programmed sectors.
+#    * Failing spares are marked bad and the next one is tried.
+
+    def replace(self, block, op, page):
+        f = self.flash
+        ppb = self.ppb
+        old = f._bmap.get(block, self.links.get(block, block))
+        self.setbad(old)
+        while True:
+            s = self.spare(old)
+            if s < 0:
+                raise OSError(errno.ENOSPC)
+            try:
+                f.blockErase(s * ppb)
+                f.block_WIP()
+                if op == W25N_OP_PROG:
+                    for i in range(ppb):
+                        if i != page:
+                            self.copy(block * ppb + i, s * ppb + i)
+                    self.merge(block * ppb + page)
+                    f.loadProgData(0, self._pbuf, len(self._pbuf), s * ppb + page)
+                    f.ProgramExecute(s * ppb + page)
+                    f.block_WIP()
+                break
+            except OSError as e:
+                if e.args[0] != errno.EIO:
+                    raise
+                self.setbad(s)
+        self.link(block, s)
+        self.remapped += 1
+        if self.debug:
+            print("bad block {} replaced by {}".format(block, s))
+
+#   /* copy(src, dst) -- copies a page with its spare area inside the chip, through RAM across dies.
+#    * Erased pages are not copied, dst stays erased for later partial programs.
+
+    def copy(self, src, dst):
+        f = self.flash
+        f.pageDataRead(src)
+        f.read(0, self._cbuf)
+        if self._cbuf == self._blank:
+            return
+        if f.dieOnAdd(src) != f.dieOnAdd(dst):
+            f.loadProgData(0, self._cbuf, len(self._cbuf), dst)
+        f.ProgramExecute(dst)
+        f.block_WIP()
+
+#   /* merge(src) -- fills the 512 byte sectors of _pbuf that were not programmed (all 0xFF) from page src
+
+    def merge(self, src):
+        f = self.flash
+        f.pageDataRead(src)
+        f.read(0, self._cbuf)
+        blank = self._blank
+        for k in range(0, len(self._page), 512):
+            if self._pbuf[k:k + 512] == blank[:512]:
+                self._pbuf[k:k + 512] = self._cbuf[k:k + 512]
+
+#   /* link(block, spare) -- makes accesses to block go to spare, in the chip LUT when possible
+
+    def link(self, block, spare):
+        f = self.flash
+        die = block // self.dblocks
+        if block not in f._bmap and block not in self.links and spare // self.dblocks == die:
+            n = 0
+            for l in self.links:
+                if l // self.dblocks == die:
+                    n += 1
+            f.dieSelectOnAdd(block * self.ppb)
+            f.block_WIP()
+            if f.caps & W25N_CAP_BBM and n < f.lut and not f.getStatusReg(W25N_STAT_REG) & W25N_STAT_LUTF:
+                f.linkBlock(block % self.dblocks, spare % self.dblocks)
+                f.block_WIP()
+                self.links[block] = spare
+                return
+        f._bmap[block] = spare
+
+#   /* save() -- writes the table to the table block not holding the newest copy
+
+    def save(self):
+        f = self.flash
+        page = self._page
+        self.busy = True
+        try:
+            while True:
+                t = self.tables[0] if self.tables[0] != self.table else self.tables[1]
+                for i in range(len(page)):
+                    page[i] = 0xFF
+                page[0:4] = _MAGIC
+                struct.pack_into('<IHHH', page, 4, self.seq + 1, self.nblocks, len(f._bmap), len(self.links))
+                off = _HDR
+                page[off:off + len(self.bad)] = self.bad
+                off += len(self.bad)
+                for m in (f._bmap, self.links):
+                    for l in m:
+                        struct.pack_into('<HH', page, off, l, m[l])
+                        off += 4
+                struct.pack_into('>I', page, off, spareSum(page, off))
+                try:
+                    f.blockErase(t * self.ppb)
+                    f.loadProgData(0, page, len(page), t * self.ppb)
+                    f.ProgramExecute(t * self.ppb)
+                    f.block_WIP()
+                    break
+                except OSError as e:
+                    if e.args[0] != errno.EIO:
+                        raise
+                    self.setbad(t)
+                    n = self.spare(t)
+                    if n < 0:
+                        raise OSError(errno.ENOSPC)
+                    self.tables[self.tables.index(t)] = n
+        finally:
+            self.busy = False
+        self.seq += 1
+        self.table = t
@@ -22,12 +22,48 @@
 #
 
 from pyb import Timer
+from micropython import const
+from array import array
+import micropython
+import time
+from nandcache import NandCache, PG_VALID, PG_DIRTY
+from nandflash import W25N_SPARE_USER, spareSum
+
+# erase block states, 2 bits per block
+_BS_USED    = const(0)   # holds data or unknown
+_BS_FREE    = const(1)   # all sectors trimmed, contents don't matter
+_BS_ERASED  = const(2)   # erased on flash and not programmed since
+
+# tags in the spare user bytes (W25N.readSpare/loadSpare, four 4 byte fields), the last field is the check
+# of the first three (spareSum). Copy back mode, tag of the last scratch page: magic and erase block,
+# bitmap of the copied pages in fields 1 and 2
+_TAG_CHECK  = const(12)
+_CB_MAGIC   = const(0x4342)
+
+# wear leveling, tag of the first page of every erase block written: magic and logical erase block,
+# erase count and sequence number
+_WL_MAGIC   = const(0x574C)
+_WL_SPARE   = const(4)     # erase blocks reserved for relocation
+_WL_CHECK   = const(16)    # relocations between two static wear leveling checks
+_WL_DELTA   = const(64)    # erase count difference that moves cold data to a worn block
+_WL_NONE    = const(0xFFFF)
+
+_RA_STREAMS = const(2)   # sequential read streams tracked for read ahead
+_ER_BLOCKS  = const(32)  # erase blocks with a map of erased blocks kept for partial page programs
+_SC_PAGES   = const(4)   # pages loaded per background step of a scrub
+
+# background work step results
+_BG_NONE    = const(0)   # nothing to do
+_BG_STEP    = const(1)   # a write back step or an erase was issued
+_BG_WAIT    = const(2)   # the die is busy for longer than the time left
 
 class NandBdev:
-    def __init__(self,flash, blocksize = 512, start = 0, size = 0, debug = False):
+    def __init__(self,flash, blocksize = 512, start = 0, size = 0, cache_size = 131072, stripe = False, readahead = 0, wear = False, debug = False, cache = None, lock = None):
         self.debug = debug
         self.flash = flash
         self.write_count = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
         self.blocksize = blocksize
         self.f_sectorsize =  flash.sector_Size()
         self.f_start = start * self.f_sectorsize // blocksize
@@ -39,148 +75,1405 @@ class NandBdev:
             self.f_size = size * self.f_sectorsize
         self.f_sectorpages =  self.f_sectorsize // self.f_pagesize
         self.pagerel = self.blockcount // self.f_sectorpages
-        self.bl_arr = bytearray(self.f_sectorsize)
-        self.bl_mem = memoryview(self.bl_arr)
+        self._span = span = self.f_size // self.f_sectorsize
+        # a cache smaller than an erase block holds single pages, erase blocks are then
+        # rewritten by copy back inside the chip through a scratch block (last block of the partition).
+        # A cache given by the caller is shared with other partitions of the chip (see nandpart.py),
+        # its slot size selects the mode and lock serialises the block device calls of the partitions.
+        if cache is not None:
+            cache_size = cache.sectorsize * cache.nslots
+        self.copyback = (cache.sectorsize if cache is not None else cache_size) < self.f_sectorsize
+        self._spp = 1 if self.copyback else self.f_sectorpages
+        self.cache = cache if cache is not None else NandCache(cache_size, self._spp * self.f_pagesize, self.f_pagesize)
+        self.lock = lock
+        if self.copyback:
+            self.f_size -= self.f_sectorsize
+        # wear leveling (block cache only), _WL_SPARE erase blocks at the end of the partition are kept free
+        self.wear = wear and not self.copyback
+        if self.wear:
+            self.f_size -= _WL_SPARE * self.f_sectorsize
         self.pg_arr = bytearray(self.f_pagesize)
         self.pg_mem = memoryview(self.pg_arr)
-        self.curr_sector = start
         self.curr_page = -1
-        self.readfsector(start)
-        
+        self.f_first = start
+        self.f_blocks = self.f_size // self.f_sectorsize
+        self._bstate = bytearray((self.f_blocks + 3) // 4)
+        self._trim = {}
+        self._alltrim = b'\xff' * (self.blockcount // 8)
+        self._notrim = bytes(self.blockcount // 8)
+        self._ff = memoryview(b'\xff' * self.f_pagesize)
+        # partial page programs: blocks known to be erased on flash (bit per block of every page) for
+        # up to _ER_BLOCKS erase blocks, blocks written to them are programmed without an erase.
+        # Every ECC sector is programmed once, so a page takes at most pagerel partial programs.
+        self._fullmask = (1 << self.pagerel) - 1
+        self.nop = self.pagerel <= flash.nop and blocksize % 512 == 0
+        self._erased = {}
+        # data rewritten unchanged (blocks) and pages not programmed, holding no data or only 0xFF
+        self.skip_blocks = 0
+        self.skip_pages = 0
+        # striped layout on multi die chips: the partition is split in two halves on neighbouring dies,
+        # even erase blocks (relative to start) go to the first half and odd ones to the second
+        self._stripe = stripe and flash.dies > 1
+        self._half = span // 2
+        if self._stripe:
+            dblocks = flash.diepages // self.f_sectorpages
+            d = start // dblocks
+            mid = start + self._half
+            if span & 1 or (mid - 1) // dblocks != d or mid // dblocks != d + 1 or (start + span - 1) // dblocks != d + 1:
+                raise ValueError("striped partition must have the same number of blocks on two dies")
+        self._scratch = self.f_first + self.f_blocks
+        self._cbslot = -1
+        self._cbmoved = -1
+        self._cbtag = bytearray(W25N_SPARE_USER)
+        self._cbmask = array('H', [0] * self.f_sectorpages)
+        if self.copyback:
+            self._cbrecover()
+        # wear leveling: logical erase block -> physical erase block (index in the partition), the reverse
+        # map, erase count per physical block and the free physical blocks, rebuilt from the tags at mount
+        self.wl_relocs = 0
+        self.wl_moves = 0
+        if self.wear:
+            nphys = self.f_blocks + _WL_SPARE
+            self._l2p = array('H', [_WL_NONE] * self.f_blocks)
+            self._p2l = array('H', [_WL_NONE] * nphys)
+            self.wl_counts = array('i', [0] * nphys)
+            self._wlfree = []
+            self._wlseq = 0
+            self._wlmount()
+        # read ahead: a ring of readahead prefetched pages per stream, holding the logical pages
+        # ra_first to ra_first + ra_count - 1 (page p in entry p % readahead), refilled for sequential
+        # streams, plus a page data read issued for the page after the ring. With background work on
+        # the ring is filled by idle() while ra_fill is set, ra_last is the page counted last per stream.
+        self.readahead = readahead
+        self.ra_arr = bytearray(_RA_STREAMS * readahead * self.f_pagesize)
+        self.ra_mem = memoryview(self.ra_arr)
+        self.ra_first = array('i', [-1] * _RA_STREAMS)
+        self.ra_count = array('i', [0] * _RA_STREAMS)
+        self.ra_next = array('i', [-1] * _RA_STREAMS)
+        self.ra_run = array('i', [0] * _RA_STREAMS)
+        self.ra_hits = array('i', [0] * _RA_STREAMS)
+        self.ra_misses = array('i', [0] * _RA_STREAMS)
+        self.ra_age = array('i', [0] * _RA_STREAMS)
+        self.ra_fill = bytearray(_RA_STREAMS)
+        self.ra_last = array('i', [-1] * _RA_STREAMS)
+        self._ratick = 0
+        # background write back (see background()), _busy counts the block device calls in progress
+        self.idle_ms = 0
+        self.slice_us = 0
+        self._busy = 0
+        self._lastio = time.ticks_ms()
+        self._bgdone = False
+        self._bgsector = self.f_first
+        self._timer = None
+        self._idleref = self.idle
+        self.bg_writebacks = 0
+        self.bg_erases = 0
+        self.bg_error = None
+        # scrubbing (see scrub()): the block being loaded for its refresh, the next page of the patrol
+        # reads and the patrol reads left in the current idle() call
+        self.scrub_threshold = 0
+        self.scrub_patrol = 0
+        self.scrub_blocks = 0
+        self.patrol_pages = 0
+        self._scslot = -1
+        self._scsector = -1
+        self._ptpage = 0
+        self._ptleft = 0
+
+#   /* _pbase(sector) -- first flash page of erase block sector
+
+    def _pbase(self, sector):
+        if sector == self._cbmoved:
+            sector = self._scratch
+        elif self.wear:
+            sector = self.f_first + self._l2p[sector - self.f_first]
+        return self._physbase(sector)
+
+#   /* _physbase(sector) -- first flash page of physical erase block sector (wear leveling and copy back ignored)
+
+    def _physbase(self, sector):
+        if self._stripe:
+            rel = sector - self.f_first
+            sector = self.f_first + (rel >> 1) + (rel & 1) * self._half
+        return sector * self.f_sectorpages
+
+#   /* physblocks() -- (first, end) of the flash erase blocks the partition programs and erases, data,
+#    * copy back scratch block and wear leveling spares included, striped or not
+
+    def physblocks(self):
+        return (self.f_first, self.f_first + self._span)
+
+#   /* _erase(sector) -- erases erase block sector in place and counts the erase for wear leveling
+
+    def _erase(self, sector):
+        self.flash.blockErase(self._pbase(sector))
+        if self.wear:
+            self.wl_counts[self._l2p[sector - self.f_first]] += 1
+
+#   /* blockstate(sector) / setblockstate(sector, state) -- erased/free/in use index of the erase blocks
+
+    def blockstate(self, sector):
+        i = sector - self.f_first
+        return (self._bstate[i >> 2] >> ((i & 3) << 1)) & 3
+
+    def setblockstate(self, sector, state):
+        if state == _BS_ERASED:
+            self._erased.pop(sector, None)
+        i = sector - self.f_first
+        sh = (i & 3) << 1
+        self._bstate[i >> 2] = (self._bstate[i >> 2] & ~(3 << sh)) | (state << sh)
+
+#   /* markerased() -- to be called after the partition was erased outside the driver (bulkErase)
+
+    def markerased(self):
+        for i in range(len(self._bstate)):
+            self._bstate[i] = 0xAA
+        self._trim = {}
+        self._erased = {}
+        if self.wear:
+            for p in range(len(self.wl_counts)):
+                self.wl_counts[p] += 1
+
+#   /* trim(n) -- records that block n (partition absolute) was freed by the filesystem.
+#    * Blocks are tracked per erase block in a small bitmap until every block of the
+#    * erase block is trimmed, the erase block is then marked free and its cache slot dropped.
+
+    def trim(self, n):
+        sector = n // self.blockcount
+        bits = self._trim.get(sector)
+        if bits is None:
+            if self.blockstate(sector) != _BS_USED:
+                return
+            bits = bytearray(self.blockcount // 8)
+            self._trim[sector] = bits
+        i = n % self.blockcount
+        bits[i >> 3] |= 1 << (i & 7)
+        if bits == self._alltrim:
+            del self._trim[sector]
+            if self.blockstate(sector) == _BS_USED:
+                self.setblockstate(sector, _BS_FREE)
+            cache = self.cache
+            lo = sector * self.f_sectorpages // self._spp
+            hi = lo + self.f_sectorpages // self._spp
+            for slot in range(cache.nslots):
+                if lo <= cache.sector[slot] < hi:
+                    cache.discard(slot)
+            self._invalidate(sector)
+
+#   /* untrim(n, count) -- blocks written again are no longer free
+
+    def untrim(self, n, count):
+        sector = n // self.blockcount
+        bits = self._trim.get(sector)
+        if bits is None:
+            if self.blockstate(sector) == _BS_USED:
+                return
+            bits = bytearray(self._alltrim)
+            self._trim[sector] = bits
+        for i in range(n % self.blockcount, min(n % self.blockcount + count, self.blockcount)):
+            bits[i >> 3] &= ~(1 << (i & 7))
+        if bits == self._notrim and self.blockstate(sector) == _BS_USED:
+            del self._trim[sector]
+
+#   /* pagefree(sector, page) -- True if no sector of the page holds data
+
+    def pagefree(self, sector, page):
+        if self.blockstate(sector) != _BS_USED:
+            return True
+        bits = self._trim.get(sector)
+        if bits is None:
+            return False
+        for i in range(page * self.pagerel, (page + 1) * self.pagerel):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+#   /* livemask(sector, page) -- bit per block of the page that holds data
+
+    def livemask(self, sector, page):
+        if self.blockstate(sector) != _BS_USED:
+            return 0
+        bits = self._trim.get(sector)
+        if bits is None:
+            return self._fullmask
+        mask = 0
+        n = page * self.pagerel
+        for b in range(self.pagerel):
+            if not bits[(n + b) >> 3] & (1 << ((n + b) & 7)):
+                mask |= 1 << b
+        return mask
+
+#   /* erasedmask(sector, page) -- bit per block of the page known to be erased on flash
+
+    def erasedmask(self, sector, page):
+        if self.blockstate(sector) == _BS_ERASED:
+            return self._fullmask
+        e = self._erased.get(sector)
+        return e[page] if e is not None else 0
+
+#   /* _erasedmap(sector, fresh) -- the map of erased blocks of sector, reset to all erased if
+#    * fresh (the block was just erased). None if nothing is known about the block.
+
+    def _erasedmap(self, sector, fresh):
+        e = self._erased.get(sector)
+        if e is None:
+            if not fresh and self.blockstate(sector) != _BS_ERASED:
+                return None
+            if len(self._erased) >= _ER_BLOCKS:
+                self._erased.popitem()
+            e = array('H', [self._fullmask] * self.f_sectorpages)
+            self._erased[sector] = e
+        elif fresh:
+            for i in range(self.f_sectorpages):
+                e[i] = self._fullmask
+        return e
+
+#   /* _blankmask(mv, mask) -- the blocks in mask of page data mv that are all 0xFF
+
+    def _blankmask(self, mv, mask):
+        ff = self._ff
+        bs = self.blocksize
+        blank = 0
+        for b in range(self.pagerel):
+            if mask & (1 << b) and mv[b * bs:(b + 1) * bs] == ff[b * bs:(b + 1) * bs]:
+                blank |= 1 << b
+        return blank
+
+#   /* _program(mv, page, mask, tag) -- programs the blocks in mask of page from mv, a partial page
+#    * program leaves the other blocks erased. With tag the wear leveling tag is added to the spare area.
+
+    def _program(self, mv, page, mask, tag = False):
+        f = self.flash
+        if mask == self._fullmask:
+            f.loadProgData(0, mv, self.f_pagesize, page)
+        elif mask:
+            bs = self.blocksize
+            load = f.loadProgData
+            for b in range(self.pagerel):
+                if mask & (1 << b):
+                    load(b * bs, mv[b * bs:(b + 1) * bs], bs, page)
+                    load = f.loadRandProgData
+        if tag:
+            self._cbtagload(mask != 0, page)
+        f.ProgramExecute(page)
+
+#   /* cachedpage(slot, page) -- returns the cache memory of a page of slot,
+#    * the page is read from flash the first time it is used, free pages are not read.
+#    * Blocks of the page already written to the slot (cache.mask) are kept.
+
+    def cachedpage(self, slot, page):
+        cache = self.cache
+        mv = cache.pagemem(slot, page)
+        i = slot * self._spp + page
+        if not cache.flags[i] & PG_VALID:
+            lpage = cache.sector[slot] * self._spp + page
+            sector = lpage // self.f_sectorpages
+            page = lpage % self.f_sectorpages
+            mask = cache.mask[i]
+            if self.pagefree(sector, page):
+                src = self._ff
+            elif mask:
+                self.flash.pageDataRead(self._pbase(sector) + page)
+                self.flash.read(0, self.pg_mem)
+                self.curr_page = lpage
+                src = self.pg_mem
+            else:
+                self.flash.pageDataRead(self._pbase(sector) + page)
+                self.flash.read(0, mv)
+                src = None
+            if src is not None:
+                bs = self.blocksize
+                for b in range(self.pagerel):
+                    if not mask & (1 << b):
+                        mv[b * bs:(b + 1) * bs] = src[b * bs:(b + 1) * bs]
+            cache.flags[i] |= PG_VALID
+        return mv
+
+#   /* readblocks(n, buf, offset) -- pages held in the cache are copied from RAM (dirty data included),
+#    * then pages in the read ahead ring. Runs of whole pages of an erase block are read from flash
+#    * straight into buf with one readPages call, partial pages at the head and tail go through
+#    * the pg_mem staging page. A read continuing a stream refills the read ahead ring (with background
+#    * work on idle() fills it). ra_hits / ra_misses count each page of a read once.
 
     def readblocks(self, n, buf, offset = 0):
+        self._enter()
+        self.read_bytes += len(buf)
+        try:
+            self._readblocks(n, buf, offset)
+        finally:
+            self._leave()
+
+    def _readblocks(self, n, buf, offset):
         buf = memoryview(buf)
         n +=  self.f_start
-        bs = self.blocksize
+        ps = self.f_pagesize
+        ppb = self.f_sectorpages
+        spp = self._spp
+        cache = self.cache
         lenght = len(buf)
+        addr = n * self.blocksize + offset
         index = 0
+        stream = self._rastream(addr) if self.readahead else -1
+        hits = 0
+        misses = 0
+        last = self.ra_last[stream] if stream >= 0 else -1
         
         if self.debug:
-            f_sector = n // self.blockcount
-            address = (n * bs) + offset
-            print("read {} at {} sector {} block {} offset {}".format(lenght,address,f_sector,n,offset))
+            print("read {} at {} sector {} block {} offset {}".format(lenght,addr,n // self.blockcount,n,offset))
         
-        #####################    read page   #################################
-        if 0:#lenght >= self.f_pagesize:
-            bs = self.f_pagesize
-            while lenght >= bs:
-                pbuf = buf[index:index + bs - offset]
-                f_sector = n // self.blockcount
-                if f_sector == self.curr_sector:
-                    addr = (n % self.blockcount) * self.blocksize
-                    if addr + offset > self.f_sectorsize - self.f_pagesize:
-                        print("read page overflow")
+        while index < lenght:
+            f_page, col = (addr // ps, addr % ps)
+            chunk = min(ps - col, lenght - index)
+            slot = cache.find(f_page // spp)
+            r = self._ring(f_page) if stream >= 0 else -1
+            if slot >= 0:
+                mv = self.cachedpage(slot, f_page % spp)
+                buf[index:index + chunk] = mv[col:col + chunk]
+            elif r >= 0:
+                r += col
+                buf[index:index + chunk] = self.ra_mem[r:r + chunk]
+                if f_page != last:
+                    hits += 1
+            elif chunk == ps:
+                f_sector = f_page // ppb
+                count = 1
+                limit = min((lenght - index) // ps, ppb - f_page % ppb)
+                while count < limit and cache.peek((f_page + count) // spp) < 0:
+                    if stream >= 0 and self._ring(f_page + count) >= 0:
                         break
-                    mv = self.bl_mem
-                    pbuf[:] = mv[addr + offset:addr + bs]
+                    count += 1
+                chunk = count * ps
+                if count == 1:
+                    if self._readpage(f_page, buf[index:index + chunk]):
+                        hits += 1
+                    elif f_page != last:
+                        misses += 1
                 else:
-                    f_page, f_offset = (n // self.pagerel, n % self.pagerel)
-                    f_offset = (f_offset * self.blocksize) + offset
-                    self.flash.pageDataRead(f_page)
-                    self.flash.read(f_offset, buffer =  pbuf)
-                index += (bs - offset)
-                n += self.f_pagesize // self.blocksize
-                lenght -= (bs - offset)
-                offset = 0
-        ###################    read block   ################################
-        if lenght >= self.blocksize:
-            bs = self.blocksize
-            while lenght >= bs:
-                pbuf = buf[index:index + bs- offset]
-                f_sector = n // self.blockcount
-                if f_sector == self.curr_sector:
-                    addr =  (n % self.blockcount) * bs 
-                    mv = self.bl_mem
-                    pbuf[:] = mv[addr + offset:addr + bs]
-                else:
-                    f_page, f_offset = (n // self.pagerel, n % self.pagerel)
-                    f_offset = (f_offset * bs) + offset
-                    if f_page != self.curr_page:
-                        self.flash.pageDataRead(f_page)
-                        self.flash.read(0, self.pg_mem)
-                        self.curr_page = f_page
-                    mv = self.pg_mem
-                    pbuf[:] = mv[f_offset:f_offset+ bs]
-                index += (bs - offset)
-                n += 1
-                lenght -= (bs - offset)
-                offset = 0
-            
-        #####################  read bytes ################################   
-        if lenght > 0:
-            pbuf = buf[index:]
-            f_sector, addr = (n // self.blockcount, n % self.blockcount)
-            addr *= bs
-            if f_sector == self.curr_sector:
-                mv = self.bl_mem
-                pbuf[:] = mv[addr + offset: addr + offset + lenght]
+                    self.flash.readPages(self._pbase(f_sector) + f_page % ppb, count, buf[index:index + chunk])
+                    misses += count
             else:
-                f_page, f_offset = (n // self.pagerel, n % self.pagerel)
-                f_offset = (f_offset * bs) + offset
                 if f_page != self.curr_page:
-                    self.flash.pageDataRead(f_page)
-                    self.flash.read(0, self.pg_mem)
+                    if self._readpage(f_page, self.pg_mem):
+                        hits += 1
+                    elif f_page != last:
+                        misses += 1
                     self.curr_page = f_page
-                mv = self.pg_mem
-                pbuf[:] = mv[f_offset:f_offset+ lenght]
+                buf[index:index + chunk] = self.pg_mem[col:col + chunk]
+            index += chunk
+            addr += chunk
+            last = (addr - 1) // ps
+        if stream >= 0:
+            self.ra_hits[stream] += hits
+            self.ra_misses[stream] += misses
+            self.ra_last[stream] = last
+            self.ra_next[stream] = addr
+            if self.ra_run[stream]:
+                if self.idle_ms:
+                    self._raslide(stream, addr // ps)
+                else:
+                    self.prefetch(stream, addr // ps)
+
+#   /* _readpage(f_page, dst) -- reads logical page f_page into dst, without a page data read if the
+#    * chip buffer holds it already (prefetched). Returns True in that case.
+
+    def _readpage(self, f_page, dst):
+        f = self.flash
+        p = self._pbase(f_page // self.f_sectorpages) + f_page % self.f_sectorpages
+        hit = f.buffered(p)
+        if hit:
+            f.dieSelectOnAdd(p)
+        else:
+            f.pageDataRead(p)
+        f.read(0, dst)
+        return hit
+
+#   /* _rastream(addr) -- the read stream a read at byte address addr continues (same or next page
+#    * as the end of its last read), else the stream with the shortest run (least recently used of
+#    * equal ones) is restarted. The runs of the other streams are halved, so ended streams age out.
+
+    def _rastream(self, addr):
+        ps = self.f_pagesize
+        page = addr // ps
+        self._ratick += 1
+        victim = 0
+        for s in range(_RA_STREAMS):
+            nxt = self.ra_next[s]
+            if nxt > 0 and 0 <= page - (nxt - 1) // ps <= 1:
+                self.ra_run[s] += 1
+                self.ra_age[s] = self._ratick
+                return s
+            run = self.ra_run[s]
+            if run < self.ra_run[victim] or (run == self.ra_run[victim] and self.ra_age[s] < self.ra_age[victim]):
+                victim = s
+        for s in range(_RA_STREAMS):
+            self.ra_run[s] >>= 1
+        self.ra_run[victim] = 0
+        self.ra_age[victim] = self._ratick
+        return victim
+
+#   /* _enter() / _leave() -- start and end of a block device call, the shared lock is held in between.
+#    * _leave restarts the idle time and the background work
+
+    def _enter(self):
+        if self.lock is not None:
+            self.lock.acquire()
+        self._busy += 1
+
+    def _leave(self):
+        self._busy -= 1
+        self._lastio = time.ticks_ms()
+        self._bgdone = False
+        if self.lock is not None:
+            self.lock.release()
+
+#   /* background(idle_ms, period_ms, slice_ms, timer) -- starts the background write back, idle_ms = 0
+#    * stops it. Timer timer fires every period_ms and schedules idle(), which writes back dirty slots
+#    * and erases free blocks for up to slice_ms once no block device call was made for idle_ms.
+#    * timer = None sets up the work without a timer, idle() is then called by the owner (partitions
+#    * sharing a lock run from the one timer of NandPartitions.background).
+
+    def background(self, idle_ms = 100, period_ms = 10, slice_ms = 2, timer = 6):
+        if idle_ms > 0 and timer is not None and self.lock is not None:
+            raise ValueError("shared partitions run from NandPartitions.background")
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        self.idle_ms = idle_ms
+        self.slice_us = slice_ms * 1000
+        if idle_ms > 0 and timer is not None:
+            self._timer = Timer(timer, freq = max(1, 1000 // period_ms), callback = self._tick)
+
+    def _tick(self, t):
+        try:
+            micropython.schedule(self._idleref, 0)
+        except RuntimeError:
+            pass
+
+#   /* idle(_) -- background work for one time slice, run through micropython.schedule or called from
+#    * a task or a thread. Skipped during a block device call (of any partition sharing the lock) and
+#    * until the device was idle for idle_ms.
+#    * Read ahead rings of sequential streams are filled first, without waiting for idle_ms.
+#    * Advances the write back of dirty slots one erase or program at a time, else the scrub of a
+#    * block (see scrub()), else erases free blocks ahead of use, else makes the patrol reads.
+#    * It only waits on a busy die when the operation ends within the slice.
+#    * Returns True if there was work to do. An error stops the background work and is kept in bg_error.
+
+    def idle(self, _ = None):
+        if self._busy or self._bgdone:
+            return False
+        quiet = time.ticks_diff(time.ticks_ms(), self._lastio) >= self.idle_ms
+        if not quiet and not any(self.ra_fill):
+            return False
+        if self.lock is not None and not self.lock.acquire(0):
+            return False
+        self._busy += 1
+        self._ptleft = self.scrub_patrol
+        start = time.ticks_us()
+        try:
+            while True:
+                left = self.slice_us - time.ticks_diff(time.ticks_us(), start)
+                step = self._idlestep(left, quiet)
+                if step != _BG_STEP or left <= 0:
+                    break
+            self._bgdone = step == _BG_NONE and quiet
+            return step != _BG_NONE
+        except OSError as e:
+            self.bg_error = e
+            self.background(0)
+            return False
+        finally:
+            self._busy -= 1
+            if self.lock is not None:
+                self.lock.release()
+
+#   /* _idlestep(left, quiet) -- one read ahead step, or once the device is quiet (idle for idle_ms) one
+#    * write back step, scrub step, pre-erase or patrol read, _BG_WAIT if the die stays busy for longer
+#    * than left us (or the patrol reads of this call are done)
+
+    def _idlestep(self, left, quiet = True):
+        cache = self.cache
+        f = self.flash
+        if self.readahead:
+            step = self._rastep(left)
+            if step != _BG_NONE:
+                return step
+        if not quiet:
+            return _BG_NONE
+        for slot in range(cache.nslots):
+            if cache.owner[slot] is self and (cache.dirty[slot] or cache.wb[slot] is not None):
+                f.dieSelectOnAdd(self.slotpage(slot))
+                if not f.ready() and f.remaining() >= left:
+                    return _BG_WAIT
+                wb = cache.wb[slot]
+                if wb is None:
+                    wb = self.writeback(slot)
+                    self.bg_writebacks += 1
+                try:
+                    next(wb)
+                except StopIteration:
+                    pass
+                return _BG_STEP
+        if self.scrub_threshold:
+            step = self._scrubstep(left)
+            if step != _BG_NONE:
+                return step
+        last = self.f_first + self.f_blocks
+        for _ in range(self.f_blocks):
+            sector = self._bgsector
+            if self.blockstate(sector) == _BS_FREE and not self.cached(sector):
+                f.dieSelectOnAdd(self._pbase(sector))
+                if not f.ready() and f.remaining() >= left:
+                    return _BG_WAIT
+                self._erase(sector)
+                self.setblockstate(sector, _BS_ERASED)
+                self.bg_erases += 1
+                return _BG_STEP
+            self._bgsector = sector + 1 if sector + 1 < last else self.f_first
+        if self.scrub_patrol:
+            return self._patrolstep(left)
+        return _BG_NONE
+
+#   /* scrub(threshold, patrol) -- starts scrubbing in the background work (block cache mode only),
+#    * threshold = 0 stops it. The page reads count the ECC corrections per erase block
+#    * (W25N.ecc_blocks, an uncorrectable page counts W25N_ECC_FAIL_WEIGHT), a block in use that
+#    * reached threshold is loaded into a clean cache slot a few pages per step and written back
+#    * in full: erased and programmed in place, with wear leveling to the least worn free block.
+#    * The erase drops the count. patrol > 0 reads up to patrol pages per idle() call when there is
+#    * nothing else to do, page data reads only (the ECC status comes with the busy poll), going
+#    * round the blocks in use, so errors of data that is never read are found as well.
+
+    def scrub(self, threshold = 8, patrol = 0):
+        if self.copyback:
+            raise ValueError("scrub needs a block cache")
+        self.scrub_threshold = threshold
+        self.scrub_patrol = patrol if threshold else 0
+        self._scslot = -1
+        self._bgdone = False
+
+#   /* _sectorat(block) -- erase block in use of the partition stored on flash block block, -1 if none
+
+    def _sectorat(self, block):
+        i = block - self.f_first
+        if self._stripe and 0 <= i < 2 * self._half:
+            i = (i % self._half) << 1 | i // self._half
+        if self.wear:
+            if not 0 <= i < len(self._p2l) or self._p2l[i] == _WL_NONE:
+                return -1
+            i = self._p2l[i]
+        elif not 0 <= i < self.f_blocks:
+            return -1
+        sector = self.f_first + i
+        return sector if self.blockstate(sector) == _BS_USED else -1
+
+#   /* _scrubdue() -- an erase block in use that reached the scrub threshold and is not being written
+#    * back, -1 if none
+
+    def _scrubdue(self):
+        cache = self.cache
+        for block, n in self.flash.ecc_blocks.items():
+            if n < self.scrub_threshold:
+                continue
+            sector = self._sectorat(block)
+            if sector < 0:
+                continue
+            slot = cache.peek(sector)
+            if slot < 0 or not (cache.dirty[slot] or cache.wb[slot] is not None):
+                return sector
+        return -1
+
+#   /* _scrubstep(left) -- loads up to _SC_PAGES pages of the block to scrub, once all are cached the
+#    * slot is marked dirty in full and the write back steps refresh the block. A slot is only taken
+#    * if the cache can give up a clean one, the block is picked again when a write took it over.
+
+    def _scrubstep(self, left):
+        cache = self.cache
+        slot = self._scslot
+        if slot >= 0 and (cache.sector[slot] != self._scsector or cache.owner[slot] is not self or cache.dirty[slot]):
+            slot = self._scslot = -1
+        if slot < 0:
+            sector = self._scrubdue()
+            if sector < 0:
+                return _BG_NONE
+            slot = cache.peek(sector)
+            if slot < 0:
+                victim = cache.victim()
+                if cache.dirty[victim] or cache.wb[victim] is not None:
+                    return _BG_NONE
+                slot = cache.alloc(self, sector)
+            self._scslot = slot
+            self._scsector = sector
+        f = self.flash
+        f.dieSelectOnAdd(self.slotpage(slot))
+        if not f.ready() and f.remaining() >= left:
+            return _BG_WAIT
+        if self.readfsector(slot, _SC_PAGES):
+            base = slot * self.f_sectorpages
+            for i in range(base, base + self.f_sectorpages):
+                cache.flags[i] |= PG_DIRTY
+                cache.mask[i] = self._fullmask
+            cache.dirty[slot] = 1
+            self._scslot = -1
+            self.scrub_blocks += 1
+        return _BG_STEP
+
+#   /* _patrolstep(left) -- page data read of the next page of a block in use, _BG_WAIT once the
+#    * patrol reads of this idle() call are done
+
+    def _patrolstep(self, left):
+        if self._ptleft <= 0:
+            return _BG_WAIT
+        ppb = self.f_sectorpages
+        for _ in range(self.f_blocks):
+            sector = self.f_first + self._ptpage // ppb
+            if self.blockstate(sector) == _BS_USED:
+                break
+            self._ptpage = (self._ptpage // ppb + 1) % self.f_blocks * ppb
+        else:
+            return _BG_NONE
+        f = self.flash
+        addr = self._pbase(sector) + self._ptpage % ppb
+        f.dieSelectOnAdd(addr)
+        if not f.ready() and f.remaining() >= left:
+            return _BG_WAIT
+        f.pageDataRead(addr)
+        self._ptpage = (self._ptpage + 1) % (self.f_blocks * ppb)
+        self._ptleft -= 1
+        self.patrol_pages += 1
+        return _BG_STEP
+
+#   /* _ring(f_page) -- offset of logical page f_page in ra_mem or -1 if no read ahead ring holds it
+
+    def _ring(self, f_page):
+        for s in range(_RA_STREAMS):
+            i = f_page - self.ra_first[s]
+            if 0 <= i < self.ra_count[s]:
+                return (s * self.readahead + f_page % self.readahead) * self.f_pagesize
+        return -1
+
+#   /* prefetch(stream, page) -- fills the read ahead ring of stream with the pages from logical page on
+#    * (up to a cached page), unless a ring holds page already, and starts the page data read of the
+#    * page after the ring
+
+    def prefetch(self, stream, page):
+        ppb = self.f_sectorpages
+        ps = self.f_pagesize
+        spp = self._spp
+        end = (self.f_first + self.f_blocks) * ppb
+        if page >= end or self._ring(page) >= 0:
+            return
+        limit = min(self.readahead, end - page)
+        count = 0
+        while count < limit and self.cache.peek((page + count) // spp) < 0:
+            count += 1
+        self.ra_count[stream] = 0
+        base = stream * self.readahead * ps
+        i = 0
+        while i < count:
+            p = page + i
+            k = p % self.readahead
+            run = min(count - i, ppb - p % ppb, self.readahead - k)
+            self.flash.readPages(self._pbase(p // ppb) + p % ppb, run, self.ra_mem[base + k * ps:base + (k + run) * ps])
+            i += run
+        self.ra_first[stream] = page
+        self.ra_count[stream] = count
+        p = page + count
+        if p < end:
+            self.flash.pageDataRead(self._pbase(p // ppb) + p % ppb)
+
+#   /* _raslide(stream, page) -- the ring of stream moves on to page, pages before it are dropped and
+#    * idle() loads the following ones (background read ahead)
+
+    def _raslide(self, stream, page):
+        i = page - self.ra_first[stream]
+        if 0 <= i <= self.ra_count[stream]:
+            self.ra_count[stream] -= i
+        else:
+            self.ra_count[stream] = 0
+        self.ra_first[stream] = page
+        self.ra_fill[stream] = 1
+
+#   /* _rastep(left) -- background read ahead: loads the next page of a ring to fill, a page data read
+#    * first and the transfer in the next step, so the slice is not spent waiting for the chip
+
+    def _rastep(self, left):
+        ppb = self.f_sectorpages
+        ps = self.f_pagesize
+        end = (self.f_first + self.f_blocks) * ppb
+        f = self.flash
+        for s in range(_RA_STREAMS):
+            if not self.ra_fill[s]:
+                continue
+            page = self.ra_first[s] + self.ra_count[s]
+            if self.ra_count[s] >= self.readahead or page >= end or self.cache.peek(page // self._spp) >= 0:
+                self.ra_fill[s] = 0
+                continue
+            p = self._pbase(page // ppb) + page % ppb
+            f.dieSelectOnAdd(p)
+            if not f.ready() and f.remaining() >= left:
+                return _BG_WAIT
+            if not f.buffered(p):
+                f.pageDataRead(p)
+                return _BG_STEP
+            base = (s * self.readahead + page % self.readahead) * ps
+            f.read(0, self.ra_mem[base:base + ps])
+            self.ra_count[s] += 1
+            return _BG_STEP
+        return _BG_NONE
+
+#   /* _invalidate(sector) -- drops pages of erase block sector from the staging page and the read ahead rings
+
+    def _invalidate(self, sector):
+        ppb = self.f_sectorpages
+        if self.curr_page // ppb == sector:
+            self.curr_page = -1
+        for s in range(_RA_STREAMS):
+            if self.ra_count[s] and self.ra_first[s] // ppb <= sector <= (self.ra_first[s] + self.ra_count[s] - 1) // ppb:
+                self.ra_count[s] = 0
+
+#   /* writeblocks(n, buf, offset) -- writes go to the cache slot of the erase block (of the page
+#    * in copy back mode), a page is only read from flash when the write does not cover it
+#    * completely, in copy back mode when it does not cover whole blocks. Data equal to the
+#    * cached page leaves it clean (skip_blocks), unless the blocks are free.
+#    * Writes crossing an erase block continue in the slot of the next block.
 
-            
     def writeblocks(self, n, buf, offset = 0):
+        self._enter()
+        self.write_bytes += len(buf)
+        try:
+            self._writeblocks(n, buf, offset)
+        finally:
+            self._leave()
+
+    def _writeblocks(self, n, buf, offset):
+        buf = memoryview(buf)
         n = n + self.f_start
         lenght = len(buf)
         f_sector = n // self.blockcount
-        if f_sector != self.curr_sector:
-            self.refreshcache(f_sector)
-        lenght = len(buf)
-        bl = n % self.blockcount
-        mv = self.bl_mem
+        addr = (n % self.blockcount) * self.blocksize + offset
         if self.debug:
             address = (n * self.blocksize) + offset
             print("write {} at {} sector {} block {} offset {}".format(lenght,address,f_sector,n,offset))
-        addr = bl * self.blocksize
-        rest = 0
-        if (addr + offset + lenght) > self.f_sectorsize:
-            rest = lenght
-            lenght = self.f_sectorsize - addr
-            rest = rest - lenght
-            if self.debug:
-                print("overflow {} bytes addr {} sector{}".format(rest,addr,f_sector))
+        ps = self.f_pagesize
+        bs = self.blocksize
+        spp = self._spp
+        cache = self.cache
         index = 0
-        mv[addr + offset:addr + offset + lenght] = buf[:lenght]
-        if rest > 0:
-            self.refreshcache(f_sector + 1)
-            mv[:rest] = buf[lenght:]
+        slot = -1
+        while index < lenght:
+            if addr >= self.f_sectorsize:
+                addr -= self.f_sectorsize
+                f_sector += 1
+                slot = -1
+                if self.debug:
+                    print("overflow {} bytes sector {}".format(lenght - index, f_sector))
+            page, col = (addr // ps, addr % ps)
+            key = (f_sector * self.f_sectorpages + page) // spp
+            if slot < 0 or cache.sector[slot] != key:
+                slot = cache.find(key)
+                if slot < 0:
+                    slot = cache.alloc(self, key)
+            page %= spp
+            i = slot * spp + page
+            chunk = min(ps - col, lenght - index)
+            bl = addr // bs
+            bits = (1 << ((col + chunk - 1) // bs + 1)) - (1 << (col // bs))
+            if cache.flags[i] & PG_VALID and self.livemask(f_sector, addr // ps) & bits == bits:
+                mv = cache.pagemem(slot, page)
+                if mv[col:col + chunk] == buf[index:index + chunk]:
+                    self.skip_blocks += (addr + chunk - 1) // bs - bl + 1
+                    index += chunk
+                    addr += chunk
+                    continue
+            self.untrim(f_sector * self.blockcount + bl, (addr + chunk - 1) // bs - bl + 1)
+            if chunk == ps:
+                mv = cache.pagemem(slot, page)
+                cache.flags[i] |= PG_VALID
+            elif self.copyback and col % bs == 0 and chunk % bs == 0:
+                mv = cache.pagemem(slot, page)
+            else:
+                mv = self.cachedpage(slot, page)
+            mv[col:col + chunk] = buf[index:index + chunk]
+            cache.flags[i] |= PG_DIRTY
+            cache.mask[i] |= bits
+            cache.dirty[slot] = 1
+            index += chunk
+            addr += chunk
         self.write_count += 1
 
-    def readfsector(self, sector):
-        page = sector * self.f_sectorpages
-        mv = self.bl_mem
-        for i in range(64):
-            index = i * 2048
-            self.flash.pageDataRead(page + i)
-            self.flash.read(0, mv[index:index + 2048])
-        self.curr_sector = sector
+#   /* readfsector(slot, limit) -- loads the pages of slot not cached yet,
+#    * runs of consecutive missing pages are read with one readPages call.
+#    * With limit only the first run, of up to limit pages, is read. Returns True once all pages are cached.
+
+    def readfsector(self, slot, limit = 0):
+        cache = self.cache
+        sector = cache.sector[slot]
+        base = slot * self.f_sectorpages
+        ps = self.f_pagesize
+        i = 0
+        while i < self.f_sectorpages:
+            if cache.flags[base + i] & PG_VALID or self.pagefree(sector, i):
+                self.cachedpage(slot, i)
+                i += 1
+                continue
+            j = i + 1
+            while j < self.f_sectorpages and j - i != limit and not cache.flags[base + j] & PG_VALID and not self.pagefree(sector, j):
+                j += 1
+            self.flash.readPages(self._pbase(sector) + i, j - i, cache.slotmem(slot)[i * ps:j * ps])
+            for k in range(base + i, base + j):
+                cache.flags[k] |= PG_VALID
+            i = j
+            if limit and i < self.f_sectorpages:
+                return False
         if self.debug:
-            print("load sector ",sector)
-        
-    def writefsector(self, sector):
-        sec_addr = sector * self.f_sectorpages
-        self.flash.blockErase(sec_addr)
-        mv = self.bl_mem
-        for i in range(64):
-            index = i * 2048
-            self.flash.loadRandProgData(0, mv[index:index + 2048], 2048)
-            self.flash.ProgramExecute(sec_addr + i)
+            print("load sector ",self.cache.sector[slot])
+        return True
+
+#   /* writefsector(slot) -- erases the block of a dirty slot and programs it back. A write back
+#    * in progress is finished first, pages written meanwhile are written by a second one.
+
+    def writefsector(self, slot):
+        cache = self.cache
+        cache.finish(slot)
+        if cache.dirty[slot]:
+            for _ in self.writeback(slot):
+                pass
+
+#   /* writeback(slot) -- returns the write back of slot as a generator that yields
+#    * after every command that leaves the chip busy (erase, program execute).
+#    * writefsector runs it straight through, AsyncNandBdev awaits the chip between steps.
+#    * The slot is marked clean when the write back starts, pages written meanwhile
+#    * dirty it again and are written by the next write back.
+
+    def writeback(self, slot):
+        gen = self._copyback(slot) if self.copyback else self._writeback(slot)
+        self.cache.wb[slot] = gen
+        return gen
+
+#   /* _appendable(slot) -- True if every dirty block of slot is erased on flash
+
+    def _appendable(self, slot):
+        cache = self.cache
+        sector = cache.sector[slot]
+        base = slot * self.f_sectorpages
+        for i in range(self.f_sectorpages):
+            if cache.flags[base + i] & PG_DIRTY and cache.mask[base + i] & ~self.erasedmask(sector, i):
+                return False
+        return True
+
+#   /* slotpage(slot) -- flash page of the first page held by slot
+
+    def slotpage(self, slot):
+        lpage = self.cache.sector[slot] * self._spp
+        return self._pbase(lpage // self.f_sectorpages) + lpage % self.f_sectorpages
+
+#   /* cached(sector) -- True if a page of erase block sector is in the cache
+
+    def cached(self, sector):
+        cache = self.cache
+        lo = sector * self.f_sectorpages // self._spp
+        hi = lo + self.f_sectorpages // self._spp
+        for slot in range(cache.nslots):
+            if lo <= cache.sector[slot] < hi:
+                return True
+        return False
+
+#   /* _writeback(slot) -- write back of a slot holding an erase block. If every dirty block is
+#    * known to be erased on flash the dirty blocks are appended by partial page programs, else the
+#    * block is erased and programmed back. Blocks without data or all 0xFF are left erased,
+#    * pages with nothing to program are counted in skip_pages.
+#    * With wear leveling the block is programmed to the least worn free block instead (in place
+#    * when other write backs took all free blocks), the first page with the tag goes last and the
+#    * old block stays intact until then. A block programmed
+#    * after an erase always gets the tag, so it is not appended to.
+
+    def _writeback(self, slot):
+        cache = self.cache
+        sector = cache.sector[slot]
+        ppb = self.f_sectorpages
+        base = slot * ppb
+        cache.dirty[slot] = 0
+        target = -1
+        try:
+            sec_addr = self._pbase(sector)
+            state = self.blockstate(sector)
+            append = self.nop and self._appendable(slot) and not (self.wear and state == _BS_ERASED)
+            tag = self.wear and not append
+            if append:
+                erased = self._erasedmap(sector, False)
+            else:
+                self.readfsector(slot)
+                if state != _BS_ERASED:
+                    if self.wear and self._wlfree:
+                        target = self._wlpick()
+                        sec_addr = self._physbase(self.f_first + target)
+                        self.wl_counts[target] += 1
+                        self.flash.blockErase(sec_addr)
+                    else:
+                        self._erase(sector)
+                    yield
+                erased = self._erasedmap(sector, True)
+            self.setblockstate(sector, _BS_USED)
+            if self._trim.get(sector) == self._notrim:
+                del self._trim[sector]
+            for k in range(ppb):
+                i = (k + 1) % ppb if tag else k
+                if append:
+                    if not cache.flags[base + i] & PG_DIRTY:
+                        continue
+                    mask = cache.mask[base + i]
+                else:
+                    mask = self.livemask(sector, i)
+                cache.flags[base + i] = PG_VALID
+                cache.mask[base + i] = 0
+                first = tag and i == 0
+                if mask or first:
+                    mv = cache.pagemem(slot, i)
+                    mask &= ~self._blankmask(mv, mask)
+                    if first:
+                        self._wltag(sector, target if target >= 0 else self._l2p[sector - self.f_first])
+                        erased[i] = 0
+                    elif not mask:
+                        self.skip_pages += 1
+                        continue
+                    erased[i] &= ~mask
+                    self._program(mv, sec_addr + i, mask, first)
+                    yield
+            if target >= 0:
+                self._wlmap(sector, target)
+                target = -1
+                self._invalidate(sector)
+                self.wl_relocs += 1
+                if self.wl_relocs % _WL_CHECK == 0:
+                    self._wlstatic()
+        except:
+            cache.dirty[slot] = 1
+            for i in range(base, base + ppb):
+                cache.flags[i] |= PG_DIRTY
+                cache.mask[i] = self._fullmask
+            self._erased.pop(sector, None)
+            if target >= 0:
+                self._wlfree.append(target)
+            raise
+        finally:
+            cache.wb[slot] = None
+        self._invalidate(sector)
         if self.debug:
             print("write sector ",sector)
-            
-    def refreshcache(self, sector):
-        self.writefsector(self.curr_sector)
-        self.readfsector(sector)
+
+#   /* _wlmount() -- rebuilds the wear leveling map from the tags of the first pages, the newest tag
+#    * of a logical block wins. Blocks without a tag get the mean erase count. Logical blocks without
+#    * a tag hold no data, they are mapped to a free block (their own one if free) and marked free.
+
+    def _wlmount(self):
+        f = self.flash
+        n = self.f_blocks
+        nphys = len(self.wl_counts)
+        tag = self._cbtag
+        seqs = array('i', [-1] * n)
+        total = 0
+        known = 0
+        for p in range(nphys):
+            f.readSpare(self._physbase(self.f_first + p), tag)
+            if tag[0] << 8 | tag[1] != _WL_MAGIC or not self._tagok():
+                self.wl_counts[p] = -1
+                continue
+            l = tag[2] << 8 | tag[3]
+            self.wl_counts[p] = self._wlint(4)
+            total += self.wl_counts[p]
+            known += 1
+            seq = self._wlint(8)
+            if seq >= self._wlseq:
+                self._wlseq = seq + 1
+            if l < n and seq > seqs[l]:
+                seqs[l] = seq
+                self._l2p[l] = p
         self.curr_page = -1
+        for p in range(nphys):
+            if self.wl_counts[p] < 0:
+                self.wl_counts[p] = total // known if known else 0
+        for l in range(n):
+            if self._l2p[l] != _WL_NONE:
+                self._p2l[self._l2p[l]] = l
+        for l in range(n):
+            if self._l2p[l] == _WL_NONE:
+                p = l
+                while self._p2l[p] != _WL_NONE:
+                    p = (p + 1) % nphys
+                self._wlmap(self.f_first + l, p)
+                self.setblockstate(self.f_first + l, _BS_FREE)
+        self._wlfree = [p for p in range(nphys) if self._p2l[p] == _WL_NONE]
+        if self.debug:
+            print("wear leveling {} blocks tagged, seq {}".format(known, self._wlseq))
+
+    def _wlint(self, i):
+        tag = self._cbtag
+        return tag[i] << 24 | tag[i + 1] << 16 | tag[i + 2] << 8 | tag[i + 3]
 
+#   /* _tagok() -- True if the check of the tag in _cbtag matches (or is erased, tags written before the check)
+
+    def _tagok(self):
+        c = self._wlint(_TAG_CHECK)
+        return c == spareSum(self._cbtag, _TAG_CHECK) or c == 0xFFFFFFFF
+
+#   /* _wltag(sector, p) -- prepares the tag of logical erase block sector stored in physical block p
+
+    def _wltag(self, sector, p):
+        tag = self._cbtag
+        l = sector - self.f_first
+        c = self.wl_counts[p]
+        seq = self._wlseq
+        self._wlseq += 1
+        tag[0] = _WL_MAGIC >> 8
+        tag[1] = _WL_MAGIC & 0xFF
+        tag[2] = l >> 8
+        tag[3] = l & 0xFF
+        for i in range(4):
+            tag[4 + i] = (c >> (24 - 8 * i)) & 0xFF
+            tag[8 + i] = (seq >> (24 - 8 * i)) & 0xFF
+
+#   /* _wlpick() -- takes the least worn free physical block out of the free list
+
+    def _wlpick(self):
+        best = self._wlfree[0]
+        for p in self._wlfree:
+            if self.wl_counts[p] < self.wl_counts[best]:
+                best = p
+        self._wlfree.remove(best)
+        return best
+
+#   /* _wlmap(sector, p) -- maps logical erase block sector to physical block p, the block it was
+#    * mapped to becomes free
+
+    def _wlmap(self, sector, p):
+        l = sector - self.f_first
+        old = self._l2p[l]
+        self._l2p[l] = p
+        self._p2l[p] = l
+        if p in self._wlfree:
+            self._wlfree.remove(p)
+        if old != _WL_NONE:
+            self._p2l[old] = _WL_NONE
+            self._wlfree.append(old)
+
+#   /* _wlstatic() -- static wear leveling: when the most worn free block was erased _WL_DELTA times
+#    * more than the least worn block in use, the data of that block (cold, it was not rewritten
+#    * for a long time) is moved there inside the chip, the least worn block becomes free.
+#    * Blocks without data are just remapped, cached blocks are left alone.
+
+    def _wlstatic(self):
+        counts = self.wl_counts
+        if not self._wlfree:
+            return
+        hot = self._wlfree[0]
+        for p in self._wlfree:
+            if counts[p] > counts[hot]:
+                hot = p
+        cold = -1
+        for l in range(self.f_blocks):
+            p = self._l2p[l]
+            if (cold < 0 or counts[p] < counts[self._l2p[cold]]) and not self.cached(self.f_first + l):
+                cold = l
+        if cold < 0 or counts[hot] - counts[self._l2p[cold]] < _WL_DELTA:
+            return
+        sector = self.f_first + cold
+        self._erased.pop(sector, None)
+        self._invalidate(sector)
+        if self.blockstate(sector) != _BS_USED:
+            self._wlmap(sector, hot)
+            self.setblockstate(sector, _BS_FREE)
+            return
+        f = self.flash
+        ppb = self.f_sectorpages
+        src = self._pbase(sector)
+        dst = self._physbase(self.f_first + hot)
+        counts[hot] += 1
+        f.blockErase(dst)
+        for k in range(ppb):
+            i = (k + 1) % ppb
+            free = self.pagefree(sector, i)
+            if i == 0:
+                if not free:
+                    self._cbload(src, dst)
+                self._wltag(sector, hot)
+                self._cbtagload(not free, dst)
+            elif free:
+                continue
+            else:
+                self._cbload(src + i, dst + i)
+            f.ProgramExecute(dst + i)
+        self._wlmap(sector, hot)
+        self.wl_moves += 1
+        if self.debug:
+            print("wear leveling moved sector {} to block {}".format(sector, hot))
+
+#   /* _copyback(slot) -- write back of the erase block of a page slot without a block cache.
+#    * Erased and free blocks get the dirty pages programmed directly. A block in use is
+#    * copied page by page to the scratch block inside the chip (page data read, the changed
+#    * blocks patched in with random data loads, program execute), erased and copied back the
+#    * same way. Unchanged data never crosses the SPI bus, free pages are not copied.
+#    * The last scratch page carries a tag naming the block, _cbrecover() finishes a copy
+#    * interrupted after the scratch block was complete. Dirty pages of the block held in
+#    * other slots are written by the same copy back.
+
+    def _copyback(self, slot):
+        cache = self.cache
+        f = self.flash
+        ppb = self.f_sectorpages
+        sector = cache.sector[slot] // ppb
+        first = sector * ppb
+        try:
+            if self._cbslot >= 0:
+                cache.finish(self._cbslot)
+            self._cbslot = slot
+            for i in range(ppb):
+                self._cbmask[i] = 0
+            n = 0
+            for s in range(cache.nslots):
+                if cache.dirty[s] and first <= cache.sector[s] < first + ppb:
+                    n += 1
+            if not n:
+                return
+            base = self._pbase(sector)
+            state = self.blockstate(sector)
+            append = state != _BS_ERASED and self.nop and self._cbappendable(sector)
+            if state == _BS_USED and not append and not self._cbchanged(sector, base):
+                return
+            erased = self._erasedmap(sector, state == _BS_FREE and not append)
+            self.setblockstate(sector, _BS_USED)
+            if self._trim.get(sector) == self._notrim:
+                del self._trim[sector]
+            if state != _BS_USED or append:
+                if state == _BS_FREE and not append:
+                    f.blockErase(base)
+                    yield
+                for i in range(ppb):
+                    if self._cbpage(first + i, -1, base + i):
+                        erased[i] &= ~self._cbmask[i]
+                        f.ProgramExecute(base + i)
+                        yield
+            else:
+                scratch = self._pbase(self._scratch)
+                tag = self._cbtag
+                for i in range(8):
+                    tag[4 + i] = 0
+                for i in range(ppb):
+                    src = -1 if self.pagefree(sector, i) else base + i
+                    loaded = self._cbpage(first + i, src, scratch + i)
+                    if loaded:
+                        tag[4 + i // 8] |= 1 << (i & 7)
+                    if i == ppb - 1:
+                        tag[0] = _CB_MAGIC >> 8
+                        tag[1] = _CB_MAGIC & 0xFF
+                        tag[2] = sector >> 8
+                        tag[3] = sector & 0xFF
+                        self._cbtagload(loaded, scratch + i)
+                    elif not loaded:
+                        continue
+                    f.ProgramExecute(scratch + i)
+                    yield
+                self._cbmoved = sector
+                f.blockErase(base)
+                erased = self._erasedmap(sector, True)
+                yield
+                for i in range(ppb):
+                    if tag[4 + i // 8] & (1 << (i & 7)):
+                        erased[i] = 0
+                        self._cbload(scratch + i, base + i)
+                        f.ProgramExecute(base + i)
+                        yield
+                self._cbmoved = -1
+                f.blockErase(scratch)
+                yield
+        except:
+            self._cbmoved = -1
+            self._erased.pop(sector, None)
+            for i in range(ppb):
+                if self._cbmask[i]:
+                    s = cache.peek(first + i)
+                    if s >= 0:
+                        cache.mask[s] |= self._cbmask[i]
+                        cache.flags[s] |= PG_DIRTY
+                        cache.dirty[s] = 1
+            raise
+        finally:
+            cache.wb[slot] = None
+            self._cbslot = -1
+        self._invalidate(sector)
+        if self.debug:
+            print("copy back sector ",sector)
+
+#   /* _cbchanged(sector, base) -- compares the dirty blocks of the page slots of erase block sector
+#    * with flash (first page base), blocks holding the same data are no longer dirty (skip_blocks).
+#    * Returns False if nothing is left to write.
+
+    def _cbchanged(self, sector, base):
+        cache = self.cache
+        f = self.flash
+        ppb = self.f_sectorpages
+        first = sector * ppb
+        bs = self.blocksize
+        pg = self.pg_mem
+        changed = False
+        for s in range(cache.nslots):
+            lpage = cache.sector[s]
+            if not cache.dirty[s] or not first <= lpage < first + ppb:
+                continue
+            f.pageDataRead(base + lpage - first)
+            f.read(0, pg)
+            self.curr_page = lpage
+            mv = cache.pagemem(s, 0)
+            mask = cache.mask[s]
+            for b in range(self.pagerel):
+                if mask & (1 << b) and mv[b * bs:(b + 1) * bs] == pg[b * bs:(b + 1) * bs]:
+                    mask &= ~(1 << b)
+                    self.skip_blocks += 1
+            cache.mask[s] = mask
+            if mask:
+                changed = True
+            else:
+                cache.flags[s] &= ~PG_DIRTY
+                cache.dirty[s] = 0
+        return changed
+
+#   /* _cbappendable(sector) -- True if every dirty block of erase block sector held in the
+#    * page slots is erased on flash
+
+    def _cbappendable(self, sector):
+        cache = self.cache
+        first = sector * self.f_sectorpages
+        for i in range(self.f_sectorpages):
+            s = cache.peek(first + i)
+            if s >= 0 and cache.dirty[s] and cache.mask[s] & ~self.erasedmask(sector, i):
+                return False
+        return True
+
+#   /* _cbload(src, dst) -- loads page src into the data buffer of the die of page dst,
+#    * through RAM when src is on another die
+
+    def _cbload(self, src, dst):
+        f = self.flash
+        f.pageDataRead(src)
+        if f.dieOnAdd(src) != f.dieOnAdd(dst):
+            f.read(0, self.pg_mem)
+            self.curr_page = -1
+            f.loadProgData(0, self.pg_mem, self.f_pagesize, dst)
+
+#   /* _cbpage(lpage, src, dst) -- prepares the chip data buffer for programming dst with
+#    * logical page lpage: page src (-1 for an erased page) with the dirty blocks of the
+#    * cached page patched in, all 0xFF blocks are not loaded into an erased page.
+#    * Returns False if there is nothing to program.
+
+    def _cbpage(self, lpage, src, dst):
+        cache = self.cache
+        f = self.flash
+        loaded = src >= 0
+        if loaded:
+            self._cbload(src, dst)
+        slot = cache.peek(lpage)
+        if slot < 0 or not cache.dirty[slot]:
+            return loaded
+        mask = cache.mask[slot]
+        mv = cache.pagemem(slot, 0)
+        bs = self.blocksize
+        prog = mask
+        if not loaded:
+            prog &= ~self._blankmask(mv, mask)
+            if not prog:
+                self.skip_pages += 1
+        for b in range(self.pagerel):
+            if prog & (1 << b):
+                if loaded:
+                    f.loadRandProgData(b * bs, mv[b * bs:(b + 1) * bs], bs, dst)
+                else:
+                    f.loadProgData(b * bs, mv[b * bs:(b + 1) * bs], bs, dst)
+                    loaded = True
+        self._cbmask[lpage % self.f_sectorpages] = mask
+        cache.mask[slot] = 0
+        cache.flags[slot] &= ~PG_DIRTY
+        cache.dirty[slot] = 0
+        return loaded
+
+#   /* _cbtagload(loaded, dst) -- adds the tag in _cbtag (copy back or wear leveling) with its check to
+#    * the data buffer of page dst, the buffer is cleared first unless page data was loaded
+
+    def _cbtagload(self, loaded, dst):
+        tag = self._cbtag
+        c = spareSum(tag, _TAG_CHECK)
+        for i in range(4):
+            tag[_TAG_CHECK + i] = (c >> (24 - 8 * i)) & 0xFF
+        self.flash.loadSpare(tag, dst, not loaded)
+
+#   /* _cbrecover() -- run at init in copy back mode. If the scratch block holds a complete copy
+#    * the interrupted copy back is finished, the scratch block is left erased.
+
+    def _cbrecover(self):
+        f = self.flash
+        ppb = self.f_sectorpages
+        scratch = self._pbase(self._scratch)
+        tag = self._cbtag
+        f.readSpare(scratch + ppb - 1, tag)
+        sector = tag[2] << 8 | tag[3]
+        if tag[0] << 8 | tag[1] == _CB_MAGIC and self._tagok() and self.f_first <= sector < self.f_first + self.f_blocks:
+            if self.debug:
+                print("copy back recover sector ",sector)
+            base = self._pbase(sector)
+            f.blockErase(base)
+            for i in range(ppb):
+                if tag[4 + i // 8] & (1 << (i & 7)):
+                    self._cbload(scratch + i, base + i)
+                    f.ProgramExecute(base + i)
+        f.blockErase(scratch)
+        f.block_WIP()
+
+#   /* stats(reset, enable) -- the flash statistics (W25N.stats, counting is started with enable = True)
+#    * with the block device counters: bytes read and written by the filesystem, write calls, cache
+#    * hits and misses, read ahead hits and misses (in pages), blocks written unchanged and page programs skipped,
+#    * background work (scrubbed blocks and patrol reads included) and the write amplification (bytes
+#    * loaded for programs per byte written). The flash statistics hold the ECC corrections and failures.
+#    * With wear leveling the relocations, cold data moves and the lowest and highest erase counts
+#    * are added. reset clears the counters after they are read (erase counts are kept).
+
+    def stats(self, reset = False, enable = None):
+        s = self.flash.stats(reset, enable)
+        cache = self.cache
+        s['read_bytes'] = self.read_bytes
+        s['write_bytes'] = self.write_bytes
+        s['writes'] = self.write_count
+        s['cache_hits'] = cache.hits
+        s['cache_misses'] = cache.misses
+        s['ra_hits'] = sum(self.ra_hits)
+        s['ra_misses'] = sum(self.ra_misses)
+        s['skip_blocks'] = self.skip_blocks
+        s['skip_pages'] = self.skip_pages
+        s['bg_writebacks'] = self.bg_writebacks
+        s['bg_erases'] = self.bg_erases
+        s['scrub_blocks'] = self.scrub_blocks
+        s['patrol_pages'] = self.patrol_pages
+        s['write_amp'] = s['load_bytes'] / self.write_bytes if self.write_bytes else 0
+        if self.wear:
+            s['wl_relocs'] = self.wl_relocs
+            s['wl_moves'] = self.wl_moves
+            s['wl_min'] = min(self.wl_counts)
+            s['wl_max'] = max(self.wl_counts)
+        if reset:
+            self.read_bytes = self.write_bytes = self.write_count = 0
+            cache.hits = cache.misses = 0
+            for i in range(_RA_STREAMS):
+                self.ra_hits[i] = 0
+                self.ra_misses[i] = 0
+            self.skip_blocks = self.skip_pages = 0
+            self.bg_writebacks = self.bg_erases = 0
+            self.scrub_blocks = self.patrol_pages = 0
+        return s
 
     def ioctl(self, op, arg):
+        self._enter()
+        try:
+            return self._ioctl(op, arg)
+        finally:
+            self._leave()
+
+    def _ioctl(self, op, arg):
         if op == 4:  # MP_BLOCKDEV_IOCTL_BLOCK_COUNT
             return  self.f_size // self.blocksize
         if op == 5:  # MP_BLOCKDEV_IOCTL_BLOCK_SIZE
@@ -188,10 +1481,10 @@ class NandBdev:
         if op == 6:  # MP_BLOCKDEV_IOCTL_BLOCK_ERASE
             if self.debug:
                 print("delete block {} ".format(arg))
+            self.trim(arg + self.f_start)
             return 0
         if op == 3:
-            self.writefsector(self.curr_sector)
+            self.cache.flush(self)
             if self.debug:
                 print("sync")
             return 0
-
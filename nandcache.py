@@ -0,0 +1,170 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Erase block cache for NandBdev
+#  *
+#  * The cache is split in slots of one erase block each. Pages of a slot are
+#  * loaded on demand and every page carries a valid and a dirty flag, the slot
+#  * itself carries a dirty flag so clean slots are dropped without write back.
+#  * Slots are replaced in least recently used order. mask holds a bit per
+#  * filesystem block of every page for owners that track changes below a page.
+#  * The owner decides what a slot holds, one erase block or (in the copy back
+#  * mode of NandBdev) one page. The partitions of one chip can share a cache
+#  * (see nandpart.py), a slot is written back by the owner that filled it.
+#  *
+#  * A write back in progress is kept in wb[slot] as a generator (see
+#  * NandBdev.writeback), releasing or discarding the slot runs it to the end first.
+#  */
+
+from array import array
+from micropython import const
+
+PG_VALID    = const(1)
+PG_DIRTY    = const(2)
+
+
+class NandCache:
+    def __init__(self, size = 131072, sectorsize = 131072, pagesize = 2048):
+        self.sectorsize = sectorsize
+        self.pagesize = pagesize
+        self.ppb = sectorsize // pagesize
+        self.nslots = max(1, size // sectorsize)
+        self.arr = bytearray(self.nslots * sectorsize)
+        self.mem = memoryview(self.arr)
+        self.sector = array('i', [-1] * self.nslots)
+        self.age = array('i', [0] * self.nslots)
+        self.owner = [None] * self.nslots
+        self.dirty = bytearray(self.nslots)
+        self.wb = [None] * self.nslots
+        self.flags = bytearray(self.nslots * self.ppb)
+        self.mask = array('H', [0] * (self.nslots * self.ppb))
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+
+#   /* find(sector) -- returns the slot holding sector or -1, a hit refreshes the slot age
+
+    def find(self, sector):
+        for i in range(self.nslots):
+            if self.sector[i] == sector:
+                self._tick += 1
+                self.age[i] = self._tick
+                self.hits += 1
+                return i
+        self.misses += 1
+        return -1
+
+#   /* alloc(owner, sector) -- takes the least recently used slot for sector.
+#    * A dirty victim is written back through owner.writefsector(slot) first.
+#    * The new slot has no valid pages.
+
+    def alloc(self, owner, sector):
+        slot = self.victim()
+        self.release(slot)
+        self.sector[slot] = sector
+        self.owner[slot] = owner
+        self._tick += 1
+        self.age[slot] = self._tick
+        return slot
+
+#   /* victim() -- the slot alloc() takes next, an empty one or the least recently used
+
+    def victim(self):
+        slot = -1
+        for i in range(self.nslots):
+            if self.sector[i] < 0:
+                return i
+            if slot < 0 or self.age[i] < self.age[slot]:
+                slot = i
+        return slot
+
+#   /* release(slot) -- writes back a dirty slot and empties it
+
+    def release(self, slot):
+        if self.dirty[slot] or self.wb[slot] is not None:
+            self.owner[slot].writefsector(slot)
+        self.discard(slot)
+
+#   /* discard(slot) -- empties a slot without writing it back
+
+    def discard(self, slot):
+        self.finish(slot)
+        self.sector[slot] = -1
+        self.owner[slot] = None
+        self.dirty[slot] = 0
+        base = slot * self.ppb
+        for i in range(base, base + self.ppb):
+            self.flags[i] = 0
+            self.mask[i] = 0
+
+#   /* flush(owner) -- writes back every dirty slot of owner, slots stay cached.
+#    * The write backs are stepped in turns, an erase or program started for one slot
+#    * runs while the next slot is loaded and programmed (on another die of multi die chips).
+#    * Slots dirtied again while their write back was in progress are written once more.
+
+    def flush(self, owner):
+        gens = self.writebacks(owner)
+        while gens:
+            i = 0
+            while i < len(gens):
+                try:
+                    next(gens[i])
+                    i += 1
+                except StopIteration:
+                    gens.pop(i)
+            if not gens:
+                gens = self.writebacks(owner)
+
+#   /* writebacks(owner) -- starts the write back of every dirty slot of owner, returns the generators
+
+    def writebacks(self, owner):
+        gens = []
+        for i in range(self.nslots):
+            if self.owner[i] is owner and (self.dirty[i] or self.wb[i] is not None):
+                gens.append(self.wb[i] if self.wb[i] is not None else owner.writeback(i))
+        return gens
+
+#   /* finish(slot) -- runs a write back in progress on slot to the end
+
+    def finish(self, slot):
+        wb = self.wb[slot]
+        if wb is not None:
+            for _ in wb:
+                pass
+
+#   /* peek(sector) -- like find() without touching the slot age or the counters
+
+    def peek(self, sector):
+        for i in range(self.nslots):
+            if self.sector[i] == sector:
+                return i
+        return -1
+
+    def slotmem(self, slot):
+        base = slot * self.sectorsize
+        return self.mem[base:base + self.sectorsize]
+
+    def pagemem(self, slot, page):
+        base = slot * self.sectorsize + page * self.pagesize
+        return self.mem[base:base + self.pagesize]
@@ -23,29 +23,73 @@
 
 import os
 from nandbdev import NandBdev
-from nandflash import W25N
+from nandftl import NandFTL
+from nandarray import NandArray
+from nandpart import NandPartitions
+from nandflash import W25N, W25N_BUS_AUTO
+from nandbbm import NandBBM
 from machine import SPI, Pin,SoftSPI
 
 
+# a bus with more data lines (lines attribute, see W25N) can be put here for the dual and quad modes
 spi= SPI(1, baudrate=60000000)
 
 cs = Pin('D5', Pin.OUT, value=1)
 
+# partitions of the chip on D5 mounted with shared = True, one cache and lock for all of them
+parts = None
 
-def start(point = "/flash2", bs = 512, fmt = False, st = 0, sz = 2048, db = False, clear = False, LFS = False):
+
+def start(point = "/flash2", bs = 512, fmt = False, st = 0, sz = 2048, db = False, clear = False, LFS = False, FTL = False, cache = 131072, stripe = False, bbm = False, readahead = 0, idle = 0, stats = False, wear = False, chips = None, shared = False, bus = W25N_BUS_AUTO, scrub = 0):
+    
+    # more chips on the bus (chip select pin names) are striped with the first one by NandArray
+    pins = [Pin(p, Pin.OUT, value=1) for p in chips] if chips and not FTL else []
     
-    dev = W25N(spi,cs)
+    global parts
+    
+    if shared and parts is not None:
+        dev = parts.flash
+    else:
+        dev = W25N(spi,cs,bus)
     
     if dev == None:
         print("coundnt find spi nand device")
         return
     
-    flash=NandBdev(dev, blocksize = 512, start = st, size = sz, debug = db)
+    devs = [dev] + [W25N(spi, p, bus) for p in pins]
+    
+    for d in devs:
+        if stats:
+            d.stats(enable = True)
+        if bbm and d.bbm is None:
+            NandBBM(d, debug = db)
+    
+    if shared and not FTL and not pins:
+        if parts is None:
+            parts = NandPartitions(dev, cache_size = cache, debug = db)
+        flash=parts.add(start = st, size = sz, stripe = stripe, readahead = readahead, wear = wear)
+    elif pins:
+        flash=NandArray(devs, blocksize = 512, start = st, size = sz, cache_size = cache, stripe = stripe, readahead = readahead, wear = wear, debug = db)
+    elif FTL:
+        flash=NandFTL(dev, blocksize = 512, start = st, size = sz, debug = db)
+    else:
+        flash=NandBdev(dev, blocksize = 512, start = st, size = sz, cache_size = cache, stripe = stripe, readahead = readahead, wear = wear, debug = db)
     
     if flash == None:
         print("error creating block device")
         return
     
+    # background write back, or garbage collection of the FTL. Shared partitions all run
+    # from the one timer of the partition set.
+    if idle and not pins:
+        if shared and not FTL:
+            parts.background(idle)
+        else:
+            flash.background(idle)
+        # blocks reaching scrub ECC corrections are rewritten in the background (block cache only)
+        if scrub and not FTL and not flash.copyback:
+            flash.scrub(scrub)
+    
     read=64
     prog=512
     look=512
@@ -54,7 +98,12 @@ def start(point = "/flash2", bs = 512, fmt = False, st = 0, sz = 2048, db = Fals
         
     try:
         if clear:
-            dev.bulkErase()
+            for d in devs:
+                d.bulkErase()
+            if not FTL:
+                flash.markerased()
+        if FTL and (fmt or clear):
+            flash.format()
         if fmt:
             if LFS:
                 os.VfsLfs2.mkfs(flash, readsize=read, progsize=prog, lookahead=look)
@@ -70,5 +119,7 @@ def start(point = "/flash2", bs = 512, fmt = False, st = 0, sz = 2048, db = Fals
     os.mount(vfs, point)
         
     print("block count = {} block size = {} flash size {:1}MB".format(flash.ioctl(4, 0),flash.ioctl(5, 0),flash.ioctl(4, 0)*flash.ioctl(5, 0)/1048576))
+    
+    return flash
 
         
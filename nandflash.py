@@ -35,6 +35,8 @@
 
 import machine
 import time
+import errno
+from array import array
 from micropython import const
 
 
@@ -56,6 +58,11 @@ W25N_PROG_EXECUTE       = const(0x10)
 W25N_PAGE_DATA_READ     = const(0x13)
 W25N_READ               = const(0x03)
 W25N_FAST_READ          = const(0x0B)
+W25N_FAST_READ_DUAL     = const(0x3B)
+W25N_FAST_READ_QUAD     = const(0x6B)
+W25N_FAST_READ_QUAD_IO  = const(0xEB)
+W25N_QUAD_PROG_DATA_LOAD= const(0x32)
+W25N_QUAD_RAND_PROG_DATA_LOAD = const(0x34)
 
 W25N_PROT_REG           = const(0xA0)
 W25N_CONFIG_REG         = const(0xB0)
@@ -73,84 +80,357 @@ W25M02GV_MAX_DIES       = const(2)
 W25N02GV_MAX_PAGE       = const(131071)
 W25N02GV_MAX_DIES       = const(1)
 W25N_BLOCK_PAGES        = const(64)
+W25N_DIE_PAGES          = const(65536)    # pages per die of a multi die chip, 16 bit page address
 W25N_PAGES_SIZE         = const(2048)
 W25N_CACHE_SIZE         = const(2176)
 
+W25N_CONFIG_BUF         = const(0x08)   # 1 buffer read mode, 0 continuous read mode
+W25N_STAT_BUSY          = const(0x01)
+W25N_STAT_EFAIL         = const(0x04)
+W25N_STAT_PFAIL         = const(0x08)
+W25N_STAT_LUTF          = const(0x40)   # bad block LUT full
+W25N_STAT_ECC           = const(0x30)   # ECC-1/ECC-0 status of the last page read
+W25N_ECC_OK             = const(0)      # no bit errors
+W25N_ECC_CORRECTED      = const(1)      # bit errors corrected
+W25N_ECC_FAILED         = const(2)      # uncorrectable in one page (3 in several pages of a continuous read)
+W25N_ECC_FAIL_WEIGHT    = const(64)     # an uncorrectable page counts as that many corrections in W25N.ecc_blocks
+W25N_BBM_LUT            = const(20)     # entries of the bad block LUT (per die)
+W25N_NOP                = const(4)      # partial programs per page, one per 512 byte ECC sector
+
+# user bytes of the spare area covered by ECC: a 4 byte field per ECC sector at W25N_SPARE_COL + 16 * k,
+# the bytes in between hold the bad block marker, unprotected user bytes and the ECC (written by the chip)
+W25N_SPARE_COL          = const(0x804)
+W25N_SPARE_FIELDS       = const(4)
+W25N_SPARE_USER         = const(16)     # ECC protected user bytes per page
+W25N_SPARE_SPAN         = const(52)     # columns from the first to the last user byte
+
+# operations that leave the chip busy, index of the wait tables and statistics
+W25N_OP_READ            = const(0)      # page data read, tRD
+W25N_OP_PROG            = const(1)      # program execute, tPP
+W25N_OP_ERASE           = const(2)      # block erase, tBE
+W25N_OP_RESET           = const(3)      # device reset, tRST
+W25N_OP_LINK            = const(4)      # bad block link (BBM LUT update)
+W25N_OP_NONE            = const(0xFF)
+
+# expected (typical) busy time, first poll interval and timeout in us per operation.
+# Timeouts are about twice the datasheet maximum (tRD 60us with ECC, tPP 700us, tBE 10ms, tRST 500us),
+# the page read, program and erase entries are replaced from the chip profile (W25N.t_expect, W25N.t_max)
+W25N_T_EXPECT           = (25, 250, 2000, 5, 250)
+W25N_T_POLL             = (0, 20, 250, 50, 20)
+W25N_T_MAX              = (200, 1500, 20000, 1000, 1500)
+W25N_T_POLL_MAX         = const(1000)
+W25N_HIST               = const(17)     # erase count histogram buckets, bucket k counts blocks erased 2^(k-1) to 2^k-1 times
+
+# capabilities of a chip profile
+W25N_CAP_CONTREAD       = const(0x01)   # continuous read mode (BUF bit of the config register, probed at init)
+W25N_CAP_CACHEREAD      = const(0x02)   # cache read, the next page is loaded while the buffer is read
+W25N_CAP_QUAD           = const(0x04)   # dual/quad output reads and quad program data loads
+W25N_CAP_ECC            = const(0x08)   # on chip ECC with ECC-0/ECC-1 status bits
+W25N_CAP_BBM            = const(0x10)   # bad block LUT (W25N_BB_MANAGE)
+
+# bus modes of the data transfers (read from and load into the data buffer), see W25N.busMode
+W25N_BUS_SPI            = const(0)      # read 03h, load 02h/84h, all on one line
+W25N_BUS_FAST           = const(1)      # fast read 0Bh
+W25N_BUS_DUAL           = const(2)      # dual output read 3Bh, data on 2 lines
+W25N_BUS_QUAD           = const(3)      # quad output read 6Bh, quad load 32h/34h, data on 4 lines
+W25N_BUS_QUAD_IO        = const(4)      # quad I/O read EBh, column and dummy clocks on 4 lines too
+W25N_BUS_AUTO           = const(0xFF)   # fastest mode of bus and chip
+
+# per bus mode: read opcode, data lines, column/dummy lines, bytes after the opcode in buffer read and in
+# continuous read mode, program data load and random load opcodes and their data lines
+W25N_BUS_MODES = (
+    (W25N_READ, 1, 1, 3, 3, W25N_PROG_DATA_LOAD, W25N_RAND_PROG_DATA_LOAD, 1),
+    (W25N_FAST_READ, 1, 1, 3, 4, W25N_PROG_DATA_LOAD, W25N_RAND_PROG_DATA_LOAD, 1),
+    (W25N_FAST_READ_DUAL, 2, 1, 3, 4, W25N_PROG_DATA_LOAD, W25N_RAND_PROG_DATA_LOAD, 1),
+    (W25N_FAST_READ_QUAD, 4, 1, 3, 4, W25N_QUAD_PROG_DATA_LOAD, W25N_QUAD_RAND_PROG_DATA_LOAD, 4),
+    (W25N_FAST_READ_QUAD_IO, 4, 4, 4, 4, W25N_QUAD_PROG_DATA_LOAD, W25N_QUAD_RAND_PROG_DATA_LOAD, 4),
+)
+
+# chip profiles by JEDEC device id (manufacturer WINBOND_MAN_ID): model, dies, erase blocks per die,
+# partial programs per page, bad block LUT entries per die, typical and maximum page read (ECC on),
+# program and block erase times in us, capabilities. Resolved once by W25N.__init__.
+W25N_PROFILES = {
+    0xAA21: ('W25N01GV', 1, 1024, 4, 20, (25, 250, 2000), (60, 700, 10000),
+             W25N_CAP_CONTREAD | W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+    0xBA21: ('W25N01GW', 1, 1024, 4, 20, (25, 250, 2000), (60, 700, 10000),
+             W25N_CAP_CONTREAD | W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+    0xAE21: ('W25N01KV', 1, 1024, 4, 20, (45, 250, 2000), (60, 700, 10000),
+             W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+    0xAA22: ('W25N02GV', 1, 2048, 4, 20, (25, 250, 2000), (60, 700, 10000),     # W25N02KV
+             W25N_CAP_CONTREAD | W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+    0xAA23: ('W25N04KV', 1, 4096, 4, 20, (45, 250, 2000), (60, 700, 10000),
+             W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+    0xBB22: ('W25M02GV', 2, 1024, 4, 20, (25, 250, 2000), (60, 700, 10000),
+             W25N_CAP_CONTREAD | W25N_CAP_QUAD | W25N_CAP_ECC | W25N_CAP_BBM),
+}
+
+
+#   /* _StatSPI(spi) -- SPI bus counting the bytes written and read, replaces the bus of W25N while statistics are on
+
+class _StatSPI:
+    def __init__(self, spi):
+        self.spi = spi
+        self.lines = getattr(spi, 'lines', 1)
+        self.nout = 0
+        self.nin = 0
+
+    def write(self, buf, lines = 1):
+        self.nout += len(buf)
+        if lines == 1:
+            self.spi.write(buf)
+        else:
+            self.spi.write(buf, lines)
+
+    def read(self, nbytes, write = 0x00):
+        self.nin += nbytes
+        return self.spi.read(nbytes, write)
+
+    def readinto(self, buf, write = 0x00, lines = 1):
+        self.nin += len(buf)
+        if lines == 1:
+            self.spi.readinto(buf, write)
+        else:
+            self.spi.readinto(buf, write, lines)
+
+    def write_readinto(self, wbuf, rbuf):
+        self.nout += len(wbuf)
+        self.nin += len(rbuf)
+        self.spi.write_readinto(wbuf, rbuf)
+
+
+#   /* spareSum(buf, n) -- check of the first n bytes of a spare area tag, 4 bytes: Fletcher-16 and its
+#    * complement, an erased field never matches
+
+def spareSum(buf, n):
+    s1 = 0
+    s2 = 0
+    for i in range(n):
+        s1 = (s1 + buf[i]) % 255
+        s2 = (s2 + s1) % 255
+    return s2 << 24 | s1 << 16 | (s2 ^ 0xFF) << 8 | (s1 ^ 0xFF)
 
 
 class W25N(object):
 
 #   /* initialises the flash and checks that the flash is 
 #    * functioning and is the right model.
-    def __init__(self, spi, cs):
+#    * spi is a machine.SPI or a bus with more data lines: an object with a lines attribute (2 or 4)
+#    * whose write(buf, lines) and readinto(buf, write, lines) transfer on lines lines, used by the
+#    * dual and quad bus modes (busMode). bus selects the mode, the fastest one of bus and chip by default.
+    def __init__(self, spi, cs, bus = W25N_BUS_AUTO):
         self._cs = cs
-        self._dieSelect = 1
         self._spi = spi
+        # preallocated command and response buffers with a view for every length,
+        # the command path does not allocate once the driver is initialised
         self._rdbuf = bytearray(5)
+        self._rd = memoryview(self._rdbuf)
+        self._rdv = tuple(self._rd[:i] for i in range(6))
         self.buf_a =  bytearray(5)
         self._buf = memoryview(self.buf_a)
+        self._bufv = tuple(self._buf[:i] for i in range(6))
         self._cmdbuf = bytearray(5)
+        self._cmd = memoryview(self._cmdbuf)
+        self._cmdv = tuple(self._cmd[:i] for i in range(6))
+        self._cmdt = tuple(self._cmd[1:i] for i in range(1, 6))
+        self._sparebuf = bytearray(W25N_SPARE_SPAN)
+        self._spare = memoryview(self._sparebuf)
         self._model = None
+        self._cfg = 0
+        self._contRead = False
+        # operation in progress per die and the time it was started
+        self._dieSelect = 0
+        # geometry, timing and capabilities of the part, from its profile (W25N_PROFILES)
+        self.dies = 1
+        self.nop = W25N_NOP
+        self.lut = W25N_BBM_LUT
+        self.caps = 0
+        self.pages = 0
+        self.maxpage = -1
+        self.diepages = W25N_DIE_PAGES
+        self.t_expect = array('i', W25N_T_EXPECT)
+        self.t_max = array('i', W25N_T_MAX)
+        self._pmask = 0xFFFFFF
+        self.bus = W25N_BUS_SPI
+        self._mode = W25N_BUS_MODES[W25N_BUS_SPI]
+        self._pend = bytearray(W25M02GV_MAX_DIES)
+        self._pstart = array('i', [0] * W25M02GV_MAX_DIES)
+        self._paddr = array('i', [0] * W25M02GV_MAX_DIES)
+        # page loaded in the data buffer of each die by the last page data read, -1 if unknown
+        self._bufpage = array('i', [-1] * W25M02GV_MAX_DIES)
+        # blocks remapped by the driver (nandbbm), logical block -> physical block
+        self._bmap = {}
+        self.bbm = None
+        self.remaps = 0
+        # ECC status of the last read (W25N_ECC_*, the worst page of a readPages call), pages read
+        # with corrected and uncorrectable errors and the correction count per block, block -> count
+        # (blocks without errors have no entry, the entry is dropped when the block is erased)
+        self.ecc = W25N_ECC_OK
+        self.ecc_corrected = 0
+        self.ecc_failed = 0
+        self.ecc_blocks = {}
+        for i in range(W25M02GV_MAX_DIES):
+            self._pend[i] = W25N_OP_NONE
+        self.status = 0
+        self.wait_count = array('i', [0] * 5)
+        self.wait_us = array('i', [0] * 5)
+        self.wait_max = array('i', [0] * 5)
+        # operation statistics (see stats()), counted per die while enabled
+        self._stats = False
+        self.op_reads = array('i', [0] * W25M02GV_MAX_DIES)
+        self.op_progs = array('i', [0] * W25M02GV_MAX_DIES)
+        self.op_erases = array('i', [0] * W25M02GV_MAX_DIES)
+        self.load_bytes = 0
+        self.erase_counts = None
         self._cs(1)
         self.reset()
+        self.block_WIP()
         self._buf[0] = W25N_JEDEC_ID
         self._buf[1] = 0x00
         buf = self.sendData(self._buf,2,3)
-        if buf[0] == WINBOND_MAN_ID:
-            if (buf[1] << 8 | buf[2]) == W25N01GV_DEV_ID:
-                self.setStatusReg(W25N_PROT_REG, 0x00)
-                self._model = 'W25N01GV'
-                print("Nand Flash {} found".format(self._model ))
-            if (buf[1] << 8 | buf[2]) == W25M02GV_DEV_ID:
-                self._model = 'W25M02GV'
+        man, devid = (buf[0], buf[1] << 8 | buf[2])
+        if man == WINBOND_MAN_ID and devid in W25N_PROFILES:
+            self.profile(W25N_PROFILES[devid])
+            for die in range(self.dies):
+                if self.dies > 1:
+                    self.dieSelect(die)
                 #self.setStatusReg(W25N_CONFIG_REG,0x9) # disable ECC
-                self.dieSelect(0)
-                self.setStatusReg(W25N_PROT_REG, 0x00)
-                self.dieSelect(1)
                 self.setStatusReg(W25N_PROT_REG, 0x00)
+            if self.dies > 1:
                 self.dieSelect(0)
-                print("Nand Flash {} found".format(self._model ))
-            if (buf[1] << 8 | buf[2]) == W25N02GV_DEV_ID:
-                self._model = 'W25N02GV'
-                #self.setStatusReg(W25N_CONFIG_REG,0x9) # disable ECC
-                self.setStatusReg(W25N_PROT_REG, 0x00)
-                print("Nand Flash {} found".format(self._model ))
-            self.size = W25N_PAGES_SIZE * W25N02GV_MAX_PAGE
+            print("Nand Flash {} found".format(self._model ))
+            self.size = W25N_PAGES_SIZE * self.pages
+            if self.caps & W25N_CAP_CONTREAD:
+                self.probeContRead()
+            self.busMode(bus)
         else:
             print("error initializing Nand Flash")
         self.block_size = W25N_BLOCK_PAGES * W25N_PAGES_SIZE
 
+#   /* profile(p) -- takes the geometry, timing and capabilities of chip profile p (an entry of W25N_PROFILES).
+#    * Timeouts are twice the datasheet maximum plus the longest poll interval.
+
+    def profile(self, p):
+        (self._model, self.dies, blocks, self.nop, self.lut, typ, top, self.caps) = p
+        self.diepages = blocks * W25N_BLOCK_PAGES
+        self.pages = self.dies * self.diepages
+        self.maxpage = self.pages - 1
+        self._pmask = self.diepages - 1 if self.dies > 1 else 0xFFFFFF
+        for op in (W25N_OP_READ, W25N_OP_PROG, W25N_OP_ERASE):
+            self.t_expect[op] = typ[op]
+            self.t_max[op] = 2 * top[op] + W25N_T_POLL_MAX
+
+#   /* busMode(mode) -- selects the bus mode of reads and program data loads (W25N_BUS_*). Modes with more
+#    * data lines need a bus with as many lines and a chip with W25N_CAP_QUAD, else the next slower mode
+#    * is taken. W25N_BUS_AUTO takes the fastest one (W25N_BUS_SPI on a plain SPI bus). Returns the mode set.
+
+    def busMode(self, mode = W25N_BUS_AUTO):
+        lines = getattr(self._spi, 'lines', 1)
+        if not self.caps & W25N_CAP_QUAD:
+            lines = 1
+        if mode == W25N_BUS_AUTO:
+            mode = W25N_BUS_QUAD_IO if lines >= 4 else W25N_BUS_DUAL if lines >= 2 else W25N_BUS_SPI
+        while mode > W25N_BUS_FAST and max(W25N_BUS_MODES[mode][1], W25N_BUS_MODES[mode][2]) > lines:
+            mode -= 1
+        self.bus = mode
+        self._mode = W25N_BUS_MODES[mode]
+        return mode
+
+#   /* _header(op, columnAdd, n) -- starts a transfer (chip select low) with op and n column/dummy bytes,
+#    * on the column lines of the bus mode for reads
+
+    def _header(self, op, columnAdd, n, lines = 1):
+        self._column(op, columnAdd)
+        self._cs(0)
+        if lines == 1:
+            self._spi.write(self._cmdv[n + 1])
+        else:
+            self._spi.write(self._cmdv[1])
+            self._spi.write(self._cmdt[n], lines)
+
+#   /* _rx(buf) / _tx(buf) -- data phase of a read / program data load on the data lines of the bus mode
+
+    def _rx(self, buf):
+        if self._mode[1] == 1:
+            self._spi.readinto(buf)
+        else:
+            self._spi.readinto(buf, 0x00, self._mode[1])
+
+    def _tx(self, buf):
+        if self._mode[7] == 1:
+            self._spi.write(buf)
+        else:
+            self._spi.write(buf, self._mode[7])
+
 #   /* int dieSelect(uint32_t die) -- Selects the active die on a multi die chip (W25*M*)
 #    * Input - die number starting at 0 
 #    * Output - error output, 0 for success
             
     def dieSelect(self, die):
         #//TODO add some type of input validation
-        self.clearBuf()
         self._buf[0] = W25M_DIE_SELECT
         self._buf[1] = die
         self.sendCmd(self._buf,2)
         self._dieSelect = die
 
-#   /* sendData(buf, len) -- Sends/recieves data to the flash chip.
-#    * The buffer that is passed to the function will have its dat sent to the
-#    * flash chip, and the data recieved will be returned
+#   /* probeContRead() -- checks if the BUF bit of the config register can be cleared,
+#    * parts that keep it set have no continuous read mode. Leaves all dies in buffer read mode.
+
+    def probeContRead(self):
+        dies = self.dies
+        for die in range(dies):
+            if dies > 1:
+                self.dieSelect(die)
+            self._cfg = self.getStatusReg(W25N_CONFIG_REG) | W25N_CONFIG_BUF
+            self.setStatusReg(W25N_CONFIG_REG, self._cfg & ~W25N_CONFIG_BUF)
+            self._contRead = not self.getStatusReg(W25N_CONFIG_REG) & W25N_CONFIG_BUF
+            self.setStatusReg(W25N_CONFIG_REG, self._cfg)
+        if dies > 1:
+            self.dieSelect(0)
+
+#   /* sendData(buf, nw, nr) -- Sends/recieves data to the flash chip.
+#    * The first nw bytes of buf are sent to the flash chip, and a view of the nr bytes
+#    * recieved is returned. The view is reused by the next command, copy it to keep it.
 
     def sendData(self, buf, nw, nr = None):
         self._cs(0)
-        self._spi.write(buf[:nw])
+        self._spi.write(self._bufv[nw] if buf is self._buf else buf[:nw])
         if nr:
-            self._rdbuf = self._spi.read(nr)
+            self._spi.readinto(self._rdv[nr])
         self._cs(1)
-        return self._rdbuf[:nr]
+        return self._rdv[nr] if nr else self._rdv[0]
     
     
-#   /* sendCmd( cmd, len) -- Sends command to the flash chip.
+#   /* sendCmd( cmd, nw) -- Sends the first nw bytes of cmd to the flash chip.
     
-    def sendCmd(self, cmd, len):
+    def sendCmd(self, cmd, nw):
+        self._cs(0)
+        self._spi.write(self._bufv[nw] if cmd is self._buf else cmd[:nw])
+        self._cs(1)
+
+#   /* sendAddr(op, pageAdd) -- Sends a command with a 24 bit page address (erase, program execute, page read)
+#    * to the selected die, on multi die chips only the page address within the die is sent.
+#    * Blocks remapped by the driver are translated here and in dieSelectOnAdd.
+
+    def sendAddr(self, op, pageAdd):
+        if self._bmap:
+            pageAdd = self.phys(pageAdd)
+        pageAdd &= self._pmask
+        c = self._cmdbuf
+        c[0] = op
+        c[1] = (pageAdd >> 16) & 0xFF
+        c[2] = (pageAdd >> 8) & 0xFF
+        c[3] = pageAdd & 0xFF
         self._cs(0)
-        self._spi.write(cmd[:len])
+        self._spi.write(self._cmdv[4])
         self._cs(1)
+
+    def _column(self, op, columnAdd):
+        c = self._cmdbuf
+        c[0] = op
+        c[1] = (columnAdd >> 8) & 0xFF
+        c[2] = columnAdd & 0xFF
+        c[3] = 0x00
+        c[4] = 0x00
         
 
 #   /* reset() -- resets the device. */
@@ -158,29 +438,69 @@ class W25N(object):
         #TODO check WIP in case of reset during write
         self._buf[0] = W25N_RESET
         self.sendCmd(self._buf,1)
-        time.sleep_ms(1)
+        self._bufpage[self._dieSelect] = -1
+        self.started(W25N_OP_RESET)
           
 #   /* int dieSelectOnAdd(pageAdd) -- auto changes selected die based on requested address
-#    * Input - full range (across all dies) page address
+#    * Input - full range (across all dies) page address, die n holds pages n*65536 to n*65536+65535
+#    * The die select command is only sent when the die changes, an operation
+#    * running on the other die is not waited for.
 #    * Output - error output, 0 for success
     
     def dieSelectOnAdd(self, pageAdd):
-        if pageAdd > self.getMaxPage():
+        if pageAdd > self.maxpage:
             return 1
-        if self._model == "W25M02GV":
-            return self.dieSelect(pageAdd // W25N01GV_MAX_PAGE)
-        else:
-            return 0
+        if self.dies > 1:
+            if self._bmap:
+                pageAdd = self.phys(pageAdd)
+            die = pageAdd // self.diepages
+            if die != self._dieSelect:
+                self.dieSelect(die)
+        return 0
+
+#   /* dieOnAdd(pageAdd) -- returns the die holding pageAdd, 0 on single die chips
+
+    def dieOnAdd(self, pageAdd):
+        if self.dies > 1:
+            if self._bmap:
+                pageAdd = self.phys(pageAdd)
+            return pageAdd // self.diepages
+        return 0
+
+#   /* phys(pageAdd) -- page address after the driver bad block remapping (nandbbm)
+
+    def phys(self, pageAdd):
+        b = self._bmap.get(pageAdd // W25N_BLOCK_PAGES)
+        if b is None:
+            return pageAdd
+        return b * W25N_BLOCK_PAGES + pageAdd % W25N_BLOCK_PAGES
+
+#   /* select(pageAdd) -- selects the die of pageAdd (the selected die if None) and waits for
+#    * the operation running on it. A failed block remapped during the wait may have moved
+#    * to another die, the die of pageAdd is then selected again.
+#    * Output - error output, 0 for success
+
+    def select(self, pageAdd):
+        while True:
+            n = self.remaps
+            if pageAdd is not None and self.dieSelectOnAdd(pageAdd):
+                return 1
+            self.block_WIP()
+            if self.remaps == n:
+                return 0
 
 #   /* getStatusReg(reg) -- gets the value from one of the registers:
 #    * W25N_STAT_REG / W25N_CONFIG_REG / W25N_PROT_REG
-#    * Output -- register byte value
+#    * Output -- register byte value (int)
     
     def getStatusReg(self, reg):
         self._buf[0] = W25N_READ_STATUS_REG
         self._buf[1] = reg
-        buf = self.sendData(self._buf,2,3)
-        return buf
+        self._cs(0)
+        self._spi.write(self._bufv[2])
+        self._spi.readinto(self._rdv[1])
+        self._cs(1)
+        return self._rdbuf[0]
 
 #   /* setStatusReg(char reg, char set) -- Sets one of the status registers:
 #    * W25N_STAT_REG / W25N_CONFIG_REG / W25N_PROT_REG
@@ -192,15 +512,10 @@ class W25N(object):
         self._buf[2] = _set
         self.sendCmd(self._buf,3)
         
-#   /* getMaxPage() Returns the max page for the given chip
+#   /* getMaxPage() Returns the max page for the given chip (maxpage, set from the chip profile)
 
     def getMaxPage(self):
-        if self._model == "W25M02GV":
-            return W25M02GV_MAX_PAGE
-        elif self._model == "W25N01GV":
-            return W25N01GV_MAX_PAGE
-        elif self._model == "W25N02GV":
-            return W25N02GV_MAX_PAGE
+        return self.maxpage
 
 #   /* writeEnable() -- enables write opperations on the chip.
 #    * Is disabled after a write operation and must be recalled.
@@ -220,35 +535,36 @@ class W25N(object):
 #   * Rerturns 0 if successful
 
     def blockErase(self, pageAdd):
-        if pageAdd > self.getMaxPage():
+        if pageAdd > self.maxpage:
             return 1
-        self.dieSelectOnAdd(pageAdd)
-        #pageAdd = pageAdd // 2048
-        cbuf = bytearray(4)
-        cbuf[0] = W25N_BLOCK_ERASE
-        cbuf[1] = (pageAdd & 0xFF0000) >> 16
-        cbuf[2] = (pageAdd & 0xFF00)>> 8
-        cbuf[3] = pageAdd & 0xFF
-        self.block_WIP()
+        self.select(pageAdd)
         self.writeEnable()
-        self._cs(0)
-        self._spi.write(cbuf)
-        self._cs(1)
+        self.sendAddr(W25N_BLOCK_ERASE, pageAdd)
+        self.started(W25N_OP_ERASE, pageAdd)
         return 0
     
 #     /* bulkErase() -- Erases the entire chip
 #      * THIS TAKES A VERY LONG TIME, ~30 SECONDS
+#      * With bad block management (nandbbm) the reserved blocks (table and spares) and bad blocks
+#      * without a replacement are left alone, remapped blocks are erased on their replacement.
 #      * Returns 0 if successful 
 
     def bulkErase(self):
         error = 0
-        sectors = self.getMaxPage() // 64
-        for i in range(sectors):
-            print("Erasing Sector ",i)
-            error = self.blockErase(i*64)
-            self.block_WIP()
-            if(error != 0):
-                return error
+        sectors = self.pages // W25N_BLOCK_PAGES
+        dies = self.dies
+        dsectors = sectors // dies
+        bbm = self.bbm
+        # on multi die chips the dies are erased in turns, each erase runs while the other dies erase
+        for i in range(dsectors):
+            for d in range(dies):
+                b = d * dsectors + i
+                if bbm is not None and (b >= bbm.first or bbm.isbad(b) and b not in self._bmap and b not in bbm.links):
+                    continue
+                error = self.blockErase(b * W25N_BLOCK_PAGES)
+                if(error != 0):
+                    return error
+        self.block_WIP_all()
         return 0
 
 #   /* loadProgData(columnAdd, buf, dataLen) -- Transfers datalen number of bytes from the 
@@ -262,18 +578,14 @@ class W25N(object):
             return 1
         if dataLen > W25N_MAX_COLUMN - columnAdd:
             return 1
-        if pageAdd:
-            if self.dieSelectOnAdd(pageAdd):
-                return 1
-        cbuf = bytearray(3)
-        cbuf[0] = W25N_PROG_DATA_LOAD
-        cbuf[1] = (columnAdd & 0xFF00)>> 8
-        cbuf[2] = columnAdd & 0xff
-        self.block_WIP()
+        if self.select(pageAdd):
+            return 1
+        if self._stats:
+            self.load_bytes += dataLen
+        self._bufpage[self._dieSelect] = -1
         self.writeEnable()
-        self._cs(0)
-        self._spi.write(cbuf)
-        self._spi.write(buf[:dataLen])
+        self._header(self._mode[5], columnAdd, 2)
+        self._tx(buf if len(buf) == dataLen else buf[:dataLen])
         self._cs(1)
         return 0
 
@@ -289,103 +601,411 @@ class W25N(object):
             return 1
         if dataLen >  (W25N_MAX_COLUMN - columnAdd):
             return 1
-        if pageAdd is not None:
-            if self.dieSelectOnAdd(pageAdd):
-                return 1
-        cbuf = bytearray(3)
-        cbuf[0] = W25N_RAND_PROG_DATA_LOAD
-        cbuf[1] = (columnAdd & 0xFF00)>> 8
-        cbuf[2] = columnAdd & 0xff
-        self.block_WIP()
+        if self.select(pageAdd):
+            return 1
+        if self._stats:
+            self.load_bytes += dataLen
+        self._bufpage[self._dieSelect] = -1
         self.writeEnable()
-        self._cs(0)
-        self._spi.write(cbuf)
-        self._spi.write(buf)
+        self._header(self._mode[6], columnAdd, 2)
+        self._tx(buf if len(buf) == dataLen else buf[:dataLen])
         self._cs(1)
-        return 0;
+        return 0
 
 #   /* ProgramExecute(add) -- Commands the flash to program the internal buffer contents to the addres page
 #    * given after a loadProgData or loadRandProgData has been called.
 #    * The selected page needs to be erased prior to use as the falsh chip can only change 1's to 0's
 #    * This command will put the flash in a busy state for a time, so busy checking is required ater use.  */
     def ProgramExecute(self, pageAdd):
-        if pageAdd > self.getMaxPage():
+        if pageAdd > self.maxpage:
             print("execute add out of bounds")
             return 1
-        self.dieSelectOnAdd(pageAdd)
+        self.select(pageAdd)
         self.writeEnable()
-        cbuf = bytearray(4)
-        cbuf[0] = W25N_PROG_EXECUTE
-        cbuf[1] = (pageAdd & 0xFF0000) >> 16
-        cbuf[2] = (pageAdd & 0xFF00) >> 8
-        cbuf[3] = pageAdd & 0xFF
-        self.sendCmd(cbuf,4)
+        self.sendAddr(W25N_PROG_EXECUTE, pageAdd)
+        self.started(W25N_OP_PROG, pageAdd)
         return 0
 
 #  //pageIndex(add) -- get page index from address
     def pageIndex(self, pageAdd):
-        return pagAdd //  W25N_PAGES_SIZE
+        return pageAdd //  W25N_PAGES_SIZE
 
 #   //pageDataRead(add) -- Commands the flash to read from the given page address into
 #   //its internal buffer, to be read using the read() function. 
 #   //This command will put the flash in a busy state for a time, so busy checking is required after use.
     def pageDataRead(self, pageAdd):
-        if pageAdd > self.getMaxPage():
+        if pageAdd > self.maxpage:
             print(" page read add out of bounds")
             return 1
-        self.dieSelectOnAdd(pageAdd)
-        cbuf = bytearray(4)
-        cbuf[0] = W25N_PAGE_DATA_READ
-        cbuf[1] = (pageAdd & 0xFF0000) >> 16
-        cbuf[2] = (pageAdd & 0x00FF00)>> 8
-        cbuf[3] = pageAdd & 0x0000FF
-        self.block_WIP()
-        self.sendCmd(cbuf,4)
+        self.select(pageAdd)
+        self.sendAddr(W25N_PAGE_DATA_READ, pageAdd)
+        self.started(W25N_OP_READ, pageAdd)
+        self._bufpage[self._dieSelect] = pageAdd
         return 0
 
+#   //buffered(add) -- True if the page was loaded (or is loading) into the data buffer of its die by
+#   //the last pageDataRead and nothing was loaded into the buffer since. The page can then be read
+#   //with dieSelectOnAdd(add) and read() without a new page data read.
+    def buffered(self, pageAdd):
+        return self._bufpage[self.dieOnAdd(pageAdd)] == pageAdd
+
 #   //read(columnAdd, buf, dataLen) -- Reads data from the flash internal buffer
 #   //columnAdd is a buffer index (0-2047) or (0 - 2111) including ECC bits
 #   //datalen is the length of data that should be read from the buffer (up to 2111)
+#   //Reading into a caller buffer does not allocate, without a buffer a new bytes object is returned
     def read(self, columnAdd, buffer = None, dataLen = None):
         if columnAdd > W25N_MAX_COLUMN:
             return 1
         if dataLen:
             if dataLen > (W25N_MAX_COLUMN - columnAdd):
                 return 1
-        cbuf = bytearray(4)
-        cbuf[0] = W25N_READ
-        cbuf[1] = columnAdd >> 8
-        cbuf[2] = columnAdd & 0xff
-        cbuf[3] = 0x00
         self.block_WIP()
-        self._cs(0)
-        self._spi.write(cbuf)
+        m = self._mode
+        self._header(m[0], columnAdd, m[3], m[2])
         if buffer is None:
-            buffer = self._spi.read(dataLen)
+            buffer = bytearray(dataLen)
+            self._rx(buffer)
+        elif dataLen is None or dataLen == len(buffer):
+            self._rx(buffer)
         else:
-            self._spi.readinto(buffer)
+            self._rx(memoryview(buffer)[:dataLen])
         self._cs(1)
         return buffer
 
+#   //readPages(startPage, count, buf) -- Reads count full pages (2048 bytes each) starting at startPage into buf.
+#   //On parts with continuous read mode the pages of each die are streamed in a single transaction,
+#   //otherwise (or with blocks remapped by the driver) every page is loaded with pageDataRead and read back to back.
+#   //Returns 0 if successful
+    def readPages(self, startPage, count, buf):
+        if startPage + count - 1 > self.maxpage:
+            return 1
+        mv = memoryview(buf)
+        ps = W25N_PAGES_SIZE
+        worst = W25N_ECC_OK
+        if not self._contRead or self._bmap:
+            for i in range(count):
+                self.pageDataRead(startPage + i)
+                self.read(0, mv[i * ps:(i + 1) * ps])
+                if self.ecc > worst:
+                    worst = self.ecc
+            self.ecc = worst
+            return 0
+        index = 0
+        while count > 0:
+            run = count
+            if self.dies > 1:
+                run = min(count, self.diepages - startPage % self.diepages)
+            self.dieSelectOnAdd(startPage)
+            self.block_WIP()
+            self.setStatusReg(W25N_CONFIG_REG, self._cfg & ~W25N_CONFIG_BUF)
+            self.pageDataRead(startPage)
+            self.block_WIP()
+            self._header(self._mode[0], 0, self._mode[4], self._mode[2])
+            self._rx(mv[index:index + run * ps])
+            self._cs(1)
+            # the ECC bits now hold the worst status of the pages streamed, read once per run
+            e = (self.getStatusReg(W25N_STAT_REG) & W25N_STAT_ECC) >> 4
+            if e > worst:
+                worst = e
+            self.setStatusReg(W25N_CONFIG_REG, self._cfg)
+            self._bufpage[self._dieSelect] = -1
+            if e and run > 1:
+                self._eccrun(startPage + 1, run - 1)
+            if self._stats:
+                self.op_reads[self._dieSelect] += run - 1
+            index += run * ps
+            startPage += run
+            count -= run
+        self.ecc = worst
+        return 0
+
+#   //_eccrun(startPage, run) -- locates the bit errors of run pages of a continuous read, which only reports
+#   //the worst status of the pages streamed: every page is loaded again (page data read, no transfer) and
+#   //the busy poll counts its status, so ecc_blocks counts corrected pages as a page by page read does.
+#   //Only called after a continuous read reported bit errors. The first page of a run was counted by its
+#   //page data read already.
+    def _eccrun(self, startPage, run):
+        for p in range(startPage, startPage + run):
+            self.pageDataRead(p)
+            self.block_WIP()
+
+#   //_eccnote(pageAdd, e) -- counts ECC status e of page pageAdd in the statistics and the block index
+    def _eccnote(self, pageAdd, e):
+        if e == W25N_ECC_CORRECTED:
+            self.ecc_corrected += 1
+            n = 1
+        else:
+            self.ecc_failed += 1
+            n = W25N_ECC_FAIL_WEIGHT
+        b = pageAdd // W25N_BLOCK_PAGES
+        self.ecc_blocks[b] = self.ecc_blocks.get(b, 0) + n
+
+#   //lastEccFail() -- returns the address of the last page of the selected die that failed ECC correction
+#   //in a continuous read (W25N_LAST_ECC_FAIL)
+    def lastEccFail(self):
+        self.block_WIP()
+        self._buf[0] = W25N_LAST_ECC_FAIL
+        self._buf[1] = 0x00
+        buf = self.sendData(self._buf, 2, 2)
+        return self._dieSelect * self.diepages + (buf[0] << 8 | buf[1])
+
+#   //readSpare(pageAdd, buf, count) -- reads the ECC protected user bytes of the spare area of count pages
+#   //from pageAdd into buf, W25N_SPARE_USER (16) bytes per page, the four 4 byte fields one after the
+#   //other. The data area is not transferred. The last page is left in the data buffer.
+#   //Returns 0 if successful
+    def readSpare(self, pageAdd, buf, count = 1):
+        sp = self._sparebuf
+        for n in range(count):
+            if self.pageDataRead(pageAdd + n):
+                return 1
+            self.read(W25N_SPARE_COL, self._spare)
+            o = n * W25N_SPARE_USER
+            for k in range(W25N_SPARE_FIELDS):
+                for j in range(4):
+                    buf[o + 4 * k + j] = sp[16 * k + j]
+        return 0
+
+#   //loadSpare(buf, pageAdd, fresh) -- loads the 16 user bytes in buf into the spare area of the data buffer,
+#   //after the data and before ProgramExecute. With fresh the data buffer is cleared first (loadProgData),
+#   //for a page programmed with the spare bytes only. Every ECC sector of a page is programmed once, the
+#   //spare fields have to be programmed with the data of the page.
+    def loadSpare(self, buf, pageAdd = None, fresh = False):
+        sp = self._sparebuf
+        for i in range(W25N_SPARE_SPAN):
+            sp[i] = 0xFF
+        for k in range(W25N_SPARE_FIELDS):
+            for j in range(4):
+                sp[16 * k + j] = buf[4 * k + j]
+        if fresh:
+            return self.loadProgData(W25N_SPARE_COL, self._spare, W25N_SPARE_SPAN, pageAdd)
+        return self.loadRandProgData(W25N_SPARE_COL, self._spare, W25N_SPARE_SPAN, pageAdd)
+
+#   //programSpare(pageAdd, buf, count) -- programs the spare user bytes of count pages from pageAdd,
+#   //16 bytes per page from buf, the data areas stay erased (and can't be programmed afterwards)
+    def programSpare(self, pageAdd, buf, count = 1):
+        mv = memoryview(buf)
+        for n in range(count):
+            if self.loadSpare(mv[n * W25N_SPARE_USER:(n + 1) * W25N_SPARE_USER], pageAdd + n, True):
+                return 1
+            self.ProgramExecute(pageAdd + n)
+        return 0
+
 #   //check_WIP() -- checks if the flash is busy with an operation
 #   //Output: true if busy, false if free
     def check_WIP(self):
         status = self.getStatusReg(W25N_STAT_REG)
-        if status[2] & 0x01:
+        if status & 0x01:
             return 1
         else:
             return 0
 
-#   //block_WIP() -- checks if the flash is busy and only returns once free
-#   //Has a 15ms timeout
+#   //started(op, pageAdd) -- records that op was issued on the selected die, block_WIP waits for it
+
+    def started(self, op, pageAdd = 0):
+        self._pend[self._dieSelect] = op
+        self._pstart[self._dieSelect] = time.ticks_us()
+        self._paddr[self._dieSelect] = pageAdd
+        if op == W25N_OP_ERASE and self.ecc_blocks:
+            self.ecc_blocks.pop(pageAdd // W25N_BLOCK_PAGES, None)
+        if self._stats:
+            self._count(op, pageAdd)
+
+#   //_count(op, pageAdd) -- counts an operation for stats(), erases per physical block
+    def _count(self, op, pageAdd):
+        d = self._dieSelect
+        if op == W25N_OP_READ:
+            self.op_reads[d] += 1
+        elif op == W25N_OP_PROG:
+            self.op_progs[d] += 1
+        elif op == W25N_OP_ERASE:
+            self.op_erases[d] += 1
+            if self._bmap:
+                pageAdd = self.phys(pageAdd)
+            b = pageAdd // W25N_BLOCK_PAGES
+            if self.erase_counts[b] < 0xFFFF:
+                self.erase_counts[b] += 1
+
+#   //stats(reset, enable) -- returns the operation statistics as a dict: page reads ('reads'), programs
+#   //('progs') and erases ('erases') per die, SPI bytes written and read ('spi_out', 'spi_in'), bytes
+#   //loaded for programs ('load_bytes'), block_WIP waits per operation ('wait_count', 'wait_us',
+#   //'wait_max', indexed by W25N_OP_*) and the erase count histogram of the blocks ('erase_hist',
+#   //bucket k holds the blocks erased 2^(k-1) to 2^k-1 times, 'erase_max' the highest count).
+#   //Counting is off by default, enable = True starts it (the SPI bus is wrapped by a counting bus and
+#   //a 2 byte counter per erase block is allocated), enable = False stops it. reset clears the
+#   //counters after they are read. Without counting only the wait statistics are kept.
+    def stats(self, reset = False, enable = None):
+        if enable and not self._stats:
+            self._spi = _StatSPI(self._spi)
+            if self.erase_counts is None:
+                self.erase_counts = array('H', [0] * (self.pages // W25N_BLOCK_PAGES))
+            self._stats = True
+        elif enable is False and self._stats:
+            self._spi = self._spi.spi
+            self._stats = False
+        dies = self.dies
+        hist = [0] * W25N_HIST
+        top = 0
+        if self.erase_counts is not None:
+            for c in self.erase_counts:
+                if c > top:
+                    top = c
+                k = 0
+                while c:
+                    c >>= 1
+                    k += 1
+                hist[k] += 1
+        while len(hist) > 1 and not hist[-1]:
+            hist.pop()
+        spi = self._spi if self._stats else None
+        s = {'reads': list(self.op_reads[:dies]), 'progs': list(self.op_progs[:dies]),
+             'erases': list(self.op_erases[:dies]), 'spi_out': spi.nout if spi else 0,
+             'spi_in': spi.nin if spi else 0, 'load_bytes': self.load_bytes,
+             'wait_count': list(self.wait_count), 'wait_us': list(self.wait_us),
+             'wait_max': list(self.wait_max), 'erase_hist': hist, 'erase_max': top,
+             'ecc_corrected': self.ecc_corrected, 'ecc_failed': self.ecc_failed}
+        if reset:
+            for a in (self.op_reads, self.op_progs, self.op_erases, self.wait_count, self.wait_us, self.wait_max):
+                for i in range(len(a)):
+                    a[i] = 0
+            if self.erase_counts is not None:
+                for i in range(len(self.erase_counts)):
+                    self.erase_counts[i] = 0
+            if spi:
+                spi.nout = 0
+                spi.nin = 0
+            self.load_bytes = 0
+            self.ecc_corrected = 0
+            self.ecc_failed = 0
+        return s
+
+#   //ready() -- non blocking check of the operation in progress on the selected die.
+#   //Returns True once it is done, raises OSError(ETIMEDOUT) when its timeout is exceeded.
+    def ready(self):
+        d = self._dieSelect
+        op = self._pend[d]
+        if op == W25N_OP_NONE:
+            return True
+        self.status = self.getStatusReg(W25N_STAT_REG)
+        if self.status & W25N_STAT_BUSY:
+            if time.ticks_diff(time.ticks_us(), self._pstart[d]) > self.t_max[op]:
+                self._pend[d] = W25N_OP_NONE
+                raise OSError(errno.ETIMEDOUT)
+            return False
+        self._pend[d] = W25N_OP_NONE
+        self.checkFail(op, self._paddr[d])
+        return True
+
+#   //remaining() -- expected time in us until the operation on the selected die is done, 0 if overdue or idle
+    def remaining(self):
+        d = self._dieSelect
+        op = self._pend[d]
+        if op == W25N_OP_NONE:
+            return 0
+        return max(0, self.t_expect[op] - time.ticks_diff(time.ticks_us(), self._pstart[d]))
+
+#   //block_WIP() -- waits until the operation in progress on the selected die is done.
+#   //Returns at once if nothing was issued since the last wait. Short operations (page read)
+#   //are polled back to back, longer ones sleep for the expected time first and then poll
+#   //with a doubling interval, intervals of a millisecond or more use sleep_ms so other
+#   //threads can run. Raises OSError(ETIMEDOUT) when the operation timeout is exceeded.
+#   //The wait time is accumulated per operation in wait_count, wait_us and wait_max.
     def block_WIP(self):
-        #/Max WIP time is 10ms for block erase so 15 should be a max.
-        count = 0
-        while self.check_WIP():
-            time.sleep_ms(1)
-            count = count + 1
-            if count > 15:
-                return 1
+        d = self._dieSelect
+        op = self._pend[d]
+        if op == W25N_OP_NONE:
+            return 0
+        start = self._pstart[d]
+        entry = time.ticks_us()
+        delay = self.t_expect[op] - time.ticks_diff(entry, start)
+        if delay < W25N_T_POLL[op]:
+            delay = W25N_T_POLL[op]
+        while True:
+            if delay >= 1000:
+                time.sleep_ms(delay // 1000)
+            elif delay:
+                time.sleep_us(delay)
+            self.status = self.getStatusReg(W25N_STAT_REG)
+            if not self.status & W25N_STAT_BUSY:
+                break
+            if time.ticks_diff(time.ticks_us(), start) > self.t_max[op]:
+                self._pend[d] = W25N_OP_NONE
+                raise OSError(errno.ETIMEDOUT)
+            delay = min(max(delay * 2, W25N_T_POLL[op]), W25N_T_POLL_MAX)
+        self._pend[d] = W25N_OP_NONE
+        waited = time.ticks_diff(time.ticks_us(), entry)
+        self.wait_count[op] += 1
+        self.wait_us[op] += waited
+        if waited > self.wait_max[op]:
+            self.wait_max[op] = waited
+        self.checkFail(op, self._paddr[d])
+        return 0
+
+#   //checkFail(op, pageAdd) -- checks the status of a finished program or erase for P-FAIL/E-FAIL.
+#   //A failed block is handed to the bad block manager (nandbbm) which remaps it and completes
+#   //the operation on the replacement block, without one OSError(EIO) is raised.
+#   //For a page data read the ECC bits are kept in ecc and counted (no extra bus transfer, the
+#   //status register was read by the busy poll), uncorrectable data is returned as read.
+    def checkFail(self, op, pageAdd):
+        if op == W25N_OP_READ:
+            e = (self.status & W25N_STAT_ECC) >> 4
+            self.ecc = e
+            if e:
+                self._eccnote(pageAdd, e)
+            return
+        if op == W25N_OP_PROG:
+            if not self.status & W25N_STAT_PFAIL:
+                return
+        elif op == W25N_OP_ERASE:
+            if not self.status & W25N_STAT_EFAIL:
+                return
+        else:
+            return
+        if self.bbm is None or self.bbm.busy:
+            raise OSError(errno.EIO)
+        d = self._dieSelect
+        self.bbm.failed(op, pageAdd)
+        self.remaps += 1
+        if self._dieSelect != d:
+            self.dieSelect(d)
+
+#   //readBBM(buf) -- reads the bad block LUT of the selected die into buf (4 bytes per entry:
+#   //logical block with the enable bit 15 and invalid bit 14, physical block)
+    def readBBM(self, buf):
+        self.block_WIP()
+        self._buf[0] = W25N_READ_BBM
+        self._buf[1] = 0x00
+        self._cs(0)
+        self._spi.write(self._bufv[2])
+        self._spi.readinto(buf)
+        self._cs(1)
+        return buf
+
+#   //linkBlock(lba, pba) -- adds a link to the bad block LUT of the selected die, accesses to
+#   //block lba (within the die) go to block pba from now on. The LUT is non volatile.
+    def linkBlock(self, lba, pba):
+        self.block_WIP()
+        self.writeEnable()
+        c = self._cmdbuf
+        c[0] = W25N_BB_MANAGE
+        c[1] = (lba >> 8) & 0xFF
+        c[2] = lba & 0xFF
+        c[3] = (pba >> 8) & 0xFF
+        c[4] = pba & 0xFF
+        self._cs(0)
+        self._spi.write(self._cmdv[5])
+        self._cs(1)
+        self.started(W25N_OP_LINK)
+        return 0
+
+#   //block_WIP_all() -- waits for the operations running on every die, the first die is selected on return
+    def block_WIP_all(self):
+        for d in range(self.dies - 1, -1, -1):
+            if self._pend[d] != W25N_OP_NONE:
+                if d != self._dieSelect:
+                    self.dieSelect(d)
+                self.block_WIP()
+        if self._dieSelect != 0:
+            self.dieSelect(0)
         return 0
 
 #   //check_Status() -- returns status register value
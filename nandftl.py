@@ -0,0 +1,556 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Log structured page mapped block device for W25N flash
+#  *
+#  * Writes are appended to pre-erased pages of an open block instead of
+#  * rewriting the whole erase block, the logical to physical page map is
+#  * kept in RAM and rebuilt at mount from the tags stored in the spare area
+#  * of every programmed page. Stale pages are reclaimed by an incremental
+#  * garbage collector.
+#  */
+
+import errno
+import struct
+import time
+import micropython
+from pyb import Timer
+from array import array
+from micropython import const
+from nandflash import W25N_SPARE_USER, spareSum
+
+# block states
+_B_FREE     = const(0)   # erased, ready to be opened
+_B_DIRTY    = const(1)   # no valid pages, needs erase
+_B_USED     = const(2)   # closed, holds valid pages
+_B_OPEN     = const(3)   # current write block
+
+# spare area tag (W25N.readSpare/loadSpare user bytes): lpn, block sequence and the check of both
+_TAG_SEQ    = const(4)
+_TAG_CHECK  = const(8)
+_BLANK      = const(0xFFFFFFFF)
+
+_GC_RESERVE = const(1)   # blocks kept back so the collector can always relocate
+
+
+def _array(typecode, n, value):
+    chunk = array(typecode, [value] * 64)
+    a = array(typecode)
+    for i in range(n // 64):
+        a.extend(chunk)
+    for i in range(n % 64):
+        a.append(value)
+    return a
+
+
+class NandFTL:
+    def __init__(self, flash, blocksize = 512, start = 0, size = 0, reserve = 8, debug = False):
+        self.debug = debug
+        self.flash = flash
+        self.write_count = 0
+        self.blocksize = blocksize
+        self.f_sectorsize = flash.sector_Size()
+        self.f_pagesize = flash.page_Size()
+        self.f_sectorpages = self.f_sectorsize // self.f_pagesize
+        if size == 0:
+            size = flash.flash_Size() // self.f_sectorsize - start
+        if reserve < _GC_RESERVE + 1 or reserve >= size:
+            raise ValueError("bad reserve")
+        self.nblocks = size
+        self.base = start * self.f_sectorpages
+        self.pages = size * self.f_sectorpages
+        self.lpages = (size - reserve) * self.f_sectorpages
+        self.f_size = self.lpages * self.f_pagesize
+        if self.pages < 0xFFFF:
+            self._none = 0xFFFF
+            self._l2p = _array('H', self.lpages, 0xFFFF)
+        else:
+            self._none = -1
+            self._l2p = _array('i', self.lpages, -1)
+        self._valid = _array('H', size, 0)
+        self._bseq = _array('i', size, 0)
+        self._state = bytearray(size)
+        self._nfree = size
+        self._seq = 0
+        self._wblk = -1
+        self._wpg = 0
+        self._next = 0
+        self._victim = -1
+        self._vpg = 0
+        self.pg_arr = bytearray(self.f_pagesize)
+        self.pg_mem = memoryview(self.pg_arr)
+        self.wb_arr = bytearray(self.f_pagesize)
+        self.wb_mem = memoryview(self.wb_arr)
+        self._wlpn = -1
+        self._wmask = 0
+        self._full = (1 << (self.f_pagesize // blocksize)) - 1 if blocksize < self.f_pagesize else 1
+        self._ff = memoryview(b'\xff' * self.f_pagesize)
+        self._tag = bytearray(b'\xff' * W25N_SPARE_USER)
+        # partly trimmed pages, logical page -> bitmap of the trimmed blocks (blocks smaller than a page)
+        self._trim = {}
+        # background collection (see background()), _busy counts the block device calls in progress
+        self.idle_ms = 0
+        self.slice_us = 0
+        self.gc_watermark = 4
+        self._busy = 0
+        self._lastio = time.ticks_ms()
+        self._bgdone = False
+        self._timer = None
+        self._idleref = self.idle
+        self.bg_steps = 0
+        self.bg_error = None
+        self.mount()
+
+#   /* mount() -- rebuilds the page map from the spare area tags, only the spare user bytes are read.
+#    * Pages are appended in order inside a block, so the scan of a block stops
+#    * at the first blank page. When a logical page is found twice the copy in
+#    * the block with the higher sequence number, or the later page, wins.
+#    * Pages with a tag failing its check (interrupted program) are skipped.
+
+    def mount(self):
+        ppb = self.f_sectorpages
+        none = self._none
+        for b in range(self.nblocks):
+            self._valid[b] = 0
+        for i in range(self.lpages):
+            self._l2p[i] = none
+        self._trim.clear()
+        for b in range(self.nblocks):
+            lpn, seq = self._readtag(b * ppb)
+            if seq == _BLANK:
+                self._setstate(b, _B_DIRTY)
+                continue
+            self._bseq[b] = seq
+            if seq > self._seq:
+                self._seq = seq
+            for i in range(ppb):
+                if i:
+                    lpn = self._readtag(b * ppb + i)[0]
+                if lpn == _BLANK:
+                    break
+                if lpn >= self.lpages or not self._tagok():
+                    continue
+                old = self._l2p[lpn]
+                if old != none and self._bseq[old // ppb] > seq:
+                    continue
+                self._map(lpn, b * ppb + i)
+            self._setstate(b, _B_USED)
+        for b in range(self.nblocks):
+            if self._state[b] == _B_USED and self._valid[b] == 0:
+                self._setstate(b, _B_DIRTY)
+        self._wblk = -1
+        self._victim = -1
+        if self.debug:
+            print("ftl mounted seq {} free {}".format(self._seq, self.free_blocks()))
+
+#   /* format() -- erases the partition and clears the page map
+
+    def format(self):
+        ppb = self.f_sectorpages
+        for b in range(self.nblocks):
+            self.flash.blockErase(self.base + b * ppb)
+            self._setstate(b, _B_FREE)
+            self._valid[b] = 0
+            self._bseq[b] = 0
+        self.flash.block_WIP_all()
+        for i in range(self.lpages):
+            self._l2p[i] = self._none
+        self._trim.clear()
+        self._seq = 0
+        self._wblk = -1
+        self._victim = -1
+        self._wlpn = -1
+
+#   /* _readtag(ppn) -- reads the tag of page ppn, returns lpn and block sequence. The page stays in the data buffer.
+
+    def _readtag(self, ppn):
+        self.flash.readSpare(self.base + ppn, self._tag)
+        return struct.unpack_from('<I', self._tag, 0)[0], struct.unpack_from('<I', self._tag, _TAG_SEQ)[0]
+
+#   /* _tagok() -- True if the check of the tag read last matches, tags written without a check pass
+
+    def _tagok(self):
+        c = struct.unpack_from('>I', self._tag, _TAG_CHECK)[0]
+        return c == spareSum(self._tag, _TAG_CHECK) or c == _BLANK
+
+    def _map(self, lpn, ppn):
+        ppb = self.f_sectorpages
+        old = self._l2p[lpn]
+        if old != self._none:
+            b = old // ppb
+            self._valid[b] -= 1
+            if self._valid[b] == 0 and self._state[b] == _B_USED:
+                self._setstate(b, _B_DIRTY)
+        self._l2p[lpn] = ppn
+        self._valid[ppn // ppb] += 1
+
+    def _setstate(self, b, s):
+        if self._state[b] <= _B_DIRTY:
+            self._nfree -= 1
+        if s <= _B_DIRTY:
+            self._nfree += 1
+        self._state[b] = s
+
+    def free_blocks(self):
+        return self._nfree
+
+#   /* _open() -- takes the next free block as write block, erased blocks first.
+#    * Host writes keep _GC_RESERVE blocks back for the collector.
+
+    def _open(self, gc):
+        if not gc:
+            while self.free_blocks() <= _GC_RESERVE:
+                self._reclaim()
+            if self._wblk >= 0 and self._wpg < self.f_sectorpages:
+                return
+        if self._wblk >= 0:
+            self._setstate(self._wblk, _B_USED if self._valid[self._wblk] else _B_DIRTY)
+        blk = -1
+        n = self.nblocks
+        for i in range(n):
+            b = (self._next + i) % n
+            s = self._state[b]
+            if s == _B_FREE:
+                blk = b
+                break
+            if s == _B_DIRTY and blk < 0 and b != self._victim:
+                blk = b
+        if blk < 0:
+            raise OSError(errno.ENOSPC)
+        if self._state[blk] == _B_DIRTY:
+            self.flash.blockErase(self.base + blk * self.f_sectorpages)
+        self._next = (blk + 1) % n
+        self._seq += 1
+        self._bseq[blk] = self._seq
+        self._setstate(blk, _B_OPEN)
+        self._valid[blk] = 0
+        self._wblk = blk
+        self._wpg = 0
+        if self.debug:
+            print("ftl open block {} seq {}".format(blk, self._seq))
+
+    def _program(self, lpn, data, gc = False):
+        if self._wblk < 0 or self._wpg >= self.f_sectorpages:
+            self._open(gc)
+        ppn = self._wblk * self.f_sectorpages + self._wpg
+        self._wpg += 1
+        tag = self._tag
+        struct.pack_into('<I', tag, 0, lpn)
+        struct.pack_into('<I', tag, _TAG_SEQ, self._seq)
+        struct.pack_into('>I', tag, _TAG_CHECK, spareSum(tag, _TAG_CHECK))
+        self.flash.loadProgData(0, data, self.f_pagesize, self.base + ppn)
+        self.flash.loadSpare(tag)
+        self.flash.ProgramExecute(self.base + ppn)
+        self._map(lpn, ppn)
+
+#   /* gc_step() -- relocates at most one valid page of the current victim block.
+#    * The victim is the closed block with the fewest valid pages, once all of its
+#    * pages are moved it is erased and returned to the free pool.
+#    * Returns True while there is collection work left.
+
+    def gc_step(self):
+        ppb = self.f_sectorpages
+        if self._victim < 0:
+            victim = -1
+            best = ppb
+            for b in range(self.nblocks):
+                if self._state[b] == _B_USED and self._valid[b] < best:
+                    victim = b
+                    best = self._valid[b]
+            if victim < 0:
+                return False
+            self._victim = victim
+            self._vpg = 0
+        victim = self._victim
+        while self._vpg < ppb and self._valid[victim]:
+            ppn = victim * ppb + self._vpg
+            self._vpg += 1
+            lpn = self._readtag(ppn)[0]
+            if lpn < self.lpages and self._l2p[lpn] == ppn:
+                self.flash.read(0, self.pg_mem)
+                self._program(lpn, self.pg_mem, True)
+                return True
+        self.flash.blockErase(self.base + victim * ppb)
+        self._setstate(victim, _B_FREE)
+        self._victim = -1
+        if self.debug:
+            print("ftl collected block ", victim)
+        return True
+
+    def _canstep(self):
+        # background steps never take the block reserved for _reclaim
+        return (self._wblk >= 0 and self._wpg < self.f_sectorpages) or self._nfree > _GC_RESERVE
+
+    def _reclaim(self):
+        victim = self._victim
+        if victim < 0:
+            if not self.gc_step():
+                raise OSError(errno.ENOSPC)
+            victim = self._victim
+        while self._victim == victim and victim >= 0:
+            self.gc_step()
+
+#   /* collect(budget, watermark) -- background collection, moves up to budget pages while
+#    * the free pool is below the watermark. Erases dirty blocks ahead of use.
+#    * Returns the number of erases and page moves done, 0 if there was nothing to do.
+
+    def collect(self, budget = 4, watermark = 4):
+        left = budget
+        for b in range(self.nblocks):
+            if left <= 0:
+                return budget
+            if self._state[b] == _B_DIRTY and b != self._victim:
+                self.flash.blockErase(self.base + b * self.f_sectorpages)
+                self._setstate(b, _B_FREE)
+                left -= 1
+        while left > 0 and self._nfree < watermark and self._canstep():
+            if not self.gc_step():
+                break
+            left -= 1
+        return budget - left
+
+#   /* _enter() / _leave() -- start and end of a block device call, _leave restarts the idle time
+
+    def _enter(self):
+        self._busy += 1
+
+    def _leave(self):
+        self._busy -= 1
+        self._lastio = time.ticks_ms()
+        self._bgdone = False
+
+#   /* background(idle_ms, period_ms, slice_ms, timer, watermark) -- starts the background collection,
+#    * idle_ms = 0 stops it. Timer timer fires every period_ms and schedules idle(), which erases dirty
+#    * blocks and collects until watermark blocks are free, for up to slice_ms once no block device
+#    * call was made for idle_ms.
+
+    def background(self, idle_ms = 100, period_ms = 10, slice_ms = 2, timer = 6, watermark = 4):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        self.idle_ms = idle_ms
+        self.slice_us = slice_ms * 1000
+        self.gc_watermark = watermark
+        if idle_ms > 0:
+            self._timer = Timer(timer, freq = max(1, 1000 // period_ms), callback = self._tick)
+
+    def _tick(self, t):
+        try:
+            micropython.schedule(self._idleref, 0)
+        except RuntimeError:
+            pass
+
+#   /* idle(_) -- background collection for one time slice, one erase or page move at a time (collect),
+#    * run through micropython.schedule or called from a task. Skipped during a block device call and
+#    * until the device was idle for idle_ms. Returns True if there was work to do.
+#    * An error stops the background work and is kept in bg_error.
+
+    def idle(self, _ = None):
+        if self._busy or self._bgdone or time.ticks_diff(time.ticks_ms(), self._lastio) < self.idle_ms:
+            return False
+        self._busy += 1
+        start = time.ticks_us()
+        steps = 0
+        try:
+            while time.ticks_diff(time.ticks_us(), start) < self.slice_us:
+                if not self.collect(1, self.gc_watermark):
+                    self._bgdone = True
+                    break
+                steps += 1
+            self.bg_steps += steps
+            return steps > 0
+        except OSError as e:
+            self.bg_error = e
+            self.background(0)
+            return False
+        finally:
+            self._busy -= 1
+
+    def _fillwb(self):
+        if self._wmask == self._full:
+            return
+        ppn = self._l2p[self._wlpn]
+        bs = self.blocksize
+        if ppn == self._none:
+            for i in range(self.f_pagesize // bs):
+                if not self._wmask & (1 << i):
+                    self.wb_mem[i * bs:(i + 1) * bs] = self._ff[:bs]
+        else:
+            self.flash.pageDataRead(self.base + ppn)
+            for i in range(self.f_pagesize // bs):
+                if not self._wmask & (1 << i):
+                    self.flash.read(i * bs, self.wb_mem[i * bs:(i + 1) * bs])
+        self._wmask = self._full
+
+    def _flushwb(self):
+        if self._wlpn < 0:
+            return
+        self._fillwb()
+        self._program(self._wlpn, self.wb_mem)
+        self._wlpn = -1
+        self._wmask = 0
+
+    def readblocks(self, n, buf, offset = 0):
+        self._enter()
+        try:
+            self._readblocks(n, buf, offset)
+        finally:
+            self._leave()
+
+    def _readblocks(self, n, buf, offset):
+        buf = memoryview(buf)
+        ps = self.f_pagesize
+        pos = n * self.blocksize + offset
+        lenght = len(buf)
+        index = 0
+        if self.debug:
+            print("read {} at {} block {} offset {}".format(lenght, pos, n, offset))
+        while index < lenght:
+            lpn, col = (pos // ps, pos % ps)
+            chunk = min(ps - col, lenght - index)
+            pbuf = buf[index:index + chunk]
+            if lpn == self._wlpn:
+                self._fillwb()
+                pbuf[:] = self.wb_mem[col:col + chunk]
+            else:
+                ppn = self._l2p[lpn]
+                if ppn == self._none:
+                    pbuf[:] = self._ff[:chunk]
+                else:
+                    self.flash.pageDataRead(self.base + ppn)
+                    self.flash.read(col, pbuf)
+            pos += chunk
+            index += chunk
+
+    def writeblocks(self, n, buf, offset = 0):
+        self._enter()
+        try:
+            self._writeblocks(n, buf, offset)
+        finally:
+            self._leave()
+
+    def _writeblocks(self, n, buf, offset):
+        buf = memoryview(buf)
+        ps = self.f_pagesize
+        bs = self.blocksize
+        pos = n * bs + offset
+        lenght = len(buf)
+        index = 0
+        if self.debug:
+            print("write {} at {} block {} offset {}".format(lenght, pos, n, offset))
+        while index < lenght:
+            lpn, col = (pos // ps, pos % ps)
+            chunk = min(ps - col, lenght - index)
+            if lpn in self._trim:
+                self._untrim(lpn, col, chunk)
+            if chunk == ps:
+                if lpn == self._wlpn:
+                    self._wlpn = -1
+                    self._wmask = 0
+                self._program(lpn, buf[index:index + chunk])
+            else:
+                if lpn != self._wlpn:
+                    self._flushwb()
+                    self._wlpn = lpn
+                    self._wmask = 0
+                if col % bs or chunk % bs:
+                    self._fillwb()
+                else:
+                    for i in range(col // bs, (col + chunk) // bs):
+                        self._wmask |= 1 << i
+                self.wb_mem[col:col + chunk] = buf[index:index + chunk]
+            pos += chunk
+            index += chunk
+        self.write_count += 1
+        if self._nfree <= _GC_RESERVE + 1 and self._canstep():
+            self.gc_step()
+
+    def ioctl(self, op, arg):
+        self._enter()
+        try:
+            return self._ioctl(op, arg)
+        finally:
+            self._leave()
+
+    def _ioctl(self, op, arg):
+        if op == 4:  # MP_BLOCKDEV_IOCTL_BLOCK_COUNT
+            return self.f_size // self.blocksize
+        if op == 5:  # MP_BLOCKDEV_IOCTL_BLOCK_SIZE
+            return self.blocksize
+        if op == 6:  # MP_BLOCKDEV_IOCTL_BLOCK_ERASE
+            self.trim(arg)
+            return 0
+        if op == 3:  # MP_BLOCKDEV_IOCTL_SYNC
+            self._flushwb()
+            if self.debug:
+                print("sync")
+            return 0
+
+#   /* trim(n) -- drops block n from the page map. Blocks smaller than a page are collected in _trim,
+#    * the page is dropped once all of its blocks are trimmed. A write takes its blocks out again.
+
+    def trim(self, n):
+        ps = self.f_pagesize
+        if self.blocksize < ps:
+            per = ps // self.blocksize
+            lpn = n // per
+            if lpn >= self.lpages:
+                return
+            mask = self._trim.get(lpn, 0) | 1 << (n % per)
+            if mask != self._full:
+                self._trim[lpn] = mask
+                return
+            del self._trim[lpn]
+            self._drop(lpn)
+            return
+        ratio = self.blocksize // ps
+        for lpn in range(n * ratio, min((n + 1) * ratio, self.lpages)):
+            self._drop(lpn)
+
+#   /* _untrim(lpn, col, chunk) -- blocks of page lpn written from column col on for chunk bytes are live again
+
+    def _untrim(self, lpn, col, chunk):
+        bs = self.blocksize
+        mask = self._trim[lpn]
+        for i in range(col // bs, (col + chunk + bs - 1) // bs):
+            mask &= ~(1 << i)
+        if mask:
+            self._trim[lpn] = mask
+        else:
+            del self._trim[lpn]
+
+    def _drop(self, lpn):
+        if lpn == self._wlpn:
+            self._wlpn = -1
+            self._wmask = 0
+        if self._l2p[lpn] != self._none:
+            self._unmap(lpn)
+
+    def _unmap(self, lpn):
+        ppn = self._l2p[lpn]
+        b = ppn // self.f_sectorpages
+        self._valid[b] -= 1
+        if self._valid[b] == 0 and self._state[b] == _B_USED:
+            self._setstate(b, _B_DIRTY)
+        self._l2p[lpn] = self._none
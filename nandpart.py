@@ -0,0 +1,166 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Partitions of one W25N sharing a cache and a lock
+#  *
+#  * Every NandBdev allocates its own cache (128k per erase block slot) and calls
+#  * the chip on its own. NandPartitions holds one NandCache for all partitions of
+#  * the chip, slots go to the partition that needs them in least recently used
+#  * order (a dirty slot of another partition is written back by its owner first),
+#  * and one lock taken for every block device call, so the partitions can be used
+#  * from several threads. The background work of all partitions runs from one timer
+#  * (background()), a partition skips its slice while another one holds the lock. The cache keys are flash erase
+#  * blocks (pages in copy back mode), so one pool serves the partitions of one chip only.
+#  *
+#  *   parts = NandPartitions(W25N(spi, cs), cache_size = 131072)
+#  *   cfg = parts.add(start = 256, size = 16)
+#  *   log = parts.add(start = 272, size = 1024)
+#  */
+
+import micropython
+from pyb import Timer
+from nandcache import NandCache
+from nandbdev import NandBdev
+try:
+    from _thread import allocate_lock
+except ImportError:
+    allocate_lock = None
+
+
+#   /* _Lock -- lock for ports without _thread, keeps the scheduled background work of one partition
+#    * out of a block device call of another one. Without threads the holder can't run while another
+#    * caller waits, a blocking acquire of a held lock raises RuntimeError instead of waiting forever.
+
+class _Lock:
+    def __init__(self):
+        self.held = False
+
+    def acquire(self, waitflag = 1, timeout = -1):
+        if self.held:
+            if waitflag:
+                raise RuntimeError("partition lock held")
+            return False
+        self.held = True
+        return True
+
+    def release(self):
+        self.held = False
+
+
+class NandPartitions:
+    def __init__(self, flash, cache_size = 131072, debug = False):
+        self.debug = debug
+        self.flash = flash
+        sectorsize = flash.sector_Size()
+        # a pool smaller than an erase block holds pages, the partitions then run in copy back mode
+        slot = sectorsize if cache_size >= sectorsize else flash.page_Size()
+        self.cache = NandCache(cache_size, slot, flash.page_Size())
+        self.lock = allocate_lock() if allocate_lock is not None else _Lock()
+        self.parts = []
+        # flash erase blocks (start, end) used by every partition (NandBdev.physblocks), including reserved
+        # blocks. A partition uses exactly the blocks start to start + size, a striped one as well.
+        self._ranges = []
+        # background work of the partitions, see background()
+        self.idle_ms = 0
+        self.slice_ms = 2
+        self._timer = None
+        self._idleref = self.idle
+
+#   /* add(start, size, ...) -- creates the partition of size erase blocks at erase block start
+#    * (size = 0: to the end of the chip) on the shared cache and lock, further arguments go to
+#    * NandBdev. Raises ValueError if it overlaps a partition added before.
+
+    def add(self, start = 0, size = 0, blocksize = 512, stripe = False, readahead = 0, wear = False):
+        last = self.flash.flash_Size() // self.flash.sector_Size()
+        end = start + size if size else last
+        if start < 0 or end > last or end <= start:
+            raise ValueError("bad partition")
+        for (s, e) in self._ranges:
+            if start < e and s < end:
+                raise ValueError("partition overlaps")
+        # the mount scans of copy back and wear leveling use the chip
+        self.lock.acquire()
+        try:
+            bdev = NandBdev(self.flash, blocksize = blocksize, start = start, size = size, stripe = stripe,
+                            readahead = readahead, wear = wear, debug = self.debug, cache = self.cache, lock = self.lock)
+            self.parts.append(bdev)
+            self._ranges.append(bdev.physblocks())
+        finally:
+            self.lock.release()
+        if self.idle_ms:
+            bdev.background(self.idle_ms, slice_ms = self.slice_ms, timer = None)
+        return bdev
+
+#   /* remove(bdev) -- writes back the cached data of partition bdev and drops it from the pool
+
+    def remove(self, bdev):
+        bdev.ioctl(3, 0)
+        self.lock.acquire()
+        try:
+            cache = self.cache
+            for slot in range(cache.nslots):
+                if cache.owner[slot] is bdev:
+                    cache.discard(slot)
+            i = self.parts.index(bdev)
+            self.parts.pop(i)
+            self._ranges.pop(i)
+        finally:
+            self.lock.release()
+
+#   /* background(idle_ms, period_ms, slice_ms, timer) -- starts the background work of all partitions
+#    * (NandBdev.background) on one timer, idle_ms = 0 stops it. Timer timer fires every period_ms and
+#    * schedules idle(). Partitions added later join in.
+
+    def background(self, idle_ms = 100, period_ms = 10, slice_ms = 2, timer = 6):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+        self.idle_ms = idle_ms
+        self.slice_ms = slice_ms
+        for p in self.parts:
+            p.background(idle_ms, slice_ms = slice_ms, timer = None)
+        if idle_ms > 0:
+            self._timer = Timer(timer, freq = max(1, 1000 // period_ms), callback = self._tick)
+
+    def _tick(self, t):
+        try:
+            micropython.schedule(self._idleref, 0)
+        except RuntimeError:
+            pass
+
+#   /* idle(_) -- one time slice of background work for every partition with background work on,
+#    * each takes the shared lock without waiting. Returns True if there was work to do.
+
+    def idle(self, _ = None):
+        work = False
+        for p in self.parts:
+            if p.idle_ms and p.idle():
+                work = True
+        return work
+
+#   /* sync() -- writes back the dirty slots of all partitions
+
+    def sync(self):
+        for p in self.parts:
+            p.ioctl(3, 0)
@@ -0,0 +1,606 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# /*
+#  * Host side simulator of W25N SPI NAND flash for tests and benchmarks on CPython
+#  *
+#  * install() puts the MicroPython modules the driver imports (micropython, machine,
+#  * pyb) and the time.ticks_*/sleep_* functions in place, all running on a virtual
+#  * microsecond clock (SimClock). SimChip models a W25N01GV, W25N02GV or W25M02GV
+#  * package: the opcodes used by nandflash.py, NAND semantics (programs only clear
+#  * bits, erase sets 0xFF, partial program limit per page), busy times per die, the
+#  * bad block LUT and injected program/erase failures and ECC status. SimSPI and SimPin
+#  * replace machine.SPI and the chip select Pin and charge the bus time to the clock.
+#  * The same inputs always give the same simulated times.
+#  *
+#  *   import nandsim
+#  *   chip = nandsim.SimChip()
+#  *   nandsim.install(chip)
+#  *   from nandflash import W25N
+#  *   flash = W25N(nandsim.SimSPI(chip), nandsim.SimPin(chip))
+#  */
+
+import sys
+import time
+import mmap
+
+SIM_PAGE        = 2048
+SIM_SPARE       = 64
+SIM_FULL        = 2112      # page with spare area, size of the data buffer
+SIM_PPB         = 64        # pages per erase block
+SIM_LUT         = 20        # bad block LUT entries per die
+SIM_TICKS       = 0x3FFFFFFF
+
+# status register bits
+SIM_BUSY        = 0x01
+SIM_WEL         = 0x02
+SIM_EFAIL       = 0x04
+SIM_PFAIL       = 0x08
+SIM_LUTF        = 0x40
+
+# JEDEC device id -> dies, erase blocks per die
+SIM_PARTS = {
+    0xAA21: (1, 1024),      # W25N01GV
+    0xAE21: (1, 1024),      # W25N01KV
+    0xAA22: (1, 2048),      # W25N02GV
+    0xAA23: (1, 4096),      # W25N04KV
+    0xBB22: (2, 1024),      # W25M02GV
+}
+
+# data lines of the data phase of the buffer reads and program data loads
+SIM_DATA_LINES = {0x03: 1, 0x0B: 1, 0x3B: 2, 0x6B: 4, 0xEB: 4, 0x02: 1, 0x84: 1, 0x32: 4, 0x34: 4}
+
+clock = None
+
+
+class SimError(Exception):
+    pass
+
+
+#   /* SimClock -- virtual clock in microseconds. Time only moves when the bus transfers data or
+#    * the driver sleeps. Timers fire as the clock passes their period, callbacks queued with
+#    * micropython.schedule run when the program sleeps or calls idle().
+
+class SimClock:
+    def __init__(self):
+        self.us = 0
+        self.timers = []
+        self.pending = []
+
+    def ticks_us(self):
+        return self.us & SIM_TICKS
+
+    def ticks_ms(self):
+        return (self.us // 1000) & SIM_TICKS
+
+    def ticks_diff(self, a, b):
+        d = (a - b) & SIM_TICKS
+        if d & 0x20000000:
+            d -= 0x40000000
+        return d
+
+    def ticks_add(self, a, b):
+        return (a + b) & SIM_TICKS
+
+    def sleep_us(self, n):
+        self.advance(n)
+        self.run_scheduled()
+
+    def sleep_ms(self, n):
+        self.sleep_us(n * 1000)
+
+#   /* advance(us) -- moves the clock, firing the timers that come due on the way
+
+    def advance(self, us):
+        end = self.us + max(0, int(us))
+        while True:
+            due = None
+            for t in self.timers:
+                if t.next <= end and (due is None or t.next < due.next):
+                    due = t
+            if due is None:
+                break
+            self.us = max(self.us, due.next)
+            due.next += due.period
+            if due.cb is not None:
+                due.cb(due)
+        self.us = end
+
+    def schedule(self, f, arg):
+        if len(self.pending) >= 8:
+            raise RuntimeError("schedule queue full")
+        self.pending.append((f, arg))
+
+    def run_scheduled(self):
+        while self.pending:
+            f, arg = self.pending.pop(0)
+            f(arg)
+
+#   /* idle(ms) -- the program does something else for ms, timers fire and scheduled callbacks run
+
+    def idle(self, ms):
+        end = self.us + ms * 1000
+        while self.us < end:
+            step = end - self.us
+            for t in self.timers:
+                step = min(step, max(1, t.next - self.us))
+            self.advance(step)
+            self.run_scheduled()
+
+
+#   /* SimTimer -- pyb.Timer / machine.Timer on the SimClock, periodic only
+
+class SimTimer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, id = -1, **kwargs):
+        self.id = id
+        self.cb = None
+        self.period = 0
+        self.next = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, freq = None, period = None, mode = None, callback = None, **kwargs):
+        self.period = 1000000 // freq if freq else int(period or 1000) * 1000
+        self.next = clock.us + self.period
+        self.cb = callback
+        if self not in clock.timers:
+            clock.timers.append(self)
+
+    def callback(self, fun):
+        self.cb = fun
+
+    def deinit(self):
+        self.cb = None
+        if self in clock.timers:
+            clock.timers.remove(self)
+
+
+#   /* SimChip(devid, tRD, tPP, tBE, nop, bad, backing, contread, strict) -- one SPI NAND package.
+#    * devid selects the part (SIM_PARTS), tRD/tPP/tBE are the page read, program and erase
+#    * times in us, nop the partial programs allowed per page, bad a list of (die, block) with
+#    * a factory bad block marker (they also fail to erase). The array lives in an anonymous
+#    * memory map, or in the file backing (kept between runs). contread = False models parts
+#    * without continuous read mode. strict raises SimError on protocol errors (command while
+#    * busy, too many partial programs, a 512 byte sector programmed twice), else they are counted.
+
+class SimChip:
+    def __init__(self, devid = 0xAA21, tRD = 25, tPP = 250, tBE = 2000, nop = 4, bad = (),
+                 backing = None, contread = True, strict = True):
+        self.devid = devid
+        self.dies, self.blocks = SIM_PARTS[devid]
+        self.pages = self.blocks * SIM_PPB
+        self.tRD, self.tPP, self.tBE = tRD, tPP, tBE
+        self.nop = nop
+        self.contread = contread
+        self.strict = strict
+        # per die: page data, a programmed flag per page, the bad block LUT
+        self._dsize = self.pages * (SIM_FULL + 1) + 4 * SIM_LUT
+        size = self._dsize * self.dies
+        new = True
+        if backing is None:
+            self.mem = mmap.mmap(-1, size)
+        else:
+            try:
+                f = open(backing, 'r+b')
+                new = False
+            except OSError:
+                f = open(backing, 'w+b')
+            f.truncate(size)
+            self.mem = mmap.mmap(f.fileno(), size)
+            f.close()
+        self.nops = [bytearray(self.pages) for _ in range(self.dies)]
+        self.buf = [bytearray(b'\xff' * SIM_FULL) for _ in range(self.dies)]
+        self.busy = [0] * self.dies
+        self.status = bytearray(self.dies)
+        self.config = bytearray([0x18] * self.dies)
+        self.prot = bytearray([0x7C] * self.dies)
+        self.rdpage = [0] * self.dies
+        self.die = 0
+        self.fail_prog = set()
+        self.fail_erase = set()
+        self.ecc = {}
+        self.ecc_last = 0
+        self.ops = {'read': 0, 'prog': 0, 'erase': 0}
+        self.errors = {'busy': 0, 'nop': 0, 'sector': 0, 'bus': 0}
+        self._cmd = None
+        self._pos = 0
+        self._col = 0
+        for (d, blk) in bad:
+            if new:
+                self._program(d, blk * SIM_PPB, bytes(SIM_FULL))
+            self.fail_erase.add((d, blk))
+
+    def _base(self, d, page):
+        return d * self._dsize + page * SIM_FULL
+
+    def _flag(self, d, page):
+        return d * self._dsize + self.pages * SIM_FULL + page
+
+    def _lutbase(self, d):
+        return d * self._dsize + self.pages * (SIM_FULL + 1)
+
+#   /* page(d, page) -- contents of a page of die d with the spare area, bytes
+
+    def page(self, d, page):
+        if not self.mem[self._flag(d, page)]:
+            return b'\xff' * SIM_FULL
+        b = self._base(d, page)
+        return self.mem[b:b + SIM_FULL]
+
+    def _program(self, d, page, data):
+        b = self._base(d, page)
+        old = self.page(d, page)
+        for k in range(0, SIM_PAGE, 512):
+            if data[k:k + 512] != b'\xff' * 512 and old[k:k + 512] != b'\xff' * 512:
+                self._error('sector', "sector programmed twice, page {}".format(page))
+        new = (int.from_bytes(old, 'little') & int.from_bytes(data, 'little')).to_bytes(SIM_FULL, 'little')
+        self.mem[b:b + SIM_FULL] = new
+        self.mem[self._flag(d, page)] = 1
+
+    def _erase(self, d, block):
+        p = block * SIM_PPB
+        f = self._flag(d, p)
+        self.mem[f:f + SIM_PPB] = bytes(SIM_PPB)
+        self.nops[d][p:p + SIM_PPB] = bytes(SIM_PPB)
+        if self.ecc:
+            for i in range(p, p + SIM_PPB):
+                self.ecc.pop((d, i), None)
+
+    def badblocks(self, d):
+        b = self._lutbase(d)
+        raw = self.mem[b:b + 4 * SIM_LUT]
+        ent = {}
+        for i in range(0, len(raw), 4):
+            if raw[i] & 0x80:
+                ent[(raw[i] & 0x3F) << 8 | raw[i + 1]] = raw[i + 2] << 8 | raw[i + 3]
+        return ent
+
+    def _map(self, d, page):
+        blk = self.badblocks(d).get(page // SIM_PPB)
+        return page if blk is None else blk * SIM_PPB + page % SIM_PPB
+
+    def isbusy(self, d = None):
+        return clock.us < self.busy[self.die if d is None else d]
+
+    def _error(self, kind, msg):
+        self.errors[kind] += 1
+        if self.strict:
+            raise SimError(msg)
+
+    def _start(self, d, t):
+        self.busy[d] = clock.us + t
+
+    def _statreg(self, d):
+        v = self.status[d]
+        if self.isbusy(d):
+            v |= SIM_BUSY
+        if len(self.badblocks(d)) >= SIM_LUT:
+            v |= SIM_LUTF
+        return v
+
+#   /* SPI side: begin() and end() are called on chip select edges, feed() with the bytes
+#    * written and out(n) for n bytes read
+
+    def begin(self):
+        self._cmd = bytearray()
+        self._pos = 0
+
+    def feed(self, data):
+        c = self._cmd
+        if len(c) >= 3 and c[0] in (0x02, 0x84, 0x32, 0x34):
+            d = self.die
+            n = min(len(data), SIM_FULL - self._col)
+            self.buf[d][self._col:self._col + n] = data[:n]
+            self._col += n
+            return
+        for i in range(len(data)):
+            c.append(data[i])
+            if len(c) == 3 and c[0] in (0x02, 0x84, 0x32, 0x34):
+                self._load(c[0])
+                self.feed(data[i + 1:])
+                return
+
+    def _load(self, op):
+        d = self.die
+        if self.isbusy():
+            self._error('busy', "program data load while busy")
+        if op in (0x02, 0x32):
+            self.buf[d][:] = b'\xff' * SIM_FULL
+        self._col = self._cmd[1] << 8 | self._cmd[2]
+
+    def out(self, n):
+        c = self._cmd
+        d = self.die
+        op = c[0]
+        pos = self._pos
+        self._pos += n
+        if op == 0x9F:
+            ident = bytes((0xEF, self.devid >> 8, self.devid & 0xFF))
+            return bytes(ident[min(pos + i, 2)] for i in range(n))
+        if op in (0x0F, 0x05):
+            reg = c[1]
+            v = self._statreg(d) if reg == 0xC0 else self.config[d] if reg == 0xB0 else self.prot[d]
+            return bytes([v]) * n
+        if op == 0xA5:
+            b = self._lutbase(d)
+            raw = bytes(self.mem[b:b + 4 * SIM_LUT])
+            return (raw[pos:pos + n] + bytes(n))[:n]
+        if op == 0xA9:
+            v = self.ecc_last.to_bytes(2, 'big')
+            return (v[pos:] + bytes(n))[:n]
+        if op in (0x03, 0x0B, 0x3B, 0x6B, 0xEB):
+            if self.isbusy():
+                self._error('busy', "read while busy")
+            if self.config[d] & 0x08:
+                col = (c[1] << 8 | c[2]) + pos
+                return (bytes(self.buf[d][col:col + n]) + b'\xff' * n)[:n]
+            # continuous read: main areas of the following pages from the page read on, the
+            # ECC bits keep the worst status of the pages streamed (11 if any page failed)
+            res = bytearray()
+            while len(res) < n:
+                p = self.rdpage[d] + (pos + len(res)) // SIM_PAGE
+                col = (pos + len(res)) % SIM_PAGE
+                k = min(n - len(res), SIM_PAGE - col)
+                res += self.page(d, self._map(d, p))[col:col + k] if p < self.pages else b'\xff' * k
+                ecc = self.ecc.get((d, self._map(d, p)), 0) if col == 0 and p < self.pages else 0
+                if ecc:
+                    if ecc >= 2:
+                        self.ecc_last = p
+                        ecc = 3
+                    self.status[d] = (self.status[d] & ~0x30) | (max(ecc, (self.status[d] >> 4) & 3) << 4)
+            return bytes(res)
+        return bytes(n)
+
+    def end(self):
+        c = self._cmd
+        self._cmd = None
+        if not c:
+            return
+        d = self.die
+        op = c[0]
+        if op == 0xFF:
+            self.busy[d] = 0
+            self.status[d] = 0
+            self._start(d, 5)
+            return
+        if op in (0x0F, 0x05, 0x9F):
+            return
+        if self.isbusy() and op != 0xC2:
+            self._error('busy', "command {:02x} while busy".format(op))
+            return
+        if op == 0x06:
+            self.status[d] |= SIM_WEL
+        elif op == 0x04:
+            self.status[d] &= ~SIM_WEL
+        elif op == 0xC2 and len(c) >= 2:
+            self.die = c[1] % self.dies
+        elif op in (0x1F, 0x01) and len(c) >= 3:
+            if c[1] == 0xA0:
+                self.prot[d] = c[2]
+            elif c[1] == 0xB0:
+                self.config[d] = c[2] if self.contread else c[2] | 0x08
+        elif op == 0xA1 and len(c) >= 5:
+            lut = self.badblocks(d)
+            if self.status[d] & SIM_WEL and len(lut) < SIM_LUT:
+                b = self._lutbase(d) + 4 * len(lut)
+                self.mem[b:b + 4] = bytes((c[1] & 0x3F | 0x80, c[2], c[3], c[4]))
+            self.status[d] &= ~SIM_WEL
+            self._start(d, 50)
+        elif op == 0x13 and len(c) >= 4:
+            page = c[1] << 16 | c[2] << 8 | c[3]
+            self.ops['read'] += 1
+            self.rdpage[d] = page
+            phys = self._map(d, page)
+            self.buf[d][:] = self.page(d, phys)
+            ecc = self.ecc.get((d, phys), 0)
+            self.status[d] = (self.status[d] & ~0x30) | (ecc << 4)
+            if ecc >= 2:
+                self.ecc_last = page
+            self._start(d, self.tRD)
+        elif op == 0x10 and len(c) >= 4:
+            page = self._map(d, c[1] << 16 | c[2] << 8 | c[3])
+            self.ops['prog'] += 1
+            if self.status[d] & SIM_WEL:
+                st = 0
+                if (d, page // SIM_PPB) in self.fail_prog:
+                    st = SIM_PFAIL
+                else:
+                    self.nops[d][page] += 1
+                    if self.nops[d][page] > self.nop:
+                        self._error('nop', "partial program limit exceeded, page {}".format(page))
+                    self._program(d, page, self.buf[d])
+                self.status[d] = (self.status[d] & ~(SIM_PFAIL | SIM_EFAIL | SIM_WEL)) | st
+            self._start(d, self.tPP)
+        elif op == 0xD8 and len(c) >= 4:
+            block = self._map(d, c[1] << 16 | c[2] << 8 | c[3]) // SIM_PPB
+            self.ops['erase'] += 1
+            if self.status[d] & SIM_WEL:
+                st = 0
+                if (d, block) in self.fail_erase:
+                    st = SIM_EFAIL
+                else:
+                    self._erase(d, block)
+                self.status[d] = (self.status[d] & ~(SIM_PFAIL | SIM_EFAIL | SIM_WEL)) | st
+            self._start(d, self.tBE)
+
+
+#   /* SimSPI(chip, baudrate, lines) -- machine.SPI on a SimChip, every byte costs 8 clock cycles of bus time.
+#    * chip can be a list of SimChips sharing the bus, a transfer goes to the chip selected by its SimPin.
+#    * With lines = 2 or 4 it is a dual/quad bus: write(buf, lines) and readinto(buf, write, lines) move
+#    * lines bits per clock. cycles counts the bus clocks.
+
+class SimSPI:
+    def __init__(self, chip, baudrate = 60000000, lines = 1, **kwargs):
+        self.chips = list(chip) if isinstance(chip, (list, tuple)) else [chip]
+        self.chip = self.chips[0]
+        self.baudrate = baudrate
+        self.lines = lines
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.cycles = 0
+        self._ns = 0
+
+    def init(self, baudrate = None, **kwargs):
+        if baudrate:
+            self.baudrate = baudrate
+
+    def _tick(self, n, lines = 1):
+        if lines > self.lines:
+            raise SimError("transfer on {} lines on a {} line bus".format(lines, self.lines))
+        clocks = n * 8 // lines
+        self.cycles += clocks
+        self._ns += clocks * 1000000000 // self.baudrate
+        clock.advance(self._ns // 1000)
+        self._ns %= 1000
+        if len(self.chips) > 1:
+            for c in self.chips:
+                if c._cmd is not None:
+                    self.chip = c
+                    break
+
+    def write(self, buf, lines = 1):
+        n = len(buf)
+        self.bytes_out += n
+        self._tick(n, lines)
+        c = self.chip._cmd
+        if c is not None and len(c) >= 3:
+            self._lines(c[0], lines)
+        self.chip.feed(bytes(buf))
+
+    def _lines(self, op, lines):
+        want = SIM_DATA_LINES.get(op)
+        if want is not None and want != lines:
+            self.chip._error('bus', "data of {:02x} on {} lines, expected {}".format(op, lines, want))
+
+    def read(self, nbytes, write = 0x00):
+        self.bytes_in += nbytes
+        self._tick(nbytes)
+        return self.chip.out(nbytes)
+
+    def readinto(self, buf, write = 0x00, lines = 1):
+        n = len(buf)
+        self.bytes_in += n
+        self._tick(n, lines)
+        if self.chip._cmd:
+            self._lines(self.chip._cmd[0], lines)
+        buf[:] = self.chip.out(n)
+
+    def write_readinto(self, wbuf, rbuf):
+        n = len(wbuf)
+        self.bytes_out += n
+        self.bytes_in += n
+        self._tick(n)
+        self.chip.feed(bytes(wbuf))
+        rbuf[:] = self.chip.out(n)
+
+
+#   /* SimPin(chip) -- chip select Pin of a SimChip, counts the transactions
+
+class SimPin:
+    OUT = 1
+    IN = 0
+
+    def __init__(self, chip = None, *args, **kwargs):
+        self.chip = chip if isinstance(chip, SimChip) else None
+        self.v = 1
+        self.transactions = 0
+
+    def __call__(self, v = None):
+        if v is None:
+            return self.v
+        if self.chip is not None:
+            if not v and self.v:
+                self.transactions += 1
+                self.chip.begin()
+            elif v and not self.v:
+                self.chip.end()
+        self.v = 1 if v else 0
+
+    def value(self, v = None):
+        return self(v)
+
+    def on(self):
+        self(1)
+
+    def off(self):
+        self(0)
+
+
+class _Module:
+    def __init__(self, name, **attrs):
+        self.__name__ = name
+        self.__dict__.update(attrs)
+
+
+#   /* install(chip) -- makes the driver importable on CPython: registers micropython, machine and
+#    * pyb modules and the MicroPython time functions, all on a new SimClock. machine.SPI() and
+#    * machine.Pin() created afterwards (as in nanddrive.py) are wired to chip. Returns the clock.
+
+def install(chip = None):
+    global clock
+    clock = SimClock()
+    sys.modules['micropython'] = _Module('micropython', const = lambda x: x, schedule = clock.schedule,
+                                         native = lambda f: f, viper = lambda f: f)
+    class Pin(SimPin):
+        def __init__(self, *args, **kwargs):
+            SimPin.__init__(self, chip)
+
+    sys.modules['machine'] = _Module('machine', SPI = lambda *a, **k: SimSPI(chip, **k),
+                                     SoftSPI = lambda *a, **k: SimSPI(chip, **k),
+                                     Pin = Pin, Timer = SimTimer)
+    sys.modules['pyb'] = _Module('pyb', Timer = SimTimer)
+    for name in ('ticks_us', 'ticks_ms', 'ticks_diff', 'ticks_add', 'sleep_us', 'sleep_ms'):
+        setattr(time, name, getattr(clock, name))
+    return clock
+
+
+#   /* demo: sequential write and read of a NandBdev partition on a simulated W25N01GV, in every bus
+#    * mode of W25N on a 4 line bus
+
+if __name__ == '__main__':
+    chip = SimChip()
+    install(chip)
+    sys.path.insert(0, __file__.rsplit('/', 1)[0] if '/' in __file__ else '.')
+    from nandflash import W25N, W25N_BUS_SPI, W25N_BUS_QUAD_IO
+    from nandbdev import NandBdev
+    data = bytearray(range(256)) * 2 * 64
+    for mode in range(W25N_BUS_SPI, W25N_BUS_QUAD_IO + 1):
+        chip = SimChip()
+        spi = SimSPI(chip, lines = 4)
+        flash = W25N(spi, SimPin(chip), bus = mode)
+        bdev = NandBdev(flash, start = 0, size = 64)
+        t = clock.us
+        for n in range(0, 8192, 64):
+            bdev.writeblocks(n, data)
+        bdev.ioctl(3, 0)
+        tw = clock.us - t
+        t = clock.us
+        c = spi.cycles
+        for n in range(0, 8192, 64):
+            bdev.readblocks(n, data)
+        tr = clock.us - t
+        print("bus mode {}: write 4MB: {:.0f} KB/s, read 4MB: {:.0f} KB/s, {}, bus {} out {} in, {} read clocks".format(
+            flash.bus, 4096 * 1e6 / tw, 4096 * 1e6 / tr, chip.ops, spi.bytes_out, spi.bytes_in, spi.cycles - c))
@@ -0,0 +1,81 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# allocation benchmark of the W25N command path, steady state page reads and
+# programs should report 0 bytes allocated. Uses the erase block at TEST_BLOCK,
+# which is erased by the test.
+
+import gc
+import time
+from machine import SPI, Pin
+from nandflash import W25N
+
+TEST_BLOCK = 1000
+LOOPS = 64
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+dev = W25N(spi, cs)
+
+page = TEST_BLOCK * 64
+buf = bytearray(2048)
+mv = memoryview(buf)
+
+def page_read(i):
+    dev.pageDataRead(page + (i & 63))
+    dev.read(0, mv)
+
+def page_program(i):
+    dev.loadProgData(0, mv, 2048)
+    dev.ProgramExecute(page + (i & 63))
+
+def status_poll(i):
+    dev.block_WIP()
+
+def measure(name, fn):
+    fn(0)
+    gc.collect()
+    gc.disable()
+    before = gc.mem_alloc()
+    start = time.ticks_us()
+    i = 0
+    while i < LOOPS:
+        fn(i)
+        i += 1
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    allocated = gc.mem_alloc() - before
+    gc.enable()
+    print("{:14} {:6} bytes allocated in {} calls, {} us per call".format(name, allocated, LOOPS, elapsed // LOOPS))
+    return allocated
+
+dev.blockErase(page)
+dev.block_WIP()
+for i in range(2048):
+    buf[i] = i & 0xFF
+
+total = 0
+total += measure("page program", page_program)
+total += measure("page read", page_read)
+total += measure("status poll", status_poll)
+
+print("steady state allocation {} bytes: {}".format(total, "OK" if total == 0 else "FAIL"))
@@ -0,0 +1,102 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+
+# striped array benchmark: sequential 64 KB writes (synced at the end) and reads through
+# NandArray on 1, 2, ... chips sharing one SPI bus, one JSON line per chip count with
+# the throughput and the speedup over one chip. The partition given by START/SIZE (in
+# erase blocks of every chip) is overwritten. On a PC the chips are nandsim SimChips on
+# one SimSPI (virtual time: bus transfers and busy flash only), run with the typical and the
+# maximum page program time of the datasheet (TPP).
+
+import sys
+import time
+import json
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip())
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandarray import NandArray
+
+START = 256
+SIZE = 64
+CHIPS = ('D5', 'D6', 'D7', 'D8')
+COUNTS = (1, 2, 4)
+BAUD = 60000000
+TPP = (250, 700) if SIM else (None,)
+BYTES = 4 * 1024 * 1024
+IO = 65536
+
+cs = [] if SIM else [Pin(p, Pin.OUT, value=1) for p in CHIPS]
+
+buf = bytearray(IO)
+for i in range(len(buf)):
+    buf[i] = i & 0xFF
+
+#   /* chips(count, tpp) -- W25N instances of the first count chips on one bus, simulated chips
+#    * program a page in tpp us
+
+def chips(count, tpp):
+    if SIM:
+        sims = [nandsim.SimChip(tPP = tpp) for _ in range(count)]
+        spi = nandsim.SimSPI(sims, baudrate = BAUD)
+        return [W25N(spi, nandsim.SimPin(c)) for c in sims]
+    spi = SPI(1, baudrate = BAUD)
+    return [W25N(spi, p) for p in cs[:count]]
+
+def bench(count, tpp):
+    flash = NandArray(chips(count, tpp), start = START, size = SIZE)
+    flash.stats(enable = True)
+    k = IO // 512
+    n = min(BYTES, flash.ioctl(4, 0) * 512) // IO
+    start = time.ticks_us()
+    for i in range(n):
+        flash.writeblocks(i * k, buf)
+    flash.ioctl(3, 0)
+    tw = max(1, time.ticks_diff(time.ticks_us(), start))
+    start = time.ticks_us()
+    for i in range(n):
+        flash.readblocks(i * k, buf)
+    tr = max(1, time.ticks_diff(time.ticks_us(), start))
+    st = flash.stats()
+    return {'chips': count, 'sim': SIM, 'tpp': tpp, 'bytes': n * IO,
+            'write_kbps': round(n * IO * 1000000 / tw / 1024, 1),
+            'read_kbps': round(n * IO * 1000000 / tr / 1024, 1),
+            'erases': sum(st['erases']), 'progs': sum(st['progs']),
+            'wait_us': st['wait_us']}
+
+for tpp in TPP:
+    base = None
+    for count in COUNTS:
+        if count > (8 if SIM else len(CHIPS)):
+            break
+        r = bench(count, tpp)
+        if base is None:
+            base = r
+        r['write_speedup'] = round(r['write_kbps'] / base['write_kbps'], 2)
+        r['read_speedup'] = round(r['read_kbps'] / base['read_kbps'], 2)
+        print(json.dumps(r))
@@ -0,0 +1,103 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# task latency benchmark: a sampler task asks to run every SAMPLE_MS while a
+# 2 MB file is copied to the nand filesystem, once with NandBdev (write back
+# blocks the scheduler) and once with AsyncNandBdev plus its flusher task.
+# The nand partition given by START/SIZE (in erase blocks) is reformatted by
+# the test.
+
+import os
+import time
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+from machine import SPI, Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+from nandasync import AsyncNandBdev
+
+START = 256
+SIZE = 64
+POINT = '/nandtest'
+COPY_SIZE = 2 * 1024 * 1024
+CHUNK = 4096
+SAMPLE_MS = 10
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+dev = W25N(spi, cs)
+
+chunk = bytearray(CHUNK)
+for i in range(CHUNK):
+    chunk[i] = i & 0xFF
+
+lat = []
+
+async def sampler():
+    while True:
+        t = time.ticks_ms()
+        await asyncio.sleep_ms(SAMPLE_MS)
+        lat.append(time.ticks_diff(time.ticks_ms(), t) - SAMPLE_MS)
+
+async def copy(flash):
+    f = open(POINT + '/copy.bin', 'wb')
+    done = 0
+    while done < COPY_SIZE:
+        f.write(chunk)
+        done += CHUNK
+        await asyncio.sleep_ms(0)
+    f.close()
+    if isinstance(flash, AsyncNandBdev):
+        await flash.flush()
+    else:
+        flash.ioctl(3, 0)
+
+async def run(flash):
+    s = asyncio.create_task(sampler())
+    w = None
+    if isinstance(flash, AsyncNandBdev):
+        w = asyncio.create_task(flash.flusher(SAMPLE_MS))
+    start = time.ticks_ms()
+    await copy(flash)
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    s.cancel()
+    if w is not None:
+        w.cancel()
+    return elapsed
+
+def bench(name, cls):
+    flash = cls(dev, start=START, size=SIZE)
+    os.VfsFat.mkfs(flash)
+    os.mount(os.VfsFat(flash), POINT)
+    lat.clear()
+    elapsed = asyncio.run(run(flash))
+    os.umount(POINT)
+    lat.sort()
+    n = len(lat)
+    print("{:14} copy {}Kb in {}ms, {} samples, latency p50 {}ms p99 {}ms max {}ms".format(
+        name, COPY_SIZE // 1024, elapsed, n, lat[n // 2], lat[n * 99 // 100], lat[-1]))
+
+bench("NandBdev", NandBdev)
+bench("AsyncNandBdev", AsyncNandBdev)
@@ -0,0 +1,105 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# bad block management across a chip erase: formats the partition given by START/SIZE (in erase
+# blocks) with nanddrive.start(bbm = True, clear = True), which erases the whole chip, mounts it
+# again and checks that the bad block table survived: the same bad blocks, driver remaps and LUT
+# links as before the erase. ERASES THE CHIP. On a PC the chip is a nandsim SimChip with factory
+# bad blocks in the user area (BAD) and the steps of nanddrive.start are run without a filesystem.
+# On the simulator the newest table copy is then torn (a program cut short) and made uncorrectable
+# (ECC), the mount must fall back to the copy before it.
+
+import sys
+
+SIM = sys.implementation.name != 'micropython'
+BAD = ((0, 100), (0, 700))
+if SIM:
+    import nandsim
+    chip = nandsim.SimChip(bad = BAD)
+    nandsim.install(chip)
+
+import os
+from machine import Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+from nandbbm import NandBBM
+import nanddrive as nand
+
+START = 256
+SIZE = 64
+POINT = '/nandbbm'
+
+#   /* mount(clear) -- mounts the partition with bad block management, after a chip erase if clear,
+#    * returns the W25N instance
+
+def mount(clear):
+    if SIM:
+        dev = W25N(nandsim.SimSPI(chip), nandsim.SimPin(chip))
+        NandBBM(dev)
+        if clear:
+            dev.bulkErase()
+            NandBdev(dev, start = START, size = SIZE).markerased()
+        return dev
+    flash = nand.start(point = POINT, st = START, sz = SIZE, bbm = True, clear = clear, fmt = clear)
+    os.umount(POINT)
+    return flash.flash
+
+def table(dev):
+    return bytes(dev.bbm.bad), dict(dev._bmap), dict(dev.bbm.links)
+
+before = table(mount(True))
+after = table(mount(False))
+bad = [b for b in range(len(before[0]) * 8) if before[0][b >> 3] & (1 << (b & 7))]
+print("bad blocks", bad, "remaps", before[1], "links", before[2])
+assert after == before, "bad block table lost by the chip erase"
+if SIM:
+    for d, b in BAD:
+        assert b in bad, "factory bad block {} not recorded".format(b)
+
+#   /* damage(dev, how) -- records one more bad block in a new table copy and damages that copy,
+#    * torn: the end of the page left erased, ecc: the chip reports it uncorrectable
+
+    def damage(dev, how):
+        bbm = dev.bbm
+        bbm.setbad(bbm.first - 1)
+        bbm.save()
+        p = bbm.table * bbm.ppb
+        if how == 'torn':
+            base = chip._base(dev.dieOnAdd(p), p % dev.diepages)
+            chip.mem[base + 20:base + 2048] = b'\xff' * 2028
+        else:
+            chip.ecc[(dev.dieOnAdd(p), p % dev.diepages)] = 2
+        return bbm.table
+
+    for how in ('torn', 'ecc'):
+        dev = mount(False)
+        good = table(dev)
+        older = dev.bbm.table
+        bad_copy = damage(dev, how)
+        dev = mount(False)
+        assert dev.bbm.table == older and table(dev) == good, "{} table copy trusted".format(how)
+        dev.bbm.save()
+        assert dev.bbm.table == bad_copy, "damaged copy not replaced"
+        assert table(mount(False)) == good
+        print(how, "table copy skipped")
+print("ok")
@@ -0,0 +1,191 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# workload benchmark: sequential and random reads and writes of 512 B, 4 KB and
+# 64 KB on NandBdev, then small files, append logging and directory operations
+# on VfsFat and VfsLfs2 mounted through nanddrive.start. Every workload prints one
+# JSON line with throughput (kbps), call latency (p50, p99, max in us), erases
+# per MB written, page programs and reads, SPI bytes per user byte and cache hit
+# rate, all from NandBdev.stats() (a directory operation counts as 512 bytes). The nand partition given by
+# START/SIZE (in erase blocks) is reformatted by the test. On a PC the driver
+# runs on nandsim (virtual time: bus transfers and busy flash only), filesystem
+# workloads need a MicroPython board.
+
+import os
+import sys
+import time
+import json
+from array import array
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip())
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+import nanddrive as nand
+
+START = 256
+SIZE = 64
+POINT = '/nandbench'
+CACHE = 131072
+READAHEAD = 0
+SEQ_BYTES = 1024 * 1024
+RAND_OPS = 256
+SIZES = (512, 4096, 65536)
+FILES = 64
+FILE_SIZE = 1024
+RECORD = 128
+RECORDS = 256
+DIRS = 32
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+_seed = [12345]
+
+def rand(n):
+    _seed[0] = (_seed[0] * 1103515245 + 12345) & 0x7FFFFFFF
+    return (_seed[0] >> 8) % n
+
+buf = bytearray(max(SIZES))
+for i in range(len(buf)):
+    buf[i] = i & 0xFF
+mv = memoryview(buf)
+
+#   /* measure(flash, name, fs, fn, n, nbytes, done) -- runs fn(i) n times, then done(), and prints
+#    * the results for nbytes of user data as a JSON line
+
+def measure(flash, name, fs, fn, n, nbytes, done = None):
+    flash.stats(True)
+    lat = array('i')
+    start = time.ticks_us()
+    for i in range(n):
+        t = time.ticks_us()
+        fn(i)
+        lat.append(time.ticks_diff(time.ticks_us(), t))
+    if done is not None:
+        done()
+    us = max(1, time.ticks_diff(time.ticks_us(), start))
+    st = flash.stats()
+    s = sorted(lat)
+    erases = sum(st['erases'])
+    lookups = st['cache_hits'] + st['cache_misses']
+    print(json.dumps({
+        'name': name, 'fs': fs, 'sim': SIM, 'ops': n, 'bytes': nbytes, 'us': us,
+        'kbps': round(nbytes * 1000000 / us / 1024, 1),
+        'p50': s[n // 2], 'p99': s[n * 99 // 100], 'max': s[-1],
+        'erases': erases, 'progs': sum(st['progs']), 'reads': sum(st['reads']),
+        'erases_per_mb': round(erases * 1048576 / nbytes, 2),
+        'spi_per_byte': round((st['spi_out'] + st['spi_in']) / nbytes, 3),
+        'cache_hit': round(st['cache_hits'] / lookups, 3) if lookups else 0,
+        'write_amp': round(st['write_amp'], 2)}))
+
+#   /* block device workloads
+
+def bench_bdev():
+    dev = W25N(spi, cs)
+    flash = NandBdev(dev, start = START, size = SIZE, cache_size = CACHE, readahead = READAHEAD)
+    flash.stats(enable = True)
+    nb = flash.ioctl(4, 0)
+    sync = lambda: flash.ioctl(3, 0)
+    for size in SIZES:
+        k = size // 512
+        n = min(SEQ_BYTES, nb * 512) // size
+        measure(flash, 'seq_write_{}'.format(size), 'bdev', lambda i: flash.writeblocks(i * k, mv[:size]), n, n * size, sync)
+        measure(flash, 'seq_read_{}'.format(size), 'bdev', lambda i: flash.readblocks(i * k, mv[:size]), n, n * size)
+    for size in SIZES[:2]:
+        k = size // 512
+        measure(flash, 'rand_write_{}'.format(size), 'bdev',
+                lambda i: flash.writeblocks(rand(nb // k) * k, mv[:size]), RAND_OPS, RAND_OPS * size, sync)
+        measure(flash, 'rand_read_{}'.format(size), 'bdev',
+                lambda i: flash.readblocks(rand(nb // k) * k, mv[:size]), RAND_OPS, RAND_OPS * size)
+    def append(i):
+        flash.writeblocks(nb // 2 + i, mv[:512])
+        flash.ioctl(3, 0)
+    measure(flash, 'append_sync_512', 'bdev', append, RECORDS, RECORDS * 512)
+
+#   /* filesystem workloads on a partition mounted by nanddrive.start
+
+def bench_fs(fs):
+    lfs = fs == 'lfs2'
+    flash = nand.start(point = POINT, fmt = True, st = START, sz = SIZE, LFS = lfs, cache = CACHE,
+                       readahead = READAHEAD, stats = True)
+    sync = os.sync if hasattr(os, 'sync') else lambda: flash.ioctl(3, 0)
+    name = POINT + '/seq.bin'
+    for size in SIZES:
+        n = SEQ_BYTES // size
+        f = open(name, 'wb')
+        measure(flash, 'fs_seq_write_{}'.format(size), fs, lambda i: f.write(mv[:size]), n, n * size,
+                lambda: (f.close(), sync()))
+        f = open(name, 'rb')
+        measure(flash, 'fs_seq_read_{}'.format(size), fs, lambda i: f.readinto(mv[:size]), n, n * size, f.close)
+    for size in SIZES[:2]:
+        f = open(name, 'r+b')
+        def write(i):
+            f.seek(rand(SEQ_BYTES // size) * size)
+            f.write(mv[:size])
+            f.flush()
+        measure(flash, 'fs_rand_write_{}'.format(size), fs, write, RAND_OPS, RAND_OPS * size, lambda: (f.close(), sync()))
+        f = open(name, 'rb')
+        def read(i):
+            f.seek(rand(SEQ_BYTES // size) * size)
+            f.readinto(mv[:size])
+        measure(flash, 'fs_rand_read_{}'.format(size), fs, read, RAND_OPS, RAND_OPS * size, f.close)
+    os.remove(name)
+    os.mkdir(POINT + '/small')
+    def create(i):
+        f = open('{}/small/f{}.txt'.format(POINT, i), 'wb')
+        f.write(mv[:FILE_SIZE])
+        f.close()
+    measure(flash, 'fs_small_files', fs, create, FILES, FILES * FILE_SIZE, sync)
+    def readsmall(i):
+        f = open('{}/small/f{}.txt'.format(POINT, i), 'rb')
+        f.readinto(mv[:FILE_SIZE])
+        f.close()
+    measure(flash, 'fs_small_read', fs, readsmall, FILES, FILES * FILE_SIZE)
+    f = open(POINT + '/log.txt', 'ab')
+    def append(i):
+        f.write(mv[:RECORD])
+        f.flush()
+        sync()
+    measure(flash, 'fs_append_sync_{}'.format(RECORD), fs, append, RECORDS, RECORDS * RECORD, f.close)
+    def dirs(i):
+        d = '{}/d{}'.format(POINT, i)
+        os.mkdir(d)
+        os.stat(d)
+        os.listdir(POINT)
+        os.rename(d, d + 'x')
+        if i & 1:
+            os.rmdir(d + 'x')
+    measure(flash, 'fs_dirs', fs, dirs, DIRS, DIRS * 512, sync)
+    os.umount(POINT)
+
+bench_bdev()
+for fs in ('fat', 'lfs2'):
+    if hasattr(os, 'VfsFat' if fs == 'fat' else 'VfsLfs2'):
+        bench_fs(fs)
+    else:
+        print(json.dumps({'name': 'skipped', 'fs': fs, 'sim': SIM}))
@@ -0,0 +1,117 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# copy back mode: fills the partition given by START/SIZE (in erase blocks, overwritten by the
+# test) through a cache smaller than an erase block, remounts and verifies it. Then rewrites one
+# page of a block in use and cuts the copy back short at every CUTS program (a lost supply, the
+# write back raises), mounts again and checks the block: before the scratch block is complete it
+# holds the old data, after it the mount finishes the copy back and it holds the new data.
+# On a PC the chip is a nandsim SimChip.
+
+import sys
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip())
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+
+START = 256
+SIZE = 16
+CACHE = 8192
+BLOCK = 3
+PAGE = 5
+CUTS = (1, 32, 64, 65, 80, 128)
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+class PowerLost(Exception):
+    pass
+
+#   /* page(n, ver) -- contents of version ver of partition page n
+
+def page(n, ver):
+    buf = bytearray([(n * 7 + ver * 91) & 0xFF]) * 2048
+    buf[0] = n & 0xFF
+    buf[1] = n >> 8
+    buf[2] = ver
+    return buf
+
+#   /* mount() -- a new W25N and copy back block device on the chip, as after a reset
+
+def mount():
+    bdev = NandBdev(W25N(spi, cs), start = START, size = SIZE, cache_size = CACHE)
+    assert bdev.copyback
+    return bdev
+
+#   /* check(bdev, ver) -- every page holds version 0, page n holds version ver[n] if given
+
+def check(bdev, ver = {}):
+    buf = bytearray(2048)
+    for n in range(bdev.ioctl(4, 0) // 4):
+        bdev.readblocks(n * 4, buf)
+        assert buf == page(n, ver.get(n, 0)), "page {} differs".format(n)
+
+bdev = mount()
+pages = bdev.ioctl(4, 0) // 4
+for n in range(pages):
+    bdev.writeblocks(n * 4, page(n, 0))
+bdev.ioctl(3, 0)
+check(mount())
+print("copy back partition of", pages, "pages written and remounted")
+
+n = BLOCK * 64 + PAGE
+ppb = 64
+for cut in CUTS:
+    bdev = mount()
+    flash = bdev.flash
+    program = flash.ProgramExecute
+    count = [0]
+
+    def cutoff(add):
+        count[0] += 1
+        if count[0] == cut:
+            raise PowerLost()
+        return program(add)
+
+    flash.ProgramExecute = cutoff
+    bdev.writeblocks(n * 4, page(n, 1))
+    try:
+        bdev.ioctl(3, 0)
+        raise SystemExit("copy back not cut at program {}".format(cut))
+    except PowerLost:
+        pass
+    bdev = mount()
+    new = cut > ppb
+    check(bdev, {n: 1} if new else {})
+    print("cut at program", cut, "block holds", "new data" if new else "old data")
+    # back to version 0 for the next cut
+    if new:
+        bdev.writeblocks(n * 4, page(n, 0))
+        bdev.ioctl(3, 0)
+check(mount())
+print("ok")
@@ -0,0 +1,105 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# NandFTL background collection and trim: fills the partition given by START/SIZE (in erase
+# blocks, reformatted by the test), rewrites pages until the free pool is low and trims 512 byte
+# blocks, then leaves the device idle with background() on and checks that the collector freed
+# blocks without a write, that fully trimmed pages were dropped from the map and that the data
+# reads back. On a PC the chip is a nandsim SimChip (virtual time).
+
+import sys
+import time
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip())
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandftl import NandFTL
+
+START = 256
+SIZE = 16
+RESERVE = 6
+WATERMARK = 4
+LOW = 3
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+_seed = [12345]
+
+def rand(n):
+    _seed[0] = (_seed[0] * 1103515245 + 12345) & 0x7FFFFFFF
+    return (_seed[0] >> 8) % n
+
+def wait(ms):
+    if SIM:
+        nandsim.clock.idle(ms)
+    else:
+        time.sleep_ms(ms)
+
+#   /* page(lpn, ver) -- contents of version ver of logical page lpn
+
+def page(lpn, ver):
+    buf = bytearray([(lpn * 31 + ver) & 0xFF]) * 2048
+    buf[0] = lpn & 0xFF
+    buf[1] = lpn >> 8
+    return buf
+
+ftl = NandFTL(W25N(spi, cs), start = START, size = SIZE, reserve = RESERVE)
+ftl.format()
+pages = ftl.ioctl(4, 0) // 4
+ver = [0] * pages
+for lpn in range(pages):
+    ftl.writeblocks(lpn * 4, page(lpn, 0))
+while ftl.free_blocks() > LOW:
+    lpn = rand(pages)
+    ver[lpn] += 1
+    ftl.writeblocks(lpn * 4, page(lpn, ver[lpn]))
+ftl.ioctl(3, 0)
+
+# all blocks of page 0 trimmed, three of page 1
+for n in range(4):
+    ftl.ioctl(6, n)
+for n in range(4, 7):
+    ftl.ioctl(6, n)
+assert ftl._l2p[0] == ftl._none, "trimmed page still mapped"
+assert ftl._l2p[1] != ftl._none, "partly trimmed page dropped"
+
+free = ftl.free_blocks()
+writes = ftl.write_count
+ftl.background(idle_ms = 20, watermark = WATERMARK)
+wait(2000)
+ftl.background(0)
+print("free blocks before", free, "after", ftl.free_blocks(), "background steps", ftl.bg_steps, ftl.bg_error)
+assert ftl.write_count == writes
+assert ftl.bg_error is None
+assert ftl.free_blocks() >= WATERMARK > free, "stale pages not collected"
+
+buf = bytearray(2048)
+for lpn in range(1, pages):
+    ftl.readblocks(lpn * 4, buf)
+    assert buf == page(lpn, ver[lpn]), "page {} differs".format(lpn)
+print("ok")
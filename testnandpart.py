@@ -0,0 +1,123 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# partitions on one pool: two partitions at START and START + SIZE (in erase blocks, overwritten
+# by the test) share the cache of a NandPartitions, once with erase block slots and once with page
+# slots (copy back mode). Random page writes go to both in turns, so slots move between the
+# partitions and dirty slots of one are written back for the other, every read is checked against
+# the data of its own partition, then the pool is rebuilt (a remount) and both are checked again.
+# Also checks that overlapping partitions, striped ones included, are refused. On a PC the chip is
+# a two die nandsim SimChip (W25M02GV).
+
+import sys
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip(0xBB22))
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandpart import NandPartitions
+
+START = 256
+SIZE = 16
+WRITES = 400
+POOLS = (262144, 8192)
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+_seed = [12345]
+
+def rand(n):
+    _seed[0] = (_seed[0] * 1103515245 + 12345) & 0x7FFFFFFF
+    return (_seed[0] >> 8) % n
+
+#   /* page(part, n, ver) -- contents of version ver of page n of partition part
+
+def page(part, n, ver):
+    buf = bytearray([(part * 101 + n * 7 + ver) & 0xFF]) * 2048
+    buf[0] = part
+    buf[1] = n & 0xFF
+    buf[2] = n >> 8
+    return buf
+
+#   /* mount(cache_size) -- a new pool with the two partitions, as after a reset
+
+def mount(cache_size):
+    parts = NandPartitions(W25N(spi, cs), cache_size = cache_size)
+    return parts, [parts.add(start = START, size = SIZE), parts.add(start = START + SIZE, size = SIZE)]
+
+def check(bdevs, ver):
+    buf = bytearray(2048)
+    for part in range(2):
+        for n in range(len(ver[part])):
+            bdevs[part].readblocks(n * 4, buf)
+            assert buf == page(part, n, ver[part][n]), "partition {} page {} differs".format(part, n)
+
+for cache_size in POOLS:
+    parts, bdevs = mount(cache_size)
+    pages = bdevs[0].ioctl(4, 0) // 4
+    ver = [[0] * pages, [0] * pages]
+    for n in range(pages):
+        for part in range(2):
+            bdevs[part].writeblocks(n * 4, page(part, n, 0))
+    buf = bytearray(2048)
+    for i in range(WRITES):
+        part = i & 1
+        n = rand(pages)
+        ver[part][n] += 1
+        bdevs[part].writeblocks(n * 4, page(part, n, ver[part][n]))
+        n = rand(pages)
+        bdevs[1 - part].readblocks(n * 4, buf)
+        assert buf == page(1 - part, n, ver[1 - part][n]), "partition {} page {} differs".format(1 - part, n)
+    check(bdevs, ver)
+    for bdev in bdevs:
+        bdev.ioctl(3, 0)
+    parts, bdevs = mount(cache_size)
+    check(bdevs, ver)
+    print("pool", cache_size, "copy back" if bdevs[0].copyback else "block cache", "partitions kept apart")
+
+for start, size in ((START + 8, 4), (START + 2 * SIZE - 1, 8)):
+    try:
+        parts.add(start = start, size = size)
+        raise SystemExit("overlap {} {} accepted".format(start, size))
+    except ValueError:
+        pass
+if parts.flash.dies > 1:
+    dblocks = parts.flash.diepages // 64
+    striped = parts.add(start = dblocks - 8, size = 16, stripe = True)
+    for start, size in ((dblocks - 10, 4), (dblocks + 4, 8)):
+        try:
+            parts.add(start = start, size = size)
+            raise SystemExit("overlap with the striped partition {} {} accepted".format(start, size))
+        except ValueError:
+            pass
+    try:
+        parts.add(start = START + 2 * SIZE, size = 16, stripe = True)
+        raise SystemExit("striped partition on one die accepted")
+    except ValueError:
+        pass
+    parts.remove(striped)
+print("ok")
@@ -0,0 +1,117 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# scrub: fills the partition given by START/SIZE (in erase blocks, overwritten by the test), marks
+# pages of two blocks as corrected by ECC (nandsim, the chip reports bit errors for them) and
+# reads the partition until those blocks reach THRESHOLD corrections, once a page at a time and
+# once with continuous reads (both must count the same corrections). The background work must refresh both blocks, a patrol must find
+# a weak block nobody reads, and the data must read back after a remount. Runs with and without
+# wear leveling. Needs nandsim to inject the bit errors, on a PC only.
+
+import sys
+
+SIM = sys.implementation.name != 'micropython'
+if not SIM:
+    raise SystemExit("testnandscrub needs nandsim")
+import nandsim
+chip = nandsim.SimChip()
+clock = nandsim.install(chip)
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+
+START = 256
+SIZE = 16
+THRESHOLD = 8
+WEAK = ((3, (5, 9)), (9, (0, 40, 63)))
+PATROL = 10
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+_seed = [12345]
+
+def rand(n):
+    _seed[0] = (_seed[0] * 1103515245 + 12345) & 0x7FFFFFFF
+    return (_seed[0] >> 8) % n
+
+#   /* weaken(bdev, block, pages) -- the chip reports corrected bit errors for pages of logical block block
+
+def weaken(bdev, block, pages):
+    flash = bdev.flash
+    base = bdev._pbase(bdev.f_first + block)
+    for p in pages:
+        chip.ecc[(flash.dieOnAdd(base + p), (base + p) % flash.diepages)] = 1
+
+for wear in (False, True):
+    counted = []
+    for pagewise in (True, False):
+        flash = W25N(spi, cs)
+        bdev = NandBdev(flash, start = START, size = SIZE, wear = wear)
+        nb = bdev.ioctl(4, 0)
+        ref = bytearray(rand(256) for _ in range(nb * 512))
+        for n in range(0, nb, 256):
+            bdev.writeblocks(n, memoryview(ref)[n * 512:(n + 256) * 512])
+        bdev.ioctl(3, 0)
+        for block, pages in WEAK:
+            weaken(bdev, block, pages)
+        # reads with a cache that can't hold the partition, so they go to flash
+        buf = bytearray(2048 if pagewise else nb * 512)
+        weak = [bdev._pbase(bdev.f_first + block) // 64 for block, pages in WEAK]
+        while min(flash.ecc_blocks.get(b, 0) for b in weak) < THRESHOLD:
+            bdev = NandBdev(flash, start = START, size = SIZE, wear = wear)
+            for n in range(0, nb, len(buf) // 512):
+                bdev.readblocks(n, buf)
+                assert buf == ref[n * 512:n * 512 + len(buf)], "block {} differs".format(n)
+        bdev.background(10, 10)
+        bdev.scrub(THRESHOLD)
+        clock.idle(2000)
+        s = bdev.stats()
+        counted.append(s['ecc_corrected'])
+        print("wear" if wear else "in place", "page reads" if pagewise else "continuous reads",
+              "scrubbed", s['scrub_blocks'], "errors", s['ecc_corrected'], bdev.bg_error)
+        assert bdev.bg_error is None
+        assert s['scrub_blocks'] >= len(WEAK), "weak blocks not scrubbed"
+        for b in weak:
+            assert bdev._sectorat(b) < 0 or flash.ecc_blocks.get(b, 0) < THRESHOLD, "block {} not refreshed".format(b)
+        bdev.background(0)
+
+        # a patrol finds the bit errors of a block nobody reads
+        bdev = NandBdev(flash, start = START, size = SIZE, wear = wear)
+        weaken(bdev, PATROL, (1,))
+        b = bdev._pbase(bdev.f_first + PATROL) // 64
+        bdev.background(10, 10)
+        bdev.scrub(1, patrol = 16)
+        clock.idle(3000)
+        s = bdev.stats()
+        assert s['patrol_pages'] and s['scrub_blocks'] >= 1, "patrol found nothing"
+        assert bdev._sectorat(b) < 0 or not flash.ecc_blocks.get(b, 0), "patrolled block not refreshed"
+        bdev.background(0)
+
+        bdev = NandBdev(W25N(spi, cs), start = START, size = SIZE, wear = wear)
+        buf = bytearray(nb * 512)
+        bdev.readblocks(0, buf)
+        assert buf == ref, "data lost by the scrub"
+    assert counted[0] == counted[1], "continuous reads counted other corrections"
+print("ok")
@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2024 Andre Botelho
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+
+# wear leveling: erases the partition given by START/SIZE (in erase blocks), fills it with
+# wear = True, rewrites a few hot blocks until relocations and cold data moves happened and
+# remounts: the map rebuilt from the spare tags, the erase counts and the data must match.
+# Then a write back is cut short (a lost supply, the write back raises) before and at the
+# tag page, the old block must stay mapped with the old data. On a PC the chip is a nandsim
+# SimChip.
+
+import sys
+
+SIM = sys.implementation.name != 'micropython'
+if SIM:
+    import nandsim
+    nandsim.install(nandsim.SimChip())
+
+from machine import SPI, Pin
+from nandflash import W25N
+from nandbdev import NandBdev
+
+START = 256
+SIZE = 16
+HOT = 3
+REWRITES = 600
+CUTS = (20, 64)
+
+spi = SPI(1, baudrate=60000000)
+cs = Pin('D5', Pin.OUT, value=1)
+
+class PowerLost(Exception):
+    pass
+
+#   /* block(n, ver) -- contents of version ver of logical erase block n
+
+def block(n, ver):
+    buf = bytearray([(n * 13 + ver) & 0xFF]) * 131072
+    buf[0] = n
+    buf[1] = ver & 0xFF
+    buf[2] = ver >> 8
+    return buf
+
+#   /* mount() -- a new W25N and wear leveled block device on the chip, as after a reset
+
+def mount():
+    return NandBdev(W25N(spi, cs), start = START, size = SIZE, wear = True)
+
+#   /* check(bdev, ver) -- logical block n holds version ver[n]
+
+def check(bdev, ver):
+    buf = bytearray(131072)
+    for n in range(len(ver)):
+        bdev.readblocks(n * 256, buf)
+        assert buf == block(n, ver[n]), "block {} differs".format(n)
+
+bdev = mount()
+for b in range(START, START + SIZE):
+    bdev.flash.blockErase(b * 64)
+    bdev.flash.block_WIP()
+bdev = mount()
+blocks = bdev.f_blocks
+ver = [0] * blocks
+for n in range(blocks):
+    bdev.writeblocks(n * 256, block(n, 0))
+bdev.ioctl(3, 0)
+for i in range(REWRITES):
+    n = i % HOT
+    ver[n] += 1
+    bdev.writeblocks(n * 256, block(n, ver[n]))
+    bdev.ioctl(3, 0)
+s = bdev.stats()
+print("relocations", s['wl_relocs'], "cold moves", s['wl_moves'], "erase counts", s['wl_min'], "-", s['wl_max'])
+assert s['wl_moves'] > 0, "no cold data moved"
+
+again = mount()
+assert list(again._l2p) == list(bdev._l2p), "map not rebuilt"
+assert list(again.wl_counts) == list(bdev.wl_counts), "erase counts not rebuilt"
+check(again, ver)
+print("map, erase counts and data survived the remount")
+
+n = HOT
+for cut in CUTS:
+    bdev = mount()
+    flash = bdev.flash
+    program = flash.ProgramExecute
+    count = [0]
+
+    def cutoff(add):
+        count[0] += 1
+        if count[0] == cut:
+            raise PowerLost()
+        return program(add)
+
+    flash.ProgramExecute = cutoff
+    mapped = bdev._l2p[n]
+    bdev.writeblocks(n * 256, block(n, ver[n] + 1))
+    try:
+        bdev.ioctl(3, 0)
+        raise SystemExit("write back not cut at program {}".format(cut))
+    except PowerLost:
+        pass
+    bdev = mount()
+    assert bdev._l2p[n] == mapped, "interrupted write back remapped the block"
+    check(bdev, ver)
+    print("cut at program", cut, "old block kept")
+print("ok")